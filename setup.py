@@ -11,6 +11,9 @@ requirements = ['requests', 'requests_oauthlib', 'typing', 'inflection',
 
 test_requirements = ['pytest', 'pytest-runner',]
 
+extras_requirements = {'async': ['aiohttp'], 'fastjson': ['orjson'],
+                       'export': ['pyarrow']}
+
 setup(name='statsbiblioteket.harvest',
       version='1.1.4rc',
         description="Harvest api client", long_description=readme,
@@ -21,6 +24,7 @@ setup(name='statsbiblioteket.harvest',
         packages=['statsbiblioteket.harvest', ],
         include_package_data=True,
         install_requires=requirements,
+        extras_require=extras_requirements,
 
         test_suite='tests',
         tests_require=test_requirements,
@@ -16,7 +16,8 @@ module_name = sys.modules[__name__]
 # Methods
 from statsbiblioteket.harvest.harvest \
     import \
-    Harvest
+    Harvest, \
+    AsyncHarvest
 
 # Types
 from statsbiblioteket.harvest.typesystem.harvest_types import \
@@ -0,0 +1,229 @@
+import asyncio
+import codecs
+import time
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp is an optional dependency
+    aiohttp = None
+
+from statsbiblioteket.harvest.http_cache import HttpCache
+from statsbiblioteket.harvest.metrics import endpoint_template, \
+    RESPONSE_BYTES, DECODE_SECONDS, RETRIES
+from statsbiblioteket.harvest.rest import Rest, HarvestError, HEADERS, \
+    STREAM_CHUNK_SIZE, logger
+from statsbiblioteket.harvest.streaming import JsonArrayDecoder
+
+
+class AsyncRest(Rest):
+    """
+    Asyncio variant of Rest, built on aiohttp.
+
+    All the endpoint methods of the mixins return coroutines when used with
+    this class, as they return the result of the internal _request method.
+    The url building and the decoding of the responses to harvest types are
+    shared with Rest. The iter_ methods return asynchronous generators.
+    """
+
+    def __init__(self, uri, email=None, password=None, client_id=None,
+                 token=None, max_connections=100, **kwargs):
+        """
+        Init method
+
+        :param max_connections: The maximum number of simultaneous
+        connections. The other keyword arguments are as for Rest, except that
+        the pool settings are not used
+        """
+        if aiohttp is None:
+            raise ImportError("The asyncio client requires aiohttp. Install "
+                              "it with 'pip install "
+                              "statsbiblioteket.harvest[async]'")
+        self.max_connections = max_connections
+        super(AsyncRest, self).__init__(uri, email, password, client_id,
+                                        token, **kwargs)
+
+    def _create_session(self):
+        """
+        The aiohttp session must be created from within the event loop, so
+        it is created by the first request
+        """
+        return None
+
+    def _get_session(self):
+        """
+        Internal method to get the aiohttp session, creating it if needed
+        """
+        if self._session is None or self._session.closed:
+            if self.auth == 'Basic':
+                auth = aiohttp.BasicAuth(self.email, self.password)
+                headers = HEADERS
+            else:
+                auth = None
+                headers = dict(HEADERS, Authorization='Bearer {token}'.format(
+                    token=self.token['access_token']))
+            if self.timeout is None:
+                timeout = aiohttp.ClientTimeout(total=None)
+            elif isinstance(self.timeout, tuple):
+                connect, read = self.timeout
+                timeout = aiohttp.ClientTimeout(total=None,
+                                                sock_connect=connect,
+                                                sock_read=read)
+            else:
+                timeout = aiohttp.ClientTimeout(total=None,
+                                                sock_connect=self.timeout,
+                                                sock_read=self.timeout)
+            connector = aiohttp.TCPConnector(limit=self.max_connections)
+            self._session = aiohttp.ClientSession(auth=auth, headers=headers,
+                                                  connector=connector,
+                                                  timeout=timeout)
+        return self._session
+
+    async def _request(self, method='GET', path='/', data=None, params=None):
+        """
+        Internal method to use the aiohttp library
+        """
+
+        url = self._url(path)
+
+        json_data = self._encode(data)
+
+        if params:
+            params = {key: str(value) for key, value in params.items()}
+
+        cached = await self._cache_io(self._cached, method, url, params)
+
+        async with await self._send(
+                method, url, data=json_data, params=params,
+                headers=HttpCache.conditional_headers(cached)) as resp:
+            content = await resp.read()
+            if resp.status >= 400:
+                message = '{status} {reason} for url: {url}'.format(
+                    status=resp.status, reason=resp.reason, url=resp.url)
+                raise HarvestError(message, content.decode('utf-8',
+                                                           errors='replace'))
+
+            status, content = await self._cache_io(
+                    self._revalidate, method, url, params, cached,
+                    resp.status, resp.headers, content)
+            endpoint = endpoint_template(path)
+            self.metrics.observe(RESPONSE_BYTES, len(content),
+                                 endpoint=endpoint)
+            start = time.perf_counter()
+            decoded = self._decode(method, status, resp.headers, content)
+            self.metrics.observe(DECODE_SECONDS, time.perf_counter() - start,
+                                 endpoint=endpoint)
+            return decoded
+
+    async def _cache_io(self, function, *args):
+        """
+        Internal method to call _cached or _revalidate. They read and write
+        the files of the http cache, so they run on the default executor
+        instead of blocking the event loop
+        """
+        if self.http_cache is None:
+            return function(*args)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, function, *args)
+
+    async def _send(self, method, url, **kwargs):
+        """
+        Internal method to send a request through the rate limiter, retrying
+        it when the rate limiter says so. See Rest._send
+        """
+        session = self._get_session()
+        endpoint = endpoint_template(url[len(self.uri):])
+        attempt = 0
+        while True:
+            wait = self.rate_limiter.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            start = time.perf_counter()
+            resp = await session.request(method, url, **kwargs)
+            self._record_response(method, endpoint, resp.status,
+                                  time.perf_counter() - start)
+            delay = self.rate_limiter.retry_delay(method, resp.status,
+                                                  resp.headers, attempt)
+            if delay is None:
+                return resp
+            logger.warning('%s %s returned %s, retrying in %.1f seconds',
+                           method, url, resp.status, delay)
+            self.metrics.increment(RETRIES, endpoint=endpoint)
+            resp.release()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _iter_get(self, path='/', params=None, paginated=False,
+                        page_size=None):
+        """
+        Internal method to GET a json list from a url, yielding the decoded
+        objects one at a time. See Rest._iter_get
+        """
+        params = dict(params or {})
+        page = 1
+        while True:
+            if paginated:
+                params['page'] = page
+            count = 0
+            async for harvest_object in self._stream(path, params):
+                count += 1
+                yield harvest_object
+            if not paginated or count == 0 or \
+                    (page_size is not None and count < page_size):
+                return
+            page += 1
+
+    async def _stream(self, path='/', params=None):
+        """
+        Internal method to GET a json list from a url, decoding the response
+        while it is read
+        """
+        url = self._url(path)
+
+        if params:
+            params = {key: str(value) for key, value in params.items()}
+
+        async with await self._send('GET', url, params=params) as resp:
+            if resp.status >= 400:
+                content = await resp.read()
+                message = '{status} {reason} for url: {url}'.format(
+                    status=resp.status, reason=resp.reason, url=resp.url)
+                raise HarvestError(message, content.decode('utf-8',
+                                                           errors='replace'))
+
+            text_decoder = codecs.getincrementaldecoder(
+                    resp.charset or 'utf-8')(errors='replace')
+            decoder = JsonArrayDecoder(object_hook=self._object_hook)
+            size = 0
+            decode_seconds = 0.0
+            async for chunk in resp.content.iter_chunked(STREAM_CHUNK_SIZE):
+                size += len(chunk)
+                start = time.perf_counter()
+                harvest_objects = decoder.feed(text_decoder.decode(chunk))
+                decode_seconds += time.perf_counter() - start
+                for harvest_object in harvest_objects:
+                    yield harvest_object
+            start = time.perf_counter()
+            harvest_objects = decoder.feed(
+                    text_decoder.decode(b'', final=True)) + decoder.close()
+            decode_seconds += time.perf_counter() - start
+            for harvest_object in harvest_objects:
+                yield harvest_object
+
+            endpoint = endpoint_template(path)
+            self.metrics.observe(RESPONSE_BYTES, size, endpoint=endpoint)
+            self.metrics.observe(DECODE_SECONDS, decode_seconds,
+                                 endpoint=endpoint)
+
+    async def close(self):
+        """
+        Close the underlying http session
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
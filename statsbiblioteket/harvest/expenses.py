@@ -12,6 +12,12 @@ class Expenses(Rest):
         """ expense categories property """
         return self._get('/expenses')
 
+    def iter_expenses(self) -> typing.Iterator[Expense]:
+        """
+        Iterate over the expenses, decoding them while the response is read
+        """
+        return self._iter_get('/expenses')
+
     def create_expense(self, new_expense_id, **kwargs):
         # TODO types
         """
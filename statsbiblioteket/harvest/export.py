@@ -0,0 +1,292 @@
+"""
+Columnar export of harvest objects to Arrow record batches and Parquet files.
+
+The schemas are derived from the column definitions of the harvest types, so
+the exported columns are the same as the columns of the backup database.
+"""
+import collections
+import itertools
+import logging
+import os
+import typing
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pyarrow is an optional dependency
+    pyarrow = None
+
+from sqlalchemy import Integer, Float, Boolean
+
+from statsbiblioteket.harvest.typesystem.conversion import converter
+from statsbiblioteket.harvest.typesystem.harvest_types import DayEntry, \
+    Expense, Invoice
+from statsbiblioteket.harvest.typesystem.orm_types import public_columns
+
+logger = logging.getLogger(__name__)
+
+EXPORT_BATCH_SIZE = 10000
+"""The number of rows per record batch"""
+
+PARTITION_FIELDS = {DayEntry: 'spent_at', Expense: 'spent_at',
+                    Invoice: 'issued_at'}
+"""The date field the parquet files of each type are partitioned by month on"""
+
+MAX_OPEN_MONTHS = 12
+"""The number of months write_parquet writes at a time"""
+
+EXPORT_TYPES = {'day_entries': DayEntry, 'expenses': Expense,
+                'invoices': Invoice}
+"""The exportable types, by table name"""
+
+
+def _require_pyarrow():
+    if pyarrow is None:
+        raise ImportError('The export needs pyarrow, install it with '
+                          '"pip install statsbiblioteket.harvest[export]"')
+
+
+def _arrow_type(column):
+    """
+    :param column: The sqlalchemy column
+    :return: the arrow type of the column
+    """
+    if isinstance(column.type, Boolean):
+        return pyarrow.bool_()
+    if isinstance(column.type, Integer):
+        return pyarrow.int64()
+    if isinstance(column.type, Float):
+        return pyarrow.float64()
+    return pyarrow.string()
+
+
+def _converter(column) -> typing.Callable:
+    """
+    :param column: The sqlalchemy column
+    :return: a function converting a json value to the python type of the
+    column, or to None if it cannot be converted. Harvest sometimes sends
+    numbers and booleans as strings
+    """
+    if isinstance(column.type, Boolean):
+        python_type = bool
+    elif isinstance(column.type, Integer):
+        python_type = int
+    elif isinstance(column.type, Float):
+        python_type = float
+    else:
+        python_type = str
+    convert_value = converter(python_type)
+
+    def convert(value):
+        try:
+            return convert_value(value)
+        except (TypeError, ValueError):
+            logger.debug('Exporting %r as null, as it is not a %s', value,
+                         python_type.__name__)
+            return None
+
+    return convert
+
+
+def arrow_schema(cls) -> 'pyarrow.Schema':
+    """
+    :param cls: The harvest type
+    :return: the arrow schema of the public columns of the type
+    """
+    _require_pyarrow()
+    return pyarrow.schema([pyarrow.field(key, _arrow_type(column))
+                           for key, column in public_columns(cls)])
+
+
+def record_batches(harvest_objects: typing.Iterable, cls,
+                   batch_size: int = EXPORT_BATCH_SIZE) -> \
+        typing.Iterator['pyarrow.RecordBatch']:
+    """
+    Convert harvest objects to arrow record batches, holding at most one
+    batch of objects in memory at a time
+
+    :param harvest_objects: The harvest objects or plain records, of type cls
+    :param cls: The harvest type
+    :param batch_size: The number of rows per batch
+    :return: a generator of record batches with the schema of cls
+    """
+    schema = arrow_schema(cls)
+    columns = public_columns(cls)
+    converters = [_converter(column) for _, column in columns]
+    iterator = iter(harvest_objects)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield _record_batch(batch, schema, columns, converters)
+
+
+def _record_batch(batch: typing.List, schema, columns, converters):
+    arrays = [pyarrow.array([convert(getattr(harvest_object, key, None))
+                             for harvest_object in batch],
+                            type=field.type)
+              for (key, _), convert, field in zip(columns, converters,
+                                                  schema)]
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _month(harvest_object, field: str) -> str:
+    value = getattr(harvest_object, field, None)
+    if not value:
+        return 'unknown'
+    return str(value)[:7]
+
+
+def write_parquet(harvest_objects: typing.Iterable, cls, directory: str,
+                  batch_size: int = EXPORT_BATCH_SIZE,
+                  max_open: int = MAX_OPEN_MONTHS) -> typing.Dict[str, int]:
+    """
+    Write harvest objects to parquet files, partitioned by the month of their
+    date field (see PARTITION_FIELDS), as
+    directory/month=YYYY-MM/part-N.parquet
+
+    At most max_open months are buffered and have an open writer. When the
+    input moves on to another month, the least recently written month is
+    flushed and closed, and if it comes back it is continued in the next part
+    file. Input sorted by the date field is written as one file per month.
+
+    Existing files of the same months are replaced, so export to an empty
+    directory to avoid mixing exports.
+
+    :param harvest_objects: The harvest objects or plain records, of type cls
+    :param cls: The harvest type
+    :param directory: The directory of the partitions
+    :param batch_size: The number of rows buffered per month before they are
+    written as a row group
+    :param max_open: The maximum number of months written at a time
+    :return: the number of rows written per month
+    """
+    schema = arrow_schema(cls)
+    columns = public_columns(cls)
+    converters = [_converter(column) for _, column in columns]
+    partition_field = PARTITION_FIELDS.get(cls)
+
+    # The open months, least recently written first
+    buffers = collections.OrderedDict()  # type: typing.Dict[str, typing.List]
+    writers = {}
+    parts = {}  # type: typing.Dict[str, int]
+    counts = {}  # type: typing.Dict[str, int]
+
+    def flush(month, rows):
+        if month not in writers:
+            month_directory = os.path.join(directory, 'month=' + month)
+            os.makedirs(month_directory, exist_ok=True)
+            part = 'part-{part}.parquet'.format(part=parts.get(month, 0))
+            writers[month] = pyarrow.parquet.ParquetWriter(
+                    os.path.join(month_directory, part), schema)
+        batch = _record_batch(rows, schema, columns, converters)
+        writers[month].write_table(pyarrow.Table.from_batches([batch]))
+
+    def close(month):
+        rows = buffers.pop(month)
+        if rows:
+            flush(month, rows)
+        writers.pop(month).close()
+        parts[month] = parts.get(month, 0) + 1
+
+    try:
+        for harvest_object in harvest_objects:
+            if partition_field is None:
+                month = 'unknown'
+            else:
+                month = _month(harvest_object, partition_field)
+            if month in buffers:
+                buffers.move_to_end(month)
+            else:
+                if len(buffers) >= max_open:
+                    close(next(iter(buffers)))
+                buffers[month] = []
+            buffers[month].append(harvest_object)
+            counts[month] = counts.get(month, 0) + 1
+            if len(buffers[month]) >= batch_size:
+                flush(month, buffers[month])
+                buffers[month] = []
+        for month in list(buffers):
+            close(month)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return counts
+
+
+def iter_timesheets(hrvst, from_date: str, to_date: str) -> \
+        typing.Iterator[DayEntry]:
+    """
+    Iterate over the timesheets of all the projects
+
+    :param hrvst: The Harvest client
+    :param from_date: The first day, YYYY-MM-DD
+    :param to_date: The last day, YYYY-MM-DD
+    :return: a generator of the day entries
+    """
+    for project in hrvst.projects():
+        yield from hrvst.iter_timesheets_for_project(project.id, from_date,
+                                                     to_date)
+
+
+def iter_expenses(hrvst, from_date: str, to_date: str) -> \
+        typing.Iterator[Expense]:
+    """
+    Iterate over the expenses of all the projects, spent between the dates
+
+    :param hrvst: The Harvest client
+    :param from_date: The first day, YYYY-MM-DD
+    :param to_date: The last day, YYYY-MM-DD
+    :return: a generator of the expenses
+    """
+    for project in hrvst.projects():
+        for expense in hrvst.iter_expenses_for_project(project.id):
+            if from_date <= (expense.spent_at or '') <= to_date:
+                yield expense
+
+
+def iter_invoices(hrvst, from_date: str, to_date: str) -> \
+        typing.Iterator[Invoice]:
+    """
+    Iterate over the invoices issued between the dates
+
+    :param hrvst: The Harvest client
+    :param from_date: The first day, YYYY-MM-DD
+    :param to_date: The last day, YYYY-MM-DD
+    :return: a generator of the invoices
+    """
+    return hrvst.iter_invoices(start_date=from_date, end_date=to_date)
+
+
+_EXPORT_SOURCES = {'day_entries': iter_timesheets, 'expenses': iter_expenses,
+                   'invoices': iter_invoices}
+
+
+def export(hrvst, directory: str, from_date: str, to_date: str,
+           tables: typing.Iterable[str] = tuple(EXPORT_TYPES),
+           batch_size: int = EXPORT_BATCH_SIZE) -> typing.Dict[str, int]:
+    """
+    Export harvest data to parquet files, as directory/<table>/month=YYYY-MM/
+
+    Use a client with records=True, as the objects are only read.
+
+    :param hrvst: The Harvest client
+    :param directory: The directory to export to
+    :param from_date: The first day, YYYY-MM-DD
+    :param to_date: The last day, YYYY-MM-DD
+    :param tables: The tables to export, from EXPORT_TYPES
+    :param batch_size: The number of rows per row group
+    :return: the number of rows exported per table
+    """
+    _require_pyarrow()
+    exported = {}
+    for table in tables:
+        cls = EXPORT_TYPES[table]
+        harvest_objects = _EXPORT_SOURCES[table](hrvst, from_date, to_date)
+        counts = write_parquet(harvest_objects, cls,
+                               os.path.join(directory, table),
+                               batch_size=batch_size)
+        exported[table] = sum(counts.values())
+        logger.info('Exported %d %s in %d months', exported[table], table,
+                    len(counts))
+    return exported
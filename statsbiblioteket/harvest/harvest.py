@@ -1,10 +1,13 @@
 import logging
 
+from statsbiblioteket.harvest.async_rest import AsyncRest
 from statsbiblioteket.harvest.clients import Clients
 from statsbiblioteket.harvest.contacts import Contacts
 from statsbiblioteket.harvest.expense_categories import ExpenseCategories
 from statsbiblioteket.harvest.expenses import Expenses
 from statsbiblioteket.harvest.invoices import Invoices
+from statsbiblioteket.harvest.memo import create_memo, memoized, invalidates, \
+    DEFAULT_SIZE
 from statsbiblioteket.harvest.projects import Projects
 from statsbiblioteket.harvest.task_assignments import TaskAssignments
 from statsbiblioteket.harvest.tasks import Tasks
@@ -16,20 +19,76 @@ class Harvest(Clients, Contacts, ExpenseCategories, Invoices, Users, Projects,
               Tasks, Timetracking, TaskAssignments, Expenses):
     """
     Harvest class to implement Harvest API
+
+    With memoize=True, get_client, get_project, get_task and get_user
+    remember their results for memo_ttl seconds (a number, or a dict from
+    'client', 'project', 'task' and 'user' to seconds), keeping at most
+    memo_size objects per entity. The memoized objects are shared between
+    callers, so treat them as read-only. Calling the update, delete and toggle
+    methods of this client forgets the changed object.
     """
 
     @classmethod
-    def oath(cls, uri, client_id, token):
-        return Harvest(uri=uri, client_id=client_id, token=token)
+    def oath(cls, uri, client_id, token, **kwargs):
+        """
+        Create a client with OAuth2 authentication.
+        The keyword arguments (rate_limiter, pool_connections, pool_maxsize,
+        max_retries, timeout, cache_dir, json_backend, records, metrics) are
+        passed on to Rest
+        """
+        return cls(uri=uri, client_id=client_id, token=token, **kwargs)
 
     @classmethod
-    def basic(cls, uri, email, password, put_auth_in_header=True):
-        return Harvest(uri=uri, email=email, password=password,
-                       put_auth_in_header=put_auth_in_header)
+    def basic(cls, uri, email, password, put_auth_in_header=True, **kwargs):
+        """
+        Create a client with basic authentication.
+        The keyword arguments (rate_limiter, pool_connections, pool_maxsize,
+        max_retries, timeout, cache_dir, json_backend, records, metrics) are
+        passed on to Rest
+        """
+        return cls(uri=uri, email=email, password=password,
+                   put_auth_in_header=put_auth_in_header, **kwargs)
 
     def __init__(self, uri, email=None, password=None, client_id=None,
-                 token=None, put_auth_in_header=True):
-        super(Harvest, self).__init__(uri, email, password, client_id, token)
+                 token=None, put_auth_in_header=True, memoize=False,
+                 memo_ttl=None, memo_size=DEFAULT_SIZE, **kwargs):
+        super(Harvest, self).__init__(uri, email, password, client_id, token,
+                                      **kwargs)
+        self._memo = create_memo(memo_ttl, memo_size) if memoize else None
+
+    def memo_stats(self):
+        """
+        The hit and miss counters of the memoized lookups
+
+        :return: a dict from entity name to a dict with hits, misses and size,
+        or an empty dict if memoization is not enabled
+        """
+        if self._memo is None:
+            return {}
+        return {entity: {'hits': cache.hits, 'misses': cache.misses,
+                         'size': len(cache)}
+                for entity, cache in self._memo.items()}
+
+    # Memoized lookups
+    get_client = memoized('client')(Clients.get_client)
+    update_client = invalidates('client')(Clients.update_client)
+    toggle_client_active = invalidates('client')(Clients.toggle_client_active)
+    delete_client = invalidates('client')(Clients.delete_client)
+
+    get_project = memoized('project')(Projects.get_project)
+    update_project = invalidates('project')(Projects.update_project)
+    toggle_project_active = invalidates('project')(
+            Projects.toggle_project_active)
+    delete_project = invalidates('project')(Projects.delete_project)
+
+    get_task = memoized('task')(Tasks.get_task)
+    update_task = invalidates('task')(Tasks.update_task)
+    delete_task = invalidates('task')(Tasks.delete_task)
+    activate_task = invalidates('task')(Tasks.activate_task)
+
+    get_user = memoized('user')(Users.get_user)
+    toggle_user_active = invalidates('user')(Users.toggle_user_active)
+    delete_user = invalidates('user')(Users.delete_user)
 
     # Accounts
     @property
@@ -83,3 +142,23 @@ class Harvest(Clients, Contacts, ExpenseCategories, Invoices, Users, Projects,
         return self._get('/account/who_am_i')
 
 
+class AsyncHarvest(Harvest, AsyncRest):
+    """
+    Asyncio variant of the Harvest class. It has the same methods as Harvest,
+    but they return coroutines, so many calls can run concurrently on one
+    event loop
+
+    ::
+
+        async with AsyncHarvest.basic(uri, email, password) as hrvst:
+            timesheets = await asyncio.gather(*[
+                hrvst.timesheets_for_project(project.id, start, end)
+                for project in await hrvst.projects()])
+    """
+
+    def __init__(self, uri, email=None, password=None, client_id=None,
+                 token=None, put_auth_in_header=True, **kwargs):
+        AsyncRest.__init__(self, uri, email, password, client_id, token,
+                           **kwargs)
+        # The lookups return coroutines, which cannot be memoized
+        self._memo = None
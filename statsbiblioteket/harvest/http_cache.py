@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import tempfile
+import typing
+
+CacheEntry = typing.NamedTuple('CacheEntry', [('etag', typing.Optional[str]),
+                                              ('last_modified',
+                                               typing.Optional[str]),
+                                              ('content', bytes)])
+"""A cached response, with the validators to send in a conditional request"""
+
+
+class HttpCache(object):
+    """
+    On-disk cache of GET responses, used to send conditional requests.
+
+    Responses with an ETag or Last-Modified header are stored, one file per
+    identity, url and parameters. When the same url is requested again, the
+    validators are sent as If-None-Match and If-Modified-Since, and if the
+    server answers 304 Not Modified, the cached content is used instead.
+    """
+
+    def __init__(self, directory: str, identity: str = ''):
+        """
+        :param directory: The directory to store the responses in. It is
+        created if it does not exist
+        :param identity: Identifies the credentials of the requests, like a
+        hash of them, so the responses one user may see are not served to
+        another user sharing the directory
+        """
+        self.directory = os.path.expanduser(directory)
+        self.identity = identity
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, url: str, params: typing.Optional[typing.Dict]) -> str:
+        params = sorted((str(key), str(value))
+                        for key, value in (params or {}).items())
+        key = json.dumps([self.identity, url, params])
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + '.json')
+
+    def get(self, url: str, params: typing.Optional[typing.Dict] = None) -> \
+            typing.Optional[CacheEntry]:
+        """
+        :param url: The url of the request
+        :param params: The query parameters of the request
+        :return: The cached response, or None if nothing is cached
+        """
+        try:
+            with open(self._path(url, params), 'r', encoding='utf-8') as file:
+                stored = json.load(file)
+        except (OSError, ValueError):
+            return None
+        return CacheEntry(stored['etag'], stored['last_modified'],
+                          stored['content'].encode('utf-8'))
+
+    def store(self, url: str, params: typing.Optional[typing.Dict], headers,
+              content: bytes):
+        """
+        Store a response, if it has an ETag or Last-Modified header
+
+        :param url: The url of the request
+        :param params: The query parameters of the request
+        :param headers: The headers of the response
+        :param content: The content of the response
+        :return: None
+        """
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if etag is None and last_modified is None:
+            return
+        stored = {'url': url, 'etag': etag, 'last_modified': last_modified,
+                  'content': content.decode('utf-8')}
+        # Write to a temporary file and rename it, so concurrent readers
+        # never see a partial file
+        descriptor, temp_path = tempfile.mkstemp(dir=self.directory,
+                                                 suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'w', encoding='utf-8') as file:
+                json.dump(stored, file)
+            os.replace(temp_path, self._path(url, params))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    @staticmethod
+    def conditional_headers(entry: typing.Optional[CacheEntry]) -> \
+            typing.Dict[str, str]:
+        """
+        :param entry: The cached response, or None
+        :return: The headers that make the request conditional on the cached
+        response
+        """
+        headers = {}
+        if entry is not None:
+            if entry.etag is not None:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified is not None:
+                headers['If-Modified-Since'] = entry.last_modified
+        return headers
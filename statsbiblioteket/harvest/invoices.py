@@ -4,6 +4,10 @@ from statsbiblioteket.harvest.rest import Rest
 from statsbiblioteket.harvest.typesystem.harvest_types import Invoice
 
 
+INVOICES_PAGE_SIZE = 50
+"""The number of invoices per page of the invoices listing"""
+
+
 class Invoices(Rest):
     # Invoices
 
@@ -18,7 +22,26 @@ class Invoices(Rest):
         - updated since date
         http://help.getharvest.com/api/invoices-api/invoices/show-invoices/#show-recently-created-invoices
         """
+        params = self._invoice_params(start_date, end_date, updated_since,
+                                      client_id, status_enum)
+        return self._get('/invoices', params=params)
+
+    def iter_invoices(self, start_date=None, end_date=None,
+                      updated_since=None, client_id=None,
+                      status_enum=None) -> typing.Iterator[Invoice]:
+        """
+        Iterate over the invoices, page by page, with the same filters as
+        invoices()
+        http://help.getharvest.com/api/invoices-api/invoices/show-invoices/#show-recently-created-invoices
+        """
+        params = self._invoice_params(start_date, end_date, updated_since,
+                                      client_id, status_enum)
+        return self._iter_get('/invoices', params=params, paginated=True,
+                              page_size=INVOICES_PAGE_SIZE)
 
+    @staticmethod
+    def _invoice_params(start_date=None, end_date=None, updated_since=None,
+                        client_id=None, status_enum=None):
         if client_id:
             params = {'client': client_id}
         elif start_date or end_date:
@@ -30,7 +53,7 @@ class Invoices(Rest):
             params = {'updated_since':updated_since}
         else:
             params = {}
-        return self._get('/invoices', params=params)
+        return params
 
     def get_invoice(self, invoice_id) -> Invoice:
         """
@@ -0,0 +1,64 @@
+import importlib
+import json
+import typing
+
+JSON_BACKENDS = ('json', 'orjson', 'ujson')
+"""The supported json libraries"""
+
+
+def apply_object_hook(value, object_hook: typing.Callable):
+    """
+    Apply an object hook to a decoded json value, the way json.loads would:
+    each dict is passed to the hook after its values have been converted
+
+    :param value: The decoded json value
+    :param object_hook: The object hook
+    :return: the converted value
+    """
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if isinstance(item, (dict, list)):
+                value[key] = apply_object_hook(item, object_hook)
+        return object_hook(value)
+    if isinstance(value, list):
+        for index, item in enumerate(value):
+            if isinstance(item, (dict, list)):
+                value[index] = apply_object_hook(item, object_hook)
+    return value
+
+
+def get_loads(backend: str = 'json') -> typing.Callable:
+    """
+    Get a json decoding function, taking the content and an object hook.
+
+    The fast libraries do not support object hooks, so the document is
+    decoded as plain dicts and lists, and the hook applied afterwards.
+
+    :param backend: The json library, one of JSON_BACKENDS, or 'auto' for the
+    fastest installed library
+    :return: a function loads(content, object_hook)
+    :raises ImportError: if the library is not installed
+    """
+    if backend == 'auto':
+        for candidate in ('orjson', 'ujson'):
+            try:
+                return get_loads(candidate)
+            except ImportError:
+                pass
+        backend = 'json'
+    if backend not in JSON_BACKENDS:
+        raise ValueError('Unknown json backend {backend}, expected one of '
+                         '{backends}'.format(backend=backend,
+                                             backends=JSON_BACKENDS))
+    if backend == 'json':
+        return json.loads
+
+    library = importlib.import_module(backend)
+
+    def loads(content, object_hook=None):
+        value = library.loads(content)
+        if object_hook is None:
+            return value
+        return apply_object_hook(value, object_hook)
+
+    return loads
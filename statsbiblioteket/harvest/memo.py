@@ -0,0 +1,164 @@
+import collections
+import functools
+import threading
+import time
+import typing
+
+MEMOIZED_ENTITIES = ('client', 'project', 'task', 'user')
+"""The entities whose lookups can be memoized"""
+
+DEFAULT_TTL = 300.0
+"""The default number of seconds a lookup is remembered"""
+
+DEFAULT_SIZE = 1024
+"""The default maximum number of lookups remembered per entity"""
+
+
+class MemoCache(object):
+    """
+    Thread safe cache with a time to live and a bounded size. When full, the
+    least recently used entry is evicted.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_size: int = DEFAULT_SIZE,
+                 clock: typing.Callable[[], float] = time.monotonic):
+        """
+        :param ttl: The number of seconds an entry is kept
+        :param max_size: The maximum number of entries
+        :param clock: The monotonic clock, in seconds
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> typing.Tuple[bool, typing.Any]:
+        """
+        :param key: The key of the entry
+        :return: (True, value) if the key is cached and not expired,
+        otherwise (False, None)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        """
+        Cache a value, evicting the least recently used entry if full
+
+        :param key: The key of the entry
+        :param value: The value
+        :return: None
+        """
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """
+        Remove an entry, if present
+
+        :param key: The key of the entry
+        :return: None
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Remove all entries. The counters are kept
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def create_memo(ttl: typing.Union[float, typing.Dict[str, float]] = None,
+                max_size: int = DEFAULT_SIZE) -> \
+        typing.Dict[str, MemoCache]:
+    """
+    Create the caches of the memoized entities
+
+    :param ttl: The time to live in seconds, either for all entities, or as a
+    dict from entity name ('client', 'project', 'task', 'user') to seconds.
+    Entities missing from the dict use DEFAULT_TTL
+    :param max_size: The maximum number of entries per entity
+    :return: a dict from entity name to cache
+    """
+    if ttl is None:
+        ttl = DEFAULT_TTL
+    memo = {}
+    for entity in MEMOIZED_ENTITIES:
+        if isinstance(ttl, dict):
+            entity_ttl = ttl.get(entity, DEFAULT_TTL)
+        else:
+            entity_ttl = ttl
+        memo[entity] = MemoCache(ttl=entity_ttl, max_size=max_size)
+    return memo
+
+
+def memoized(entity: str):
+    """
+    Decorate a lookup method, taking the id of the object, so the result is
+    taken from the memo of the entity, if memoization is enabled
+
+    :param entity: The name of the entity
+    :return: the decorator
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, object_id):
+            memo = self._memo
+            if memo is None:
+                return method(self, object_id)
+            cache = memo[entity]
+            key = str(object_id)
+            found, value = cache.get(key)
+            if not found:
+                value = method(self, object_id)
+                cache.put(key, value)
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+def invalidates(entity: str):
+    """
+    Decorate a method that changes an object, taking the id of the object as
+    the first argument, so the object is removed from the memo of the entity
+
+    :param entity: The name of the entity
+    :return: the decorator
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, object_id, *args, **kwargs):
+            try:
+                return method(self, object_id, *args, **kwargs)
+            finally:
+                # Even if the call failed, the object might have changed
+                if self._memo is not None:
+                    self._memo[entity].invalidate(str(object_id))
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,298 @@
+import bisect
+import re
+import threading
+import typing
+
+REQUEST_SECONDS = 'harvest_request_seconds'
+"""Histogram of the duration of each http request, until the headers arrived"""
+
+RESPONSE_BYTES = 'harvest_response_bytes'
+"""Histogram of the size of the response bodies"""
+
+DECODE_SECONDS = 'harvest_decode_seconds'
+"""Histogram of the time spent decoding the responses to harvest types"""
+
+RESPONSES = 'harvest_responses_total'
+"""Counter of the responses, by status code"""
+
+RETRIES = 'harvest_retries_total'
+"""Counter of the retried requests"""
+
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = (1024, 16 * 1024, 128 * 1024, 1024 ** 2, 8 * 1024 ** 2,
+                 64 * 1024 ** 2)
+
+_NUMERIC_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+Labels = typing.Tuple[typing.Tuple[str, str], ...]
+_Key = typing.Tuple[str, Labels]  # The name and the labels of a metric
+
+
+def endpoint_template(path: str) -> str:
+    """
+    :param path: The path of a request, like /projects/123/entries?from=...
+    :return: the path with the ids replaced, like /projects/{id}/entries
+    """
+    path = path.split('?', 1)[0]
+    return _NUMERIC_SEGMENT.sub('/{id}', path) or '/'
+
+
+class MetricsSink(object):
+    """
+    Receiver of the metrics of a client. Subclass it to forward the metrics
+    to a monitoring system
+    """
+
+    def observe(self, name: str, value: float, **labels: str):
+        """
+        Record a measurement of a histogram
+
+        :param name: The name of the histogram
+        :param value: The measured value
+        :param labels: The labels of the measurement, like endpoint
+        """
+
+    def increment(self, name: str, value: float = 1, **labels: str):
+        """
+        Increment a counter
+
+        :param name: The name of the counter
+        :param value: The increment
+        :param labels: The labels of the counter, like status
+        """
+
+
+class Histogram(object):
+    """
+    Count, sum, extremes and bucket counts of a series of measurements
+    """
+
+    def __init__(self, buckets: typing.Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, fraction: float) -> float:
+        """
+        :param fraction: The fraction, like 0.95
+        :return: the upper bound of the bucket holding the quantile, or the
+        maximum if it is in the last bucket
+        """
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.bucket_counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class InMemoryMetrics(MetricsSink):
+    """
+    Thread safe in-memory histograms and counters, the default sink of Rest
+    """
+
+    def __init__(self,
+                 buckets: typing.Dict[str, typing.Sequence[float]] = None):
+        """
+        :param buckets: The bucket bounds per histogram name. Histograms of
+        sizes use BYTES_BUCKETS and all others SECONDS_BUCKETS by default
+        """
+        self._buckets = {RESPONSE_BYTES: BYTES_BUCKETS}
+        self._buckets.update(buckets or {})
+        self._lock = threading.Lock()
+        self.histograms = {}  # type: typing.Dict[_Key, Histogram]
+        self.counters = {}  # type: typing.Dict[_Key, float]
+
+    def observe(self, name: str, value: float, **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = Histogram(self._buckets.get(name, SECONDS_BUCKETS))
+                self.histograms[key] = histogram
+            histogram.observe(value)
+
+    def increment(self, name: str, value: float = 1, **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def histogram(self, name: str,
+                  **labels: str) -> typing.Optional[Histogram]:
+        """
+        :return: the histogram with the name and labels, or None if nothing
+        was observed
+        """
+        return self.histograms.get((name, tuple(sorted(labels.items()))))
+
+    def counter(self, name: str, **labels: str) -> float:
+        """
+        :return: the value of the counter with the name and labels
+        """
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def endpoints(self) -> typing.Dict[str, typing.Dict[str, float]]:
+        """
+        :return: the totals per endpoint: requests, seconds, p95_seconds,
+        max_seconds, bytes, decode_seconds and retries
+        """
+        endpoints = sorted({dict(labels).get('endpoint', '')
+                            for _, labels in self.histograms})
+        totals = {}
+        for endpoint in endpoints:
+            requests = self._merged(REQUEST_SECONDS, endpoint)
+            retries = sum(value for (name, labels), value in
+                          list(self.counters.items())
+                          if name == RETRIES and
+                          dict(labels).get('endpoint') == endpoint)
+            totals[endpoint] = {
+                'requests': requests.count,
+                'seconds': requests.sum,
+                'p95_seconds': requests.quantile(0.95) or 0,
+                'max_seconds': requests.max or 0,
+                'bytes': self._merged(RESPONSE_BYTES, endpoint).sum,
+                'decode_seconds': self._merged(DECODE_SECONDS, endpoint).sum,
+                'retries': retries}
+        return totals
+
+    def summary(self) -> str:
+        """
+        :return: a table of the requests, response sizes and decode times per
+        endpoint
+        """
+        header = ('endpoint', 'requests', 'mean s', 'p95 s', 'max s', 'MiB',
+                  'decode s', 'retries')
+        rows = [header]
+        for endpoint, totals in sorted(self.endpoints().items()):
+            requests = totals['requests']
+            rows.append((endpoint, str(requests),
+                         '{:.3f}'.format(totals['seconds'] / requests
+                                         if requests else 0),
+                         '{:.3f}'.format(totals['p95_seconds']),
+                         '{:.3f}'.format(totals['max_seconds']),
+                         '{:.2f}'.format(totals['bytes'] / 1024 ** 2),
+                         '{:.3f}'.format(totals['decode_seconds']),
+                         str(int(totals['retries']))))
+        widths = [max(len(row[column]) for row in rows)
+                  for column in range(len(header))]
+        return '\n'.join('  '.join(value.ljust(width) if column == 0 else
+                                   value.rjust(width)
+                                   for column, (value, width) in
+                                   enumerate(zip(row, widths)))
+                         for row in rows)
+
+    def _merged(self, name: str, endpoint: str) -> Histogram:
+        """
+        :return: the histograms of the name and endpoint, merged over the
+        other labels
+        """
+        merged = Histogram(self._buckets.get(name, SECONDS_BUCKETS))
+        with self._lock:
+            for (key_name, labels), histogram in self.histograms.items():
+                if key_name != name or \
+                        dict(labels).get('endpoint') != endpoint:
+                    continue
+                merged.count += histogram.count
+                merged.sum += histogram.sum
+                for index, count in enumerate(histogram.bucket_counts):
+                    merged.bucket_counts[index] += count
+                for value in (histogram.min, histogram.max):
+                    if value is not None:
+                        merged.min = value if merged.min is None else \
+                            min(merged.min, value)
+                        merged.max = value if merged.max is None else \
+                            max(merged.max, value)
+        return merged
+
+
+def _prometheus_labels(labels: Labels, **extra: str) -> str:
+    labels = list(labels) + sorted(extra.items())
+    if not labels:
+        return ''
+    return '{' + ','.join('{key}="{value}"'.format(
+            key=key, value=_prometheus_escape(value))
+                          for key, value in labels) + '}'
+
+
+def _prometheus_escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def prometheus_text(metrics: InMemoryMetrics) -> str:
+    """
+    :param metrics: The metrics
+    :return: the metrics in the Prometheus text exposition format
+    """
+    lines = []
+    for name in sorted({name for name, _ in metrics.histograms}):
+        lines.append('# TYPE {name} histogram'.format(name=name))
+        for (key_name, labels), histogram in sorted(
+                metrics.histograms.items()):
+            if key_name != name:
+                continue
+            cumulative = 0
+            bounds = [str(bound) for bound in histogram.buckets] + ['+Inf']
+            for bound, count in zip(bounds, histogram.bucket_counts):
+                cumulative += count
+                lines.append('{name}_bucket{labels} {value}'.format(
+                        name=name, labels=_prometheus_labels(labels, le=bound),
+                        value=cumulative))
+            lines.append('{name}_sum{labels} {value}'.format(
+                    name=name, labels=_prometheus_labels(labels),
+                    value=histogram.sum))
+            lines.append('{name}_count{labels} {value}'.format(
+                    name=name, labels=_prometheus_labels(labels),
+                    value=histogram.count))
+    for name in sorted({name for name, _ in metrics.counters}):
+        lines.append('# TYPE {name} counter'.format(name=name))
+        for (key_name, labels), value in sorted(metrics.counters.items()):
+            if key_name == name:
+                lines.append('{name}{labels} {value}'.format(
+                        name=name, labels=_prometheus_labels(labels),
+                        value=value))
+    return '\n'.join(lines) + '\n'
+
+
+def _statsd_name(prefix: str, name: str, labels: Labels) -> str:
+    parts = [prefix, name] + [
+        re.sub(r'[^A-Za-z0-9_]+', '_', str(value)).strip('_')
+        for _, value in labels]
+    return '.'.join(part for part in parts if part)
+
+
+def statsd_lines(metrics: InMemoryMetrics, prefix: str = 'harvest') -> \
+        typing.List[str]:
+    """
+    :param metrics: The metrics
+    :param prefix: The prefix of the metric names
+    :return: StatsD lines with the totals of the metrics, timers in
+    milliseconds. The labels are appended to the metric names
+    """
+    lines = []
+    for (name, labels), histogram in sorted(metrics.histograms.items()):
+        metric = _statsd_name(prefix, name, labels)
+        if name == RESPONSE_BYTES:
+            lines.append('{metric}:{value}|c'.format(metric=metric,
+                                                     value=int(histogram.sum)))
+        else:
+            lines.append('{metric}:{value:.3f}|ms'.format(
+                    metric=metric, value=histogram.mean * 1000))
+    for (name, labels), value in sorted(metrics.counters.items()):
+        lines.append('{metric}:{value}|c'.format(
+                metric=_statsd_name(prefix, name, labels), value=int(value)))
+    return lines
@@ -4,17 +4,33 @@ from statsbiblioteket.harvest.rest import Rest
 from statsbiblioteket.harvest.typesystem.harvest_types import Project, DayEntry, Expense
 
 
+def timesheet_params(start_date, end_date, updated_since=None) -> dict:
+    """
+    :return: the query parameters of the timesheet requests of projects and
+    people, for the dates YYYY-MM-DD and the optional updated_since
+    """
+    params = {'from': start_date.replace('-', ''),
+              'to': end_date.replace('-', '')}
+    if updated_since is not None:
+        params['updated_since'] = updated_since
+    return params
+
+
 class Projects(Rest):
-    def projects(self, client_id: str =None) -> typing.List[Project]:
+    def projects(self, client_id: str = None, updated_since=None) -> \
+            typing.List[Project]:
         """
-        Get all the projects (optinally restricted to a particular client)
+        Get all the projects (optinally restricted to a particular client
+        and/or updated since a particular date)
         """
         params = {}
         if client_id:
             # You can filter by client_id and updated_since.
             # For example to show only the projects belonging to client with the id 23445.
             # GET /projects?client=23445
-            params = {'client': client_id}
+            params['client'] = client_id
+        if updated_since is not None:
+            params['updated_since'] = updated_since
         return self._get('/projects', params=params)
 
     def projects_for_client(self, client_id: str) -> typing.List[Project]:
@@ -26,17 +42,30 @@ class Projects(Rest):
         url = '/projects'
         return self._get(url, params=params)
 
-    def timesheets_for_project(self, project_id, start_date, end_date) -> \
+    def timesheets_for_project(self, project_id, start_date, end_date,
+                               updated_since=None) -> \
     typing.List[DayEntry]:
         """
-        Get the timesheets for a project
+        Get the timesheets for a project (optionally only the ones updated
+        since a particular date)
         """
-        params = {'from': start_date.replace('-', ''),
-                  'to': end_date.replace('-', '')}
+        params = timesheet_params(start_date, end_date, updated_since)
 
         url = '/projects/{0}/entries'.format(project_id)
         return self._get(url, params=params)
 
+    def iter_timesheets_for_project(self, project_id, start_date, end_date,
+                                    updated_since=None) -> \
+            typing.Iterator[DayEntry]:
+        """
+        Iterate over the timesheets for a project, decoding them while the
+        response is read
+        """
+        params = timesheet_params(start_date, end_date, updated_since)
+
+        url = '/projects/{0}/entries'.format(project_id)
+        return self._iter_get(url, params=params)
+
     def expenses_for_project(self, project_id) -> \
     typing.List[Expense]:
         """
@@ -47,6 +76,15 @@ class Projects(Rest):
         url = '/projects/{0}/expenses'.format(project_id)
         return self._get(url)
 
+    def iter_expenses_for_project(self, project_id) -> \
+            typing.Iterator[Expense]:
+        """
+        Iterate over the expenses for a project, decoding them while the
+        response is read
+        """
+        url = '/projects/{0}/expenses'.format(project_id)
+        return self._iter_get(url)
+
     def get_project(self, project_id) -> Project:
         """
         Get a particular project
@@ -1,48 +1,283 @@
 # Internal methods
+import codecs
+import email.utils
+import hashlib
 import json
+import logging
 import os
+import random
+import threading
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests_oauthlib import OAuth2Session
+from urllib3.util.retry import Retry
 
+from statsbiblioteket.harvest.http_cache import HttpCache
+from statsbiblioteket.harvest.json_backend import get_loads
+from statsbiblioteket.harvest.metrics import InMemoryMetrics, \
+    endpoint_template, REQUEST_SECONDS, RESPONSE_BYTES, DECODE_SECONDS, \
+    RESPONSES, RETRIES
+from statsbiblioteket.harvest.streaming import JsonArrayDecoder
 from statsbiblioteket.harvest.typesystem.harvest_types import json_to_harvest
+from statsbiblioteket.harvest.typesystem.records import json_to_record
 from statsbiblioteket.harvest.typesystem.orm_types import TypeToJSON
 
+logger = logging.getLogger(__name__)
+
 HARVEST_STATUS_URL = 'http://www.harveststatus.com/api/v2/status.json'
 
+HARVEST_REQUEST_LIMIT = 100
+HARVEST_REQUEST_PERIOD = 15
+"""Harvest allows HARVEST_REQUEST_LIMIT requests per HARVEST_REQUEST_PERIOD
+seconds. Requests beyond that are answered with 429 Too Many Requests"""
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'])
+"""Methods whose requests can be retried after a server error"""
+
+STREAM_CHUNK_SIZE = 64 * 1024
+"""The number of bytes read at a time from streamed responses"""
+
 
 class HarvestError(Exception):
     """ Custom class for Harvest exceptions """
     pass
 
 
+class RateLimiter(object):
+    """
+    Token bucket rate limiter shared by all the requests of a client, and by
+    all the threads using it.
+
+    The bucket holds up to half of `requests` tokens, and is refilled with
+    the other half every `period` seconds, so the burst of a full bucket and
+    the refill never add up to more than `requests` requests in any period.
+    Each request takes a token, and waits for the bucket to refill if it is
+    empty. A 429 response with a
+    Retry-After header pauses all requests for that long. Server errors are
+    retried with jittered exponential backoff.
+    """
+
+    def __init__(self, requests=HARVEST_REQUEST_LIMIT,
+                 period=HARVEST_REQUEST_PERIOD, max_retries=5, backoff=1.0,
+                 max_backoff=60.0, clock=time.monotonic):
+        """
+        :param requests: The number of requests allowed per period
+        :param period: The length of the period, in seconds
+        :param max_retries: The number of times a request is retried
+        :param backoff: The base delay of the exponential backoff, in seconds
+        :param max_backoff: The maximum delay between retries, in seconds
+        :param clock: The monotonic clock, in seconds
+        """
+        self.capacity = max(1, requests // 2)
+        self.rate = max(1, requests - self.capacity) / period
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._tokens = float(self.capacity)
+        self._updated = clock()
+        self._paused_until = self._updated
+
+    def reserve(self) -> float:
+        """
+        Take a token from the bucket
+
+        :return: The number of seconds to wait before sending the request
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (
+                now - self._updated) * self.rate)
+            self._updated = now
+            # The token is taken even if the bucket is empty, so concurrent
+            # callers queue up behind each other
+            self._tokens -= 1
+            wait = max(0.0, -self._tokens / self.rate)
+            return max(wait, self._paused_until - now)
+
+    def acquire(self):
+        """
+        Take a token from the bucket, sleeping until the request may be sent
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def retry_delay(self, method: str, status_code: int, headers,
+                    attempt: int):
+        """
+        Determine if a request should be retried
+
+        :param method: The http method of the request
+        :param status_code: The status code of the response
+        :param headers: The headers of the response
+        :param attempt: The number of times the request have been retried
+        :return: The number of seconds to wait before retrying the request,
+        or None if it should not be retried
+        """
+        if attempt >= self.max_retries:
+            return None
+
+        retry_after = self._retry_after(headers)
+        if status_code == 429 or (status_code == 503 and
+                                  retry_after is not None):
+            # The request was not processed, so it is safe to retry
+            if retry_after is None:
+                retry_after = self.backoff_delay(attempt)
+            with self._lock:
+                self._paused_until = max(self._paused_until,
+                                         self._clock() + retry_after)
+            return retry_after
+
+        if 500 <= status_code < 600 and method.upper() in IDEMPOTENT_METHODS:
+            return self.backoff_delay(attempt)
+
+        return None
+
+    def backoff_delay(self, attempt: int) -> float:
+        """
+        :param attempt: The number of times the request have been retried
+        :return: The jittered exponential backoff delay, in seconds
+        """
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    @staticmethod
+    def _retry_after(headers):
+        """
+        :return: The Retry-After header in seconds, or None if not present
+        """
+        value = headers.get('Retry-After')
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, date.timestamp() - time.time())
+
+
+HEADERS = {
+    'Content-Type': 'application/json',
+    'Accept': 'application/json',
+    'User-Agent': 'Mozilla/5.0',
+    # 'TimeTracker for Linux' -- ++ << >>
+}
+
+
+def _idempotent_retry(**kwargs) -> Retry:
+    """
+    :param kwargs: The arguments of Retry
+    :return: a Retry of the IDEMPOTENT_METHODS. Before urllib3 1.26, the
+    allowed_methods argument was called method_whitelist
+    """
+    try:
+        return Retry(allowed_methods=IDEMPOTENT_METHODS, **kwargs)
+    except TypeError:
+        return Retry(method_whitelist=IDEMPOTENT_METHODS, **kwargs)
+
+
 class Rest(object):
     def __init__(self, uri, email=None, password=None, client_id=None,
-                 token=None):
-        """ Init method """
+                 token=None, rate_limiter=None, pool_connections=10,
+                 pool_maxsize=10, max_retries=3, timeout=(10, 60),
+                 cache_dir=None, json_backend='json', records=False,
+                 metrics=None):
+        """
+        Init method
+
+        :param uri: The url of the harvest domain
+        :param email: The email of the user, for basic authentication
+        :param password: The password of the user, for basic authentication
+        :param client_id: The client id, for OAuth2 authentication
+        :param token: The token, for OAuth2 authentication
+        :param rate_limiter: The RateLimiter of the requests. Pass the same
+        limiter to several clients of the same account to share the budget
+        :param pool_connections: The number of connection pools to cache
+        :param pool_maxsize: The maximum number of kept-alive connections per
+        host. This should be at least the number of threads using the client
+        :param max_retries: The number of times a request is retried on
+        connection errors (and idempotent requests on read errors)
+        :param timeout: The connect and read timeouts in seconds, as a number
+        or a (connect, read) tuple. None to wait forever
+        :param cache_dir: If set, GET responses are cached in this directory,
+        and requested again with conditional requests
+        :param json_backend: The json library decoding the responses, 'json',
+        'orjson', 'ujson' or 'auto' for the fastest installed
+        :param records: If True, responses are decoded as the plain records of
+        typesystem.records instead of the database mapped harvest types
+        :param metrics: The MetricsSink receiving the timings, sizes and
+        status codes of the requests per endpoint. By default an
+        InMemoryMetrics, available as the metrics attribute
+        """
         self.uri = uri.rstrip('/')
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self._loads = get_loads(json_backend)
+        self._object_hook = json_to_record if records else json_to_harvest
+        self.metrics = metrics if metrics is not None else InMemoryMetrics()
 
         if email and password:
-            self._session = requests.Session()
             self.auth = 'Basic'
             self.email = email.strip()
             self.password = password
-            self._session.auth = (self.email, self.password)
         elif client_id and token:
             self.auth = 'OAuth2'
             self.client_id = client_id
             self.token = token
-            self._session = OAuth2Session(client_id=self.client_id,
-                                          token=self.token)
         else:
             raise ValueError()
 
-        self._session.headers.update({
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'User-Agent': 'Mozilla/5.0',
-            # 'TimeTracker for Linux' -- ++ << >>
-        })
+        self.http_cache = HttpCache(cache_dir, self._credentials_hash()) \
+            if cache_dir else None
+        self._session = self._create_session()
+
+    def _credentials_hash(self) -> str:
+        """
+        :return: a hash of the credentials, which keeps the cached responses
+        of different users apart
+        """
+        if self.auth == 'Basic':
+            credentials = [self.auth, self.email, self.password]
+        else:
+            credentials = [self.auth, self.client_id,
+                           self.token.get('access_token')]
+        return hashlib.sha256(
+                json.dumps(credentials).encode('utf-8')).hexdigest()
+
+    def _create_session(self):
+        """
+        Internal method to create the http session used for all the requests
+        """
+        if self.auth == 'Basic':
+            session = requests.Session()
+            session.auth = (self.email, self.password)
+        else:
+            session = OAuth2Session(client_id=self.client_id,
+                                    token=self.token)
+
+        session.headers.update(HEADERS)
+
+        # Retry connection problems here. Error responses are retried by the
+        # rate limiter
+        retry = _idempotent_retry(total=self.max_retries, status=0,
+                                  backoff_factor=0.5, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                              pool_maxsize=self.pool_maxsize,
+                              max_retries=retry)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
 
     def _get(self, path='/', data=None, params=None):
         """
@@ -50,6 +285,64 @@ class Rest(object):
         """
         return self._request('GET', path, data, params)
 
+    def _iter_get(self, path='/', params=None, paginated=False,
+                  page_size=None):
+        """
+        Internal method to GET a json list from a url, yielding the decoded
+        objects one at a time.
+        If paginated, the pages are requested one after another, until an
+        empty page (or a page with less than page_size objects) is returned
+        """
+        params = dict(params or {})
+        page = 1
+        while True:
+            if paginated:
+                params['page'] = page
+            count = 0
+            for harvest_object in self._stream(path, params):
+                count += 1
+                yield harvest_object
+            if not paginated or count == 0 or \
+                    (page_size is not None and count < page_size):
+                return
+            page += 1
+
+    def _stream(self, path='/', params=None):
+        """
+        Internal method to GET a json list from a url, decoding the response
+        while it is read
+        """
+        url = self._url(path)
+
+        resp = self._send(method='GET', url=url, params=params, stream=True)
+        with resp:
+            try:
+                resp.raise_for_status()
+            except requests.exceptions.HTTPError as exc:
+                raise HarvestError(exc, exc.response.text)
+
+            text_decoder = codecs.getincrementaldecoder(
+                    resp.encoding or 'utf-8')(errors='replace')
+            decoder = JsonArrayDecoder(object_hook=self._object_hook)
+            size = 0
+            decode_seconds = 0.0
+            for chunk in resp.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                size += len(chunk)
+                start = time.perf_counter()
+                harvest_objects = decoder.feed(text_decoder.decode(chunk))
+                decode_seconds += time.perf_counter() - start
+                yield from harvest_objects
+            start = time.perf_counter()
+            harvest_objects = decoder.feed(
+                    text_decoder.decode(b'', final=True)) + decoder.close()
+            decode_seconds += time.perf_counter() - start
+            yield from harvest_objects
+
+            endpoint = endpoint_template(path)
+            self.metrics.observe(RESPONSE_BYTES, size, endpoint=endpoint)
+            self.metrics.observe(DECODE_SECONDS, decode_seconds,
+                                 endpoint=endpoint)
+
     def _post(self, path='/', data=None, params=None):
         """
         Internal method to POST to a url
@@ -73,24 +366,111 @@ class Rest(object):
         Internal method to use requests library
         """
 
-        url = '{uri}{path}'.format(uri=self.uri, path=path)
+        url = self._url(path)
 
-        json_data = json.dumps(data, cls=TypeToJSON)
+        json_data = self._encode(data)
 
-        resp = self._session.request(method=method, url=url, data=json_data,
-                                     params=params)
+        cached = self._cached(method, url, params)
+
+        resp = self._send(method=method, url=url, data=json_data,
+                          params=params,
+                          headers=HttpCache.conditional_headers(cached))
         try:
             resp.raise_for_status()
         except requests.exceptions.HTTPError as exc:
             raise HarvestError(exc, exc.response.text)
 
-        if resp.status_code == requests.codes.created:
-            return os.path.basename(resp.headers['location'])
+        status_code, content = self._revalidate(method, url, params, cached,
+                                                resp.status_code,
+                                                resp.headers, resp.content)
+        endpoint = endpoint_template(path)
+        self.metrics.observe(RESPONSE_BYTES, len(resp.content),
+                             endpoint=endpoint)
+        start = time.perf_counter()
+        decoded = self._decode(method, status_code, resp.headers, content)
+        self.metrics.observe(DECODE_SECONDS, time.perf_counter() - start,
+                             endpoint=endpoint)
+        return decoded
+
+    def _cached(self, method, url, params):
+        """
+        Internal method to get the cached response of a GET request
+        """
+        if self.http_cache is None or method != 'GET':
+            return None
+        return self.http_cache.get(url, params)
+
+    def _revalidate(self, method, url, params, cached, status_code, headers,
+                    content):
+        """
+        Internal method to use the cached content if the server answered 304
+        Not Modified, and otherwise cache the new content
+        """
+        if cached is not None and status_code == requests.codes.not_modified:
+            return requests.codes.ok, cached.content
+        if self.http_cache is not None and method == 'GET' and \
+                status_code == requests.codes.ok:
+            self.http_cache.store(url, params, headers, content)
+        return status_code, content
+
+    def _send(self, method, url, **kwargs):
+        """
+        Internal method to send a request through the rate limiter, retrying
+        it when the rate limiter says so
+        """
+        endpoint = endpoint_template(url[len(self.uri):])
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            start = time.perf_counter()
+            resp = self._session.request(method=method, url=url,
+                                         timeout=self.timeout, **kwargs)
+            self._record_response(method, endpoint, resp.status_code,
+                                  time.perf_counter() - start)
+            delay = self.rate_limiter.retry_delay(method, resp.status_code,
+                                                  resp.headers, attempt)
+            if delay is None:
+                return resp
+            logger.warning('%s %s returned %s, retrying in %.1f seconds',
+                           method, url, resp.status_code, delay)
+            self.metrics.increment(RETRIES, endpoint=endpoint)
+            resp.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def _record_response(self, method, endpoint, status_code, seconds):
+        """
+        Internal method to record the duration and status of a request
+        """
+        self.metrics.observe(REQUEST_SECONDS, seconds, endpoint=endpoint,
+                             method=method)
+        self.metrics.increment(RESPONSES, endpoint=endpoint,
+                               status=str(status_code))
+
+    def _url(self, path):
+        """
+        Internal method to build the url of a path
+        """
+        return '{uri}{path}'.format(uri=self.uri, path=path)
+
+    @staticmethod
+    def _encode(data):
+        """
+        Internal method to encode the request data as json
+        """
+        return json.dumps(data, cls=TypeToJSON)
+
+    def _decode(self, method, status_code, headers, content):
+        """
+        Internal method to decode a successful response as harvest types
+        """
+        if status_code == requests.codes.created:
+            return os.path.basename(headers['location'])
 
         if 'DELETE' not in method:
-            return resp.json(object_hook=json_to_harvest)
+            return self._loads(content, object_hook=self._object_hook)
         else:
-            return resp.text
+            return content.decode('utf-8', errors='replace')
 
     @classmethod
     def status(cls):
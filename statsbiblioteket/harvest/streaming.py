@@ -0,0 +1,128 @@
+import json
+import typing
+
+_START = 'start'
+_VALUE = 'value'
+_FIRST_VALUE = 'first value'
+_SEPARATOR = 'separator'
+_END = 'end'
+_WHOLE = 'whole'
+
+_WHITESPACE = ' \t\n\r'
+
+
+class JsonArrayDecoder(object):
+    """
+    Incremental decoder of a json array.
+
+    Text is fed to the decoder as it arrives, and the elements of the array
+    are returned as soon as they are complete, so only one element (and one
+    chunk of text) needs to be in memory at a time.
+
+    If the json document is not an array, it is decoded as a whole when the
+    decoder is closed, and returned as the only element.
+    """
+
+    def __init__(self, object_hook: typing.Callable = None):
+        self._decoder = json.JSONDecoder(object_hook=object_hook)
+        self._buffer = ''
+        self._state = _START
+
+    def feed(self, text: str) -> typing.List:
+        """
+        Feed a chunk of the json text to the decoder
+
+        :param text: The next chunk of the json text
+        :return: The elements completed by this chunk
+        """
+        self._buffer += text
+        return list(self._parse(final=False))
+
+    def close(self) -> typing.List:
+        """
+        Signal that all the text have been fed to the decoder
+
+        :return: The remaining elements
+        :raises ValueError: if the text was not a complete json document
+        """
+        if self._state == _WHOLE:
+            self._state = _END
+            document = self._decoder.decode(self._buffer)
+            self._buffer = ''
+            if isinstance(document, list):
+                return document
+            return [document]
+
+        elements = list(self._parse(final=True))
+        if self._state != _END or self._buffer.strip(_WHITESPACE):
+            raise ValueError('Incomplete json array')
+        return elements
+
+    def _parse(self, final: bool) -> typing.Iterator:
+        buffer = self._buffer
+        index = 0
+        try:
+            while self._state not in (_END, _WHOLE):
+                while index < len(buffer) and buffer[index] in _WHITESPACE:
+                    index += 1
+                if index == len(buffer):
+                    return
+                char = buffer[index]
+
+                if self._state == _START:
+                    if char == '[':
+                        self._state = _FIRST_VALUE
+                        index += 1
+                    else:
+                        self._state = _WHOLE
+                elif self._state == _SEPARATOR:
+                    if char == ',':
+                        self._state = _VALUE
+                    elif char == ']':
+                        self._state = _END
+                    else:
+                        raise ValueError(
+                                'Expected , or ] at position {index}'.format(
+                                        index=index))
+                    index += 1
+                elif self._state == _FIRST_VALUE and char == ']':
+                    self._state = _END
+                    index += 1
+                else:
+                    try:
+                        element, end = self._decoder.raw_decode(buffer, index)
+                    except ValueError:
+                        if final:
+                            raise
+                        return  # The element is not complete yet
+                    if not final:
+                        # Only accept the element when the separator after
+                        # it has arrived, as a number like 12 could continue
+                        # as 12.5 in the next chunk
+                        after = end
+                        while after < len(buffer) and \
+                                buffer[after] in _WHITESPACE:
+                            after += 1
+                        if after == len(buffer) or buffer[after] not in ',]':
+                            return
+                    index = end
+                    self._state = _SEPARATOR
+                    yield element
+        finally:
+            self._buffer = buffer[index:]
+
+
+def iter_json_array(chunks: typing.Iterable[str],
+                    object_hook: typing.Callable = None) -> typing.Iterator:
+    """
+    Decode a json array from an iterable of text chunks, yielding the
+    elements as they are completed
+
+    :param chunks: The json text, in chunks
+    :param object_hook: The object hook of the json decoder
+    :return: a generator of the elements of the array
+    """
+    decoder = JsonArrayDecoder(object_hook=object_hook)
+    for chunk in chunks:
+        yield from decoder.feed(chunk)
+    yield from decoder.close()
@@ -0,0 +1,241 @@
+import datetime
+import hashlib
+import typing
+
+from sqlalchemy import bindparam, select, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from statsbiblioteket.harvest.synch import logger
+from statsbiblioteket.harvest.typesystem.conversion import converter
+from statsbiblioteket.harvest.typesystem.orm_types import HarvestDBType, \
+    VERSION_COLUMN_NAME, CONTENT_HASH_COLUMN_NAME, CONTENT_HASH_LENGTH, \
+    versioned_columns
+
+BATCH_SIZE = 500
+"""The number of objects handled per query. This keeps the IN clauses
+below the bound parameter limit of SQLite"""
+
+UpsertStats = typing.NamedTuple('UpsertStats', [('inserted', int),
+                                                ('updated', int),
+                                                ('unchanged', int)])
+"""The number of rows inserted, updated and left unchanged by an upsert"""
+
+
+def _normaliser(column) -> typing.Callable:
+    """
+    Get a function that converts a harvest json value to the python type of
+    the column, so it compares equal to the value read back from the database.
+    Harvest is not consistent in the types, ie. ids are sometimes strings.
+    Values that cannot be converted are returned as they are
+
+    :param column: The column
+    :return: The conversion function
+    """
+    try:
+        convert = converter(column.type.python_type)
+    except NotImplementedError:
+        return lambda value: value
+
+    def normalise(value):
+        try:
+            return convert(value)
+        except (TypeError, ValueError):
+            return value
+
+    return normalise
+
+
+def content_hash(values: typing.Iterable[typing.Tuple[str, typing.Any]]) -> \
+        str:
+    """
+    :param values: The (column key, normalised value) pairs of the columns
+    given by Harvest, in the order of the versioned columns
+    :return: the hex digest stored in the _content_hash column
+    """
+    return hashlib.blake2b(repr(tuple(values)).encode('utf-8'),
+                           digest_size=CONTENT_HASH_LENGTH // 2).hexdigest()
+
+
+def add_content_hash_columns(engine: Engine):
+    """
+    Add the _content_hash column to the tables created before it existed.
+    The rows of those tables get their hash the first time they are upserted
+
+    :param engine: The engine of the database
+    :return: None
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in HarvestDBType.metadata.sorted_tables:
+        column = table.c.get(CONTENT_HASH_COLUMN_NAME)
+        if column is None or table.name not in existing_tables:
+            continue
+        if column.name in {existing['name'] for existing in
+                           inspector.get_columns(table.name)}:
+            continue
+        logger.info('Adding the column {column} to {table}',
+                    column=column.name, table=table.name)
+        with engine.begin() as connection:
+            connection.execute(
+                    'ALTER TABLE {table} ADD COLUMN {column} {type}'.format(
+                        table=table.name, column=column.name,
+                        type=column.type.compile(engine.dialect)))
+
+
+def _batches(objects: typing.Sequence, size: int) -> typing.Iterator:
+    for start in range(0, len(objects), size):
+        yield objects[start:start + size]
+
+
+def bulk_upsert(session: Session, cls: typing.Type[HarvestDBType],
+                harvest_objects: typing.Iterable[HarvestDBType],
+                transaction_now: datetime.datetime,
+                batch_size: int = BATCH_SIZE) -> UpsertStats:
+    """
+    Upserts the given objects in the database, without loading them into the
+    session.
+
+    For each batch of objects, the content hashes of the existing rows are
+    read with one query. Objects with the same hash as their row are
+    unchanged, and only get their _updated_on set, with one UPDATE for the
+    batch. The rest of the existing rows are read, and compared in memory.
+    New objects are inserted, and changed objects are updated, with the old
+    row copied into the history table and the version increased, as
+    create_version does for objects flushed by a versioned session. All the
+    inserts and updates are executed as executemany statements. The
+    _updated_on column of every given object is set to transaction_now, so
+    they are not archived.
+
+    :param session: The session, whose transaction is used
+    :param cls: The class of the objects (which implicitly denote the sql
+    table)
+    :param harvest_objects: The objects to create or update in the database
+    :param transaction_now: The timestamp to mark the rows as updated with
+    :param batch_size: The number of objects per query
+    :return: The number of inserted, updated and unchanged rows
+    """
+    table = cls.__table__
+    history_table = cls.__history_mapper__.local_table
+    primary_key, = table.primary_key.columns
+    hash_column = table.c[CONTENT_HASH_COLUMN_NAME]
+    columns = versioned_columns(cls)
+    normalisers = {col_key: _normaliser(table.c[col_key])
+                   for _, col_key in columns}
+
+    # Later objects with the same id wins, as with consecutive merges
+    by_id = {}
+    for harvest_object in harvest_objects:
+        by_id[normalisers[primary_key.key](
+                getattr(harvest_object, primary_key.key))] = harvest_object
+
+    # The statements are built once, with the ids of a batch as an expanding
+    # parameter, instead of a bound parameter per id
+    batch_ids = primary_key.in_(bindparam('ids', expanding=True))
+    select_hashes = select([primary_key, hash_column]).where(batch_ids)
+    select_rows = select([table.c[col_key] for _, col_key in columns] + [
+        table.c[VERSION_COLUMN_NAME]]).where(batch_ids)
+    touch = table.update().where(batch_ids).values(
+            _updated_on=transaction_now)
+
+    inserted = updated = unchanged = 0
+    for ids in _batches(list(by_id), batch_size):
+        stored_hashes = dict(session.execute(select_hashes,
+                                             {'ids': ids}).fetchall())
+
+        given = {}
+        hashes = {}
+        touched = []
+        compared = []
+        for id_ in ids:
+            values = by_id[id_].__dict__
+            # Only the columns given by harvest, normalised
+            given_values = [(col_key, normalisers[col_key](values[prop_key]))
+                            for prop_key, col_key in columns
+                            if prop_key in values]
+            hashes[id_] = content_hash(given_values)
+            if id_ in stored_hashes and stored_hashes[id_] == hashes[id_]:
+                touched.append(id_)
+                continue
+            given[id_] = dict(given_values)
+            if id_ in stored_hashes:
+                compared.append(id_)
+
+        existing = {}
+        if compared:
+            existing = {row[primary_key.key]: row for row in
+                        session.execute(select_rows, {'ids': compared})}
+
+        inserts = []
+        updates = []
+        history = []
+        rehashed = []
+        for id_, values in given.items():
+            old_row = existing.get(id_)
+            if old_row is None:
+                row = {col_key: values.get(col_key) for _, col_key in columns}
+                row[VERSION_COLUMN_NAME] = 1
+                row['_updated_on'] = transaction_now
+                row[CONTENT_HASH_COLUMN_NAME] = hashes[id_]
+                inserts.append(row)
+                continue
+
+            row = {}
+            changes = {}
+            for _, col_key in columns:
+                old_value = old_row[col_key]
+                if col_key in values:
+                    new_value = values[col_key]
+                    if new_value != old_value:
+                        changes[col_key] = (old_value, new_value)
+                else:
+                    # Not given by harvest, so keep the stored value
+                    new_value = old_value
+                row['b_' + col_key] = new_value
+
+            if not changes:
+                # Stored before the hash, or with a hash of other fields
+                rehashed.append({'b_id_': id_, 'b_hash': hashes[id_]})
+                continue
+
+            logger.debug('Object {id} was changed: {row}',
+                         id=str(by_id[id_]), row=changes)
+            old_version = old_row[VERSION_COLUMN_NAME]
+            history_row = {col_key: old_row[col_key]
+                           for _, col_key in columns}
+            history_row[VERSION_COLUMN_NAME] = old_version
+            history.append(history_row)
+
+            row['b_' + VERSION_COLUMN_NAME] = old_version + 1
+            row['b__updated_on'] = transaction_now
+            row['b_' + CONTENT_HASH_COLUMN_NAME] = hashes[id_]
+            row['b_id_'] = id_
+            updates.append(row)
+
+        if inserts:
+            session.execute(table.insert(), inserts)
+        if history:
+            session.execute(history_table.insert(), history)
+        if updates:
+            values = {col_key: bindparam('b_' + col_key)
+                      for _, col_key in columns if col_key != primary_key.key}
+            values[VERSION_COLUMN_NAME] = bindparam('b_' + VERSION_COLUMN_NAME)
+            values['_updated_on'] = bindparam('b__updated_on')
+            values[CONTENT_HASH_COLUMN_NAME] = bindparam(
+                    'b_' + CONTENT_HASH_COLUMN_NAME)
+            session.execute(table.update().where(
+                    primary_key == bindparam('b_id_')).values(values), updates)
+        if rehashed:
+            session.execute(table.update().where(
+                    primary_key == bindparam('b_id_')).values(
+                    {'_updated_on': transaction_now,
+                     CONTENT_HASH_COLUMN_NAME: bindparam('b_hash')}),
+                    rehashed)
+        if touched:
+            session.execute(touch, {'ids': touched})
+
+        inserted += len(inserts)
+        updated += len(updates)
+        unchanged += len(touched) + len(rehashed)
+
+    return UpsertStats(inserted, updated, unchanged)
@@ -0,0 +1,327 @@
+import collections
+import typing
+from concurrent.futures import Executor
+from datetime import datetime, date, timedelta
+
+from statsbiblioteket.harvest import Harvest
+from statsbiblioteket.harvest.synch import logger
+from statsbiblioteket.harvest.typesystem.harvest_types import DayEntry, \
+    Expense, TaskAssignment
+
+ProjectData = typing.NamedTuple('ProjectData', [
+    ('project_id', int),
+    ('project_name', str),
+    ('task_assignments', typing.List[TaskAssignment]),
+    ('expenses', typing.Optional[typing.List[Expense]]),
+    ('timesheets', typing.List[DayEntry])])
+"""The per-project data fetched from Harvest. expenses is None if the
+expenses module is not enabled"""
+
+ProjectRef = typing.NamedTuple('ProjectRef', [
+    ('id', int),
+    ('name', str),
+    ('earliest_record_at', typing.Optional[str]),
+    ('latest_record_at', typing.Optional[str])])
+"""A project to fetch, with the hint_earliest_record_at and
+hint_latest_record_at of the project, if known"""
+
+WINDOW_MONTHS = {'month': 1, 'quarter': 3, 'year': 12}
+"""The number of months in each size of date window"""
+
+
+def _parse_date(value: str) -> date:
+    return datetime.strptime(value[:10], '%Y-%m-%d').date()
+
+
+def _add_months(day: date, months: int) -> date:
+    """
+    :return: the first day of the month the given number of months after the
+    month of day
+    """
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def date_windows(from_date: str, to_date: str, size: str = None,
+                 earliest: str = None, latest: str = None) -> \
+        typing.List[typing.Tuple[str, str]]:
+    """
+    Split a date interval into calendar aligned windows.
+
+    If the earliest and latest record dates of a project are known, the
+    windows before the earliest and after the latest record are not made
+    separately, but covered by the first and the last window. So no records
+    are missed if the hints are out of date, while a long interval does not
+    cause many requests for empty windows.
+
+    :param from_date: The first day of the interval, YYYY-MM-DD
+    :param to_date: The last day of the interval, YYYY-MM-DD
+    :param size: 'month', 'quarter' or 'year', or None for a single window
+    :param earliest: The date of the earliest record, if known
+    :param latest: The date of the latest record, if known
+    :return: (first day, last day) tuples, YYYY-MM-DD, covering the interval
+    """
+    if size is None:
+        return [(from_date, to_date)]
+    months = WINDOW_MONTHS[size]
+
+    start = _parse_date(from_date)
+    end = _parse_date(to_date)
+    if earliest is not None:
+        start = max(start, _parse_date(earliest))
+    if latest is not None:
+        end = min(end, _parse_date(latest))
+    if start > end:
+        # No records in the interval, according to the hints
+        return [(from_date, to_date)]
+
+    windows = []
+    window_start = date(start.year, (start.month - 1) // months * months + 1,
+                        1)
+    while window_start <= end:
+        window_end = _add_months(window_start, months) - timedelta(days=1)
+        windows.append([window_start.isoformat(), window_end.isoformat()])
+        window_start = window_end + timedelta(days=1)
+    windows[0][0] = from_date
+    windows[-1][1] = to_date
+    return [tuple(window) for window in windows]
+
+
+def may_have_records(project: ProjectRef, from_date: str, to_date: str) -> \
+        bool:
+    """
+    :param project: The project
+    :param from_date: The first day of the interval, YYYY-MM-DD
+    :param to_date: The last day of the interval, YYYY-MM-DD
+    :return: False if the earliest and latest record dates of the project
+    show that it has no records in the interval. Projects without the dates
+    may have records
+    """
+    if project.earliest_record_at is None or project.latest_record_at is None:
+        return True
+    return project.earliest_record_at[:10] <= to_date and \
+        project.latest_record_at[:10] >= from_date
+
+
+def ordered_parallel_map(executor: Executor, function: typing.Callable,
+                         items: typing.Iterable,
+                         window: int) -> typing.Iterator:
+    """
+    Map function over items on the executor, yielding the results in the
+    order of items.
+
+    At most window calls are in flight (or finished, but not yet consumed) at
+    any time, so a slow consumer does not cause the fetched data to pile up
+    in memory.
+
+    :param executor: The executor to run the calls on
+    :param function: The function to call for each item
+    :param items: The items to map over
+    :param window: The maximum number of outstanding calls
+    :return: a generator of the results of function, in the order of items
+    """
+    pending = collections.deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # If the consumer stops early (or fails) do not start the remaining
+        # calls
+        for future in pending:
+            future.cancel()
+
+
+def fetch_project_data(hrvst: Harvest,
+                       projects: typing.Iterable[ProjectRef],
+                       from_date: str, to_date: str, backup_expenses: bool,
+                       executor: Executor, window: int,
+                       task_assignments_since: str = None,
+                       timesheets_since: str = None,
+                       date_window: str = None,
+                       timesheets: bool = True,
+                       skip_timesheets: typing.Container[int] = ()) -> \
+        typing.Iterator[ProjectData]:
+    """
+    Fetch the task assignments, expenses and timesheets of each project
+    concurrently
+
+    The timesheets of a project can be fetched in date windows, which are
+    fetched in parallel and merged, so the responses stay small and a slow
+    project does not hold up the others.
+
+    :param hrvst: The Harvest client. It is shared by all the workers
+    :param projects: The projects to fetch. These must not be session bound
+    objects, as they are used from the worker threads
+    :param from_date: Get timesheets starting from this date
+    :param to_date: Get timesheets until this date
+    :param backup_expenses: If true, fetch the expenses of each project
+    :param executor: The executor that runs the fetches
+    :param window: The maximum number of requests fetched ahead of the
+    consumer
+    :param task_assignments_since: If set, only fetch the task assignments
+    updated since this date
+    :param timesheets_since: If set, only fetch the timesheets updated since
+    this date
+    :param date_window: 'month', 'quarter' or 'year' to fetch the timesheets
+    in windows of that size, or None to fetch them in one request
+    :param timesheets: If false, the timesheets are not fetched, as they are
+    fetched per user instead, and the timesheets of ProjectData are empty
+    :param skip_timesheets: The ids of the projects whose timesheets are not
+    fetched, like the ones may_have_records rules out
+    :return: a generator of ProjectData, in the order of projects
+    """
+
+    def jobs() -> typing.Iterator[typing.Tuple[ProjectRef, typing.Any]]:
+        for project in projects:
+            yield project, None
+            if not timesheets or project.id in skip_timesheets:
+                continue
+            for dates in date_windows(from_date, to_date, date_window,
+                                      project.earliest_record_at,
+                                      project.latest_record_at):
+                yield project, dates
+
+    def fetch(job: typing.Tuple[ProjectRef, typing.Any]):
+        project, dates = job
+        if dates is None:
+            logger.debug("Fetching Project {name}", name=project.name)
+            task_assignments = hrvst.get_all_tasks_from_project(
+                    project.id, updated_since=task_assignments_since)
+
+            expenses = None
+            if backup_expenses:  # Only if the expenses module is enabled
+                expenses = hrvst.expenses_for_project(project.id)
+            return project, dates, (task_assignments, expenses)
+
+        start_date, end_date = dates
+        timesheets = hrvst.timesheets_for_project(
+                project.id, start_date=start_date, end_date=end_date,
+                updated_since=timesheets_since)
+        return project, dates, timesheets
+
+    # The jobs of a project are consecutive, and the results come in the
+    # order of the jobs, so the timesheets of a project are complete when the
+    # next project starts
+    current = None
+    for project, dates, data in ordered_parallel_map(executor, fetch, jobs(),
+                                                     window):
+        if dates is None:
+            if current is not None:
+                yield current
+            task_assignments, expenses = data
+            current = ProjectData(project.id, project.name, task_assignments,
+                                  expenses, [])
+        else:
+            current.timesheets.extend(data)
+    if current is not None:
+        yield current
+
+
+ENTRIES_STRATEGIES = ('auto', 'project', 'user')
+"""The ways of fetching the timesheets: per project, per user, or whichever
+needs the fewest requests"""
+
+
+def project_timesheet_requests(projects: typing.Iterable[ProjectRef],
+                               from_date: str, to_date: str,
+                               date_window: str = None,
+                               skip_timesheets: typing.Container[int] = ()) \
+        -> int:
+    """
+    :param projects: The projects
+    :param from_date: The first day of the interval, YYYY-MM-DD
+    :param to_date: The last day of the interval, YYYY-MM-DD
+    :param date_window: The size of the date windows, or None
+    :param skip_timesheets: The ids of the projects whose timesheets are not
+    fetched
+    :return: the number of requests fetch_project_data makes for the
+    timesheets of the projects
+    """
+    return sum(len(date_windows(from_date, to_date, date_window,
+                                project.earliest_record_at,
+                                project.latest_record_at))
+               for project in projects if project.id not in skip_timesheets)
+
+
+def user_timesheet_requests(users: int, from_date: str, to_date: str,
+                            date_window: str = None, earliest: str = None,
+                            latest: str = None) -> int:
+    """
+    :param users: The number of users
+    :param from_date: The first day of the interval, YYYY-MM-DD
+    :param to_date: The last day of the interval, YYYY-MM-DD
+    :param date_window: The size of the date windows, or None
+    :param earliest: The date of the earliest record of the account, if known
+    :param latest: The date of the latest record of the account, if known
+    :return: the number of requests fetch_user_timesheets makes for the
+    timesheets of the users
+    """
+    return users * len(date_windows(from_date, to_date, date_window,
+                                    earliest, latest))
+
+
+def choose_entries_strategy(strategy: str, user_requests: int,
+                            project_requests: int) -> str:
+    """
+    :param strategy: One of ENTRIES_STRATEGIES
+    :param user_requests: The number of timesheet requests per user, see
+    user_timesheet_requests
+    :param project_requests: The number of timesheet requests per project,
+    see project_timesheet_requests
+    :return: 'project' or 'user'. For 'auto', the one with the fewest
+    requests, per project if they are equal
+    """
+    if strategy != 'auto':
+        return strategy
+    if user_requests < project_requests:
+        return 'user'
+    return 'project'
+
+
+def fetch_user_timesheets(hrvst: Harvest, user_ids: typing.Iterable[int],
+                          from_date: str, to_date: str, executor: Executor,
+                          window: int, timesheets_since: str = None,
+                          date_window: str = None, earliest: str = None,
+                          latest: str = None) -> \
+        typing.Iterator[typing.Tuple[int, typing.List[DayEntry]]]:
+    """
+    Fetch the timesheets of each user, across all projects, concurrently
+
+    :param hrvst: The Harvest client. It is shared by all the workers
+    :param user_ids: The ids of the users
+    :param from_date: Get timesheets starting from this date
+    :param to_date: Get timesheets until this date
+    :param executor: The executor that runs the fetches
+    :param window: The maximum number of requests fetched ahead of the
+    consumer
+    :param timesheets_since: If set, only fetch the timesheets updated since
+    this date
+    :param date_window: 'month', 'quarter' or 'year' to fetch the timesheets
+    in windows of that size, or None to fetch them in one request
+    :param earliest: The date of the earliest record of the account, if known
+    :param latest: The date of the latest record of the account, if known
+    :return: a generator of (user id, timesheets), in the order of user_ids
+    """
+    windows = date_windows(from_date, to_date, date_window, earliest, latest)
+
+    def fetch(job: typing.Tuple[int, typing.Tuple[str, str]]):
+        user_id, (start_date, end_date) = job
+        return user_id, hrvst.timesheets_for_user(
+                user_id, start_date=start_date, end_date=end_date,
+                updated_since=timesheets_since)
+
+    jobs = ((user_id, dates) for user_id in user_ids for dates in windows)
+    current_user, current = None, []
+    for user_id, timesheets in ordered_parallel_map(executor, fetch, jobs,
+                                                    window):
+        if user_id != current_user:
+            if current_user is not None:
+                yield current_user, current
+            current_user, current = user_id, []
+        current.extend(timesheets)
+    if current_user is not None:
+        yield current_user, current
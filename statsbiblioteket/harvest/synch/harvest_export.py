@@ -0,0 +1,100 @@
+import argparse
+import logging
+from datetime import date
+
+from statsbiblioteket.harvest import Harvest
+from statsbiblioteket.harvest.export import export, EXPORT_TYPES, \
+    EXPORT_BATCH_SIZE
+from statsbiblioteket.harvest.synch import logger
+from statsbiblioteket.harvest.synch.harvest_synch import curdir, \
+    setup_logging, get_harvest_credentials
+
+
+EXPORT_DESCRIPTION = 'Exports timesheets, expenses and invoices from your ' \
+                     'harvest domain to parquet files, partitioned by month'
+
+
+def create_export_parser():
+    parser = argparse.ArgumentParser(prog='harvest export',
+                                     description=EXPORT_DESCRIPTION)
+    add_export_arguments(parser)
+    return parser
+
+
+def add_export_arguments(parser):
+    """
+    Add the options of the export to the parser, which is also the export
+    subcommand of the harvest parser
+
+    :param parser: The argparse parser
+    """
+    parser.add_argument('--domain', action='store', required=True,
+                        help='The Harvest domain to export',
+                        dest='harvestDomain')
+    parser.add_argument('--user', action='store', required=False,
+                        help='The harvest user to connect as',
+                        dest='harvestUser')
+    parser.add_argument('--password', action='store', required=False,
+                        help='The harvest password.\n If not specified, '
+                             'the username and password is read from the '
+                             'file ~/.harvest', dest='harvestPassword')
+
+    parser.add_argument('--out', action='store', required=True,
+                        dest='outDir',
+                        help='The directory to write the parquet files to, '
+                             'as <out>/<table>/month=YYYY-MM/part-0.parquet')
+
+    parser.add_argument('--from', action='store', default='1970-01-01',
+                        dest='fromDate',
+                        help='Export data starting from this date, '
+                             'format YYYY-MM-DD (default: %(default)s)')
+    parser.add_argument('--to', action='store',
+                        default="{:%Y-%m-%d}".format(date.today()),
+                        dest='toDate',
+                        help='Export data until this date, format '
+                             'YYYY-MM-DD (default: %(default)s)')
+
+    parser.add_argument('--tables', action='store', nargs='+',
+                        choices=sorted(EXPORT_TYPES),
+                        default=sorted(EXPORT_TYPES), dest='tables',
+                        help='The tables to export (default: %(default)s)')
+
+    parser.add_argument('--batchSize', action='store', type=int,
+                        default=EXPORT_BATCH_SIZE, dest='batchSize',
+                        help='The number of rows per parquet row group '
+                             '(default: %(default)s)')
+
+    parser.add_argument('--logConf', default=curdir + '/default_log.ini',
+                        help='the log file (default: %(default)s)',
+                        dest='logconffile')
+
+
+def export_main(argv=None):
+    parser = create_export_parser()
+    run_export(parser, parser.parse_args(argv))
+
+
+def run_export(parser, args):
+    """
+    Run the export
+
+    :param parser: The parser of the arguments, to report errors
+    :param args: The parsed arguments
+    """
+    setup_logging(args)
+
+    harvest_pass, harvest_user = get_harvest_credentials(args)
+    if harvest_pass is None:
+        parser.error('Failed to read harvest password from either '
+                     'commandline or the ~/.harvest file')
+
+    # The exported objects are only read, so they are decoded as plain records
+    hrvst = Harvest.basic(uri=args.harvestDomain, email=harvest_user,
+                          password=harvest_pass, records=True)
+    exported = export(hrvst, args.outDir, from_date=args.fromDate,
+                      to_date=args.toDate, tables=args.tables,
+                      batch_size=args.batchSize)
+    for table, rows in sorted(exported.items()):
+        logger.info('{table}: {rows} rows', table=table, rows=rows)
+
+    logging.shutdown()
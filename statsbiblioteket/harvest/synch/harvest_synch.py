@@ -1,14 +1,17 @@
 import argparse
+import cProfile
 import logging
 import logging.config
+import typing
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date
 from os import path
 from os.path import expanduser
 
+import inflection
 import sqlalchemy
 import sqlalchemy.orm
-from sqlalchemy import func
-from sqlalchemy.orm import Query
+from sqlalchemy import func, select, literal, exists, DateTime
 from sqlalchemy.orm import attributes
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.base import object_state
@@ -16,17 +19,37 @@ from sqlalchemy.sql.ddl import CreateTable
 
 from statsbiblioteket.harvest import Harvest
 from statsbiblioteket.harvest.synch import logger
-from statsbiblioteket.harvest.typesystem.harvest_types import *
-from statsbiblioteket.harvest.typesystem.orm_types import versioned_session
+from statsbiblioteket.harvest.synch.bulk_upsert import bulk_upsert, \
+    add_content_hash_columns
+from statsbiblioteket.harvest.synch.fetching import fetch_project_data, \
+    ProjectRef, WINDOW_MONTHS, ENTRIES_STRATEGIES, choose_entries_strategy, \
+    fetch_user_timesheets, may_have_records, project_timesheet_requests, \
+    user_timesheet_requests
+from statsbiblioteket.harvest.synch.profiling import PhaseProfiler, \
+    profiled_versioned_session
+from statsbiblioteket.harvest.synch.sync_state import update_high_water_mark, \
+    updated_since, promote_high_water_mark, start_checkpoint, Checkpoint, \
+    get_checkpoint, set_last_project, set_last_user, clear_checkpoint, \
+    set_checkpoint_options
+from statsbiblioteket.harvest.typesystem.harvest_types import User, Task, \
+    Client, Invoice, Project, TaskAssignment, Expense, DayEntry
+from statsbiblioteket.harvest.typesystem.orm_types import HarvestDBType, \
+    versioned_columns, VERSION_COLUMN_NAME
 
 curdir = path.dirname(path.realpath(__file__))
 
+profiler = PhaseProfiler()
+
+MARK_CHUNK_SIZE = 500
+"""The number of projects whose timesheets are marked as updated at a time"""
+
 
 def create_parser():
     parser = argparse.ArgumentParser(
             description='Backups all harvest data from your harvest domain '
                         'to a SQL database', )
-    parser.add_argument('--domain', action='store', required=True,
+    # Required, unless the export subcommand is used
+    parser.add_argument('--domain', action='store',
                         help='The Harvest domain to backup',
                         dest='harvestDomain')
     parser.add_argument('--user', action='store', required=False,
@@ -56,10 +79,87 @@ def create_parser():
                         help='Get timesheets until this date, format '
                              'YYYY-MM-DD (default: %(default)s)')
 
+    parser.add_argument('--incremental', action='store_true',
+                        dest='incremental',
+                        help='Only fetch the objects updated since the last '
+                             'backup. Objects deleted in Harvest are not '
+                             'archived in this mode')
+
+    parser.add_argument('--workers', action='store', type=int, default=4,
+                        dest='workers',
+                        help='The number of concurrent requests used to fetch '
+                             'the tasks, expenses and timesheets of the '
+                             'projects (default: %(default)s)')
+
+    parser.add_argument('--window', action='store', default=None,
+                        choices=sorted(WINDOW_MONTHS), dest='dateWindow',
+                        help='Fetch the timesheets of each project in date '
+                             'windows of this size, in parallel, to keep the '
+                             'responses small (default: the whole interval '
+                             'in one request)')
+
+    parser.add_argument('--entriesStrategy', action='store', default='auto',
+                        choices=ENTRIES_STRATEGIES, dest='entriesStrategy',
+                        help='Fetch the timesheets per project or per user. '
+                             'auto uses the one with the fewest requests '
+                             '(default: %(default)s)')
+
+    parser.add_argument('--pruneProjects', action='store_true',
+                        dest='pruneProjects',
+                        help='Do not fetch the timesheets of the projects '
+                             'whose earliest and latest record dates, as '
+                             'reported by Harvest, are outside the --from '
+                             'and --to interval. Projects without these '
+                             'dates are always fetched')
+
+    parser.add_argument('--cacheDir', action='store', default=None,
+                        dest='cacheDir',
+                        help='If set, Harvest responses are cached in this '
+                             'directory, and only downloaded again if they '
+                             'have changed')
+
+    parser.add_argument('--checkpoint', action='store_true',
+                        dest='checkpoint',
+                        help='Commit after each project, and record the '
+                             'progress, so an interrupted backup can be '
+                             'resumed with --resume')
+
+    parser.add_argument('--checkpointSize', action='store', type=int,
+                        default=0, dest='checkpointSize',
+                        help='With --checkpoint, only commit when at least '
+                             'this many objects have been stored since the '
+                             'last commit (default: %(default)s, commit after '
+                             'each project)')
+
+    parser.add_argument('--resume', action='store_true', dest='resume',
+                        help='Resume an interrupted checkpointed backup from '
+                             'the last finished project. It must use the same '
+                             '--from, --to and --incremental options. Implies '
+                             '--checkpoint')
+
+    parser.add_argument('--profile', action='store', default=None,
+                        dest='profile', metavar='FILE',
+                        help='Write a json report of the duration and the '
+                             'number of objects of each phase of the backup '
+                             'to this file, or - for stdout')
+
+    parser.add_argument('--cProfile', action='store', default=None,
+                        dest='cProfile', metavar='FILE',
+                        help='Run the backup under cProfile, and write the '
+                             'statistics to this file, for use with pstats')
+
     parser.add_argument('--logConf', default=curdir + '/default_log.ini',
                         help='the log file (default: %(default)s)',
                         dest='logconffile')
 
+    # Imported here, as the export module imports from this module
+    from statsbiblioteket.harvest.synch.harvest_export import \
+        add_export_arguments, EXPORT_DESCRIPTION
+    commands = parser.add_subparsers(dest='command', title='commands')
+    add_export_arguments(commands.add_parser(
+            'export', help='Export to parquet files instead of backing up',
+            description=EXPORT_DESCRIPTION))
+
     datetime.today()
     return parser
 
@@ -67,6 +167,12 @@ def create_parser():
 def main():
     parser = create_parser()
     args = parser.parse_args()
+    if args.command == 'export':
+        from statsbiblioteket.harvest.synch.harvest_export import run_export
+        run_export(parser, args)
+        return
+    if args.harvestDomain is None:
+        parser.error('the following arguments are required: --domain')
 
     setup_logging(args)
 
@@ -74,7 +180,16 @@ def main():
     if harvest_pass is None:
         parser.error('Failed to read harvest password from either commandline or the ~/.harvest file')
 
-    backup(args, harvest_user, harvest_pass)
+    if args.cProfile:
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            backup(args, harvest_user, harvest_pass)
+        finally:
+            profile.disable()
+            profile.dump_stats(args.cProfile)
+    else:
+        backup(args, harvest_user, harvest_pass)
 
     logging.shutdown()
 
@@ -136,92 +251,438 @@ def backup(args, harvest_user, harvest_pass):
 
     session_maker = sessionmaker(bind=engine)
 
+    global profiler
+    profiler = PhaseProfiler()
+
     global session
     session = session_maker()  # type: Session
-    versioned_session(session)
+    profiled_versioned_session(session, profiler)
 
     global transaction_now
     transaction_now = session.scalar(func.now())
 
+    hrvst = None
+    pruned = {'projects': 0, 'requests': 0}
+    failed = False
     try:
         # Create the tables that are missing
         HarvestDBType.metadata.create_all(engine)
+        # And the columns added since the tables were created
+        add_content_hash_columns(engine)
+
+        checkpointing = args.checkpoint or args.resume
+        checkpoint = None
+        if checkpointing:
+            checkpoint = begin_checkpoint(args)
 
         # Connect to Harvest
+        # Keep a warm connection for each worker
         hrvst = Harvest.basic(uri=args.harvestDomain, email=harvest_user,
-                              password=harvest_pass)  # type: Harvest
+                              password=harvest_pass,
+                              pool_maxsize=max(10, args.workers),
+                              cache_dir=args.cacheDir)  # type: Harvest
 
         # Determine modules, for what not to back up
-        who_am_i = hrvst.who_am_i
+        with profiler.phase('fetch.who_am_i'):
+            who_am_i = hrvst.who_am_i
         # True/false if we have installed this module
         backup_expenses = who_am_i['company']['modules']['expenses'] or False
         backup_invoices = who_am_i['company']['modules']['invoices'] or False
 
         # printDDL(engine)
 
+        incremental = args.incremental
+
         # Backup the User, Task and Client lists. These are usually very short
-        upsert(User, hrvst.users())
-        archive_untouched_rows(User)
+        users = synch_list(User, hrvst.users, incremental)
+        if incremental:
+            users = session.query(User).all()
+        user_ids = sorted(user.id for user in users)
 
-        upsert(Task, hrvst.tasks())
-        archive_untouched_rows(Task)
+        synch_list(Task, hrvst.tasks, incremental)
 
-        upsert(Client, hrvst.clients())
-        archive_untouched_rows(Client)
+        synch_list(Client, hrvst.clients, incremental)
 
         # If the invoice module is enabled, back up invoices
         if backup_invoices:
-            upsert(Invoice, hrvst.invoices())
-            archive_untouched_rows(Invoice)
+            synch_list(Invoice, hrvst.invoices, incremental)
 
         # Backup and store the projects list
-        projects = upsert(Project, hrvst.projects())
-        archive_untouched_rows(Project)
+        projects = synch_list(Project, hrvst.projects, incremental)
+        if incremental:
+            # Only the changed projects were fetched, but all of them can
+            # have new timesheets
+            projects = session.query(Project).order_by(Project.id).all()
 
         from_date = args.fromDate
         to_date = args.toDate
         logger.info('For date inverval {from_} to {to}', from_=from_date, to=to_date)
-        for project in projects:  # For each Project
-            logger.info("For Project {name}", name=project.name)
-            # logformat.add_indent()
-
-            # Get Tasks for each project and store them
-            task_assignments = hrvst.get_all_tasks_from_project(project.id)
-            upsert(TaskAssignment, task_assignments)
-
-            # Get Expenses for each project and store them
-            if backup_expenses:  # Only if the expenses module is enabled
-                upsert(Expense, hrvst.expenses_for_project(project.id))
-
-            # get Timesheets for each project and store them
-            timesheets = hrvst.timesheets_for_project(project.id,
-                                                      start_date=from_date,
-                                                      end_date=to_date)
-            upsert(DayEntry, timesheets)
-
-            # logformat.sub_indent()
+        # Only plain tuples are handed to the fetching threads, as the
+        # project objects are bound to the session
+        # The projects are backed up in order of id, so the progress of a
+        # checkpointed backup is the id of the last finished project
+        project_refs = sorted(ProjectRef(project.id, project.name,
+                                         project.hint_earliest_record_at,
+                                         project.hint_latest_record_at)
+                              for project in projects)
+        earliest, latest = record_date_range(project_refs)
+        skip_timesheets = set()
+        if args.pruneProjects:
+            # The hints of Harvest rule out the projects without records in
+            # the interval, and with them all their timesheet requests
+            skip_timesheets = {project.id for project in project_refs
+                               if not may_have_records(project, from_date,
+                                                       to_date)}
+        # Before the resume filtering, which changes the numbers
+        strategy = resolve_entries_strategy(
+                args, checkpoint,
+                user_requests=user_timesheet_requests(
+                        len(user_ids), from_date, to_date, args.dateWindow,
+                        earliest, latest),
+                project_requests=project_timesheet_requests(
+                        project_refs, from_date, to_date, args.dateWindow,
+                        skip_timesheets))
+        logger.info('Fetching the timesheets per {strategy}',
+                    strategy=strategy)
+        if checkpoint is not None and checkpoint.last_project is not None:
+            project_refs = [project for project in project_refs
+                            if project.id > checkpoint.last_project]
+            logger.info('Resuming after project {id}, {count} projects left',
+                        id=checkpoint.last_project, count=len(project_refs))
+        if checkpoint is not None and checkpoint.last_user is not None:
+            user_ids = [user_id for user_id in user_ids
+                        if user_id > checkpoint.last_user]
+            logger.info('Resuming after user {id}, {count} users left',
+                        id=checkpoint.last_user, count=len(user_ids))
+        if strategy == 'project':
+            skipped = [project for project in project_refs
+                       if project.id in skip_timesheets]
+            pruned['projects'] = len(skipped)
+            pruned['requests'] = project_timesheet_requests(
+                    skipped, from_date, to_date, args.dateWindow)
+        stored_since_commit = 0
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            fetched = fetch_project_data(hrvst, project_refs,
+                                         from_date=from_date, to_date=to_date,
+                                         backup_expenses=backup_expenses,
+                                         executor=executor,
+                                         window=2 * args.workers,
+                                         task_assignments_since=since(
+                                                 TaskAssignment, incremental),
+                                         timesheets_since=since(DayEntry,
+                                                                incremental),
+                                         date_window=args.dateWindow,
+                                         timesheets=strategy == 'project',
+                                         skip_timesheets=skip_timesheets)
+            # The fetching happens in the worker threads, while this thread
+            # is the only one using the session
+            fetched = profiler.iterate('fetch.project_data', fetched)
+            for project_data in fetched:  # For each Project
+                logger.info("For Project {name}",
+                            name=project_data.project_name)
+                # logformat.add_indent()
+
+                # Store the Tasks for each project
+                upsert(TaskAssignment, project_data.task_assignments)
+                update_high_water_mark(session, TaskAssignment,
+                                       project_data.task_assignments,
+                                       pending=checkpointing)
+
+                # Store the Expenses for each project
+                if project_data.expenses is not None:
+                    upsert(Expense, project_data.expenses)
+
+                # Store the Timesheets for each project
+                if strategy == 'project':
+                    upsert(DayEntry, project_data.timesheets)
+                    update_high_water_mark(session, DayEntry,
+                                           project_data.timesheets,
+                                           pending=checkpointing)
+
+                if checkpointing:
+                    stored_since_commit += len(project_data.task_assignments) \
+                                           + len(project_data.expenses or []) \
+                                           + len(project_data.timesheets)
+                    if stored_since_commit >= args.checkpointSize:
+                        commit_checkpoint(project_id=project_data.project_id)
+                        stored_since_commit = 0
+
+                # logformat.sub_indent()
+
+            if strategy == 'user':
+                fetched = fetch_user_timesheets(
+                        hrvst, user_ids, from_date=from_date, to_date=to_date,
+                        executor=executor, window=2 * args.workers,
+                        timesheets_since=since(DayEntry, incremental),
+                        date_window=args.dateWindow, earliest=earliest,
+                        latest=latest)
+                fetched = profiler.iterate('fetch.user_timesheets', fetched)
+                for user_id, timesheets in fetched:  # For each User
+                    logger.info("For User {id}", id=user_id)
+                    upsert(DayEntry, timesheets)
+                    update_high_water_mark(session, DayEntry, timesheets,
+                                           pending=checkpointing)
+
+                    if checkpointing:
+                        stored_since_commit += len(timesheets)
+                        if stored_since_commit >= args.checkpointSize:
+                            commit_checkpoint(user_id=user_id)
+                            stored_since_commit = 0
 
         # Flush changes to be sure they are available for the following queries
-        session.flush()
+        flush()
 
-        archive_untouched_rows(TaskAssignment)
-        archive_untouched_rows(Expense)
+        if checkpointing:
+            promote_high_water_mark(session, TaskAssignment)
+            promote_high_water_mark(session, DayEntry)
+            clear_checkpoint(session)
+
+        if incremental:
+            # Untouched rows are not known to be deleted in incremental mode
+            commit()
+            return
 
         # All DayEntries outside the given range is marked as updated,
         # to prevent
         # them from being archived
-        mark_timesheets_as_updated(DayEntry, from_date, to_date)
+        with profiler.phase('mark_timesheets'):
+            # The stored timesheets of the pruned projects were not fetched
+            # again, but are still there
+            mark_timesheets_as_updated(
+                    DayEntry, from_date, to_date,
+                    project_ids=skip_timesheets if strategy == 'project'
+                    else ())
         # Now, all DayEntries outside the from_date->to_date range are
         # marked as updated, and
         # all which we got from harvest are marked as updated. Any that
         # remains are
         # entries in the given range, which NO LONGER exist in Harvest. These
         # should be archived
-        archive_untouched_rows(DayEntry)
+        archive_untouched_tables(backup_invoices)
 
-        session.commit()
+        commit()
+    except BaseException:
+        failed = True
+        raise
     finally:
         session.close()
+        try:
+            report(args, hrvst, pruned)
+        except Exception:
+            # A failing report must not replace the error of the backup
+            logger.exception('Failed to report on the backup')
+            if not failed:
+                raise
+
+
+def report(args, hrvst: typing.Optional[Harvest],
+           pruned: typing.Dict[str, int]):
+    """
+    Log the requests of the backup, and write the profile if requested
+
+    :param args: The parsed arguments
+    :param hrvst: The Harvest client, or None if the backup failed before it
+    was created
+    :param pruned: The number of skipped projects and timesheet requests
+    :return: None
+    """
+    if hrvst is not None:
+        logger.info("Requests per endpoint:\n{table}",
+                    table=hrvst.metrics.summary())
+    if args.pruneProjects:
+        logger.info("Skipped {requests} timesheet requests for {projects} "
+                    "projects without records in the interval", **pruned)
+    if args.profile:
+        endpoints = hrvst.metrics.endpoints() if hrvst is not None else {}
+        profiler.write(args.profile, endpoints=endpoints, pruned=pruned)
+
+
+def begin_checkpoint(args) -> typing.Optional[Checkpoint]:
+    """
+    Start a checkpointed backup, or resume the unfinished one with --resume.
+    When resuming, transaction_now is set to the timestamp of the unfinished
+    backup, so the rows it touched are not archived
+
+    :param args: The command line arguments
+    :return: The progress of the unfinished backup, or None if the backup
+    starts from the beginning
+    :raises ValueError: if the unfinished backup used other options
+    """
+    global transaction_now
+    options = checkpoint_options(args)
+    checkpoint = get_checkpoint(session) if args.resume else None
+    if checkpoint is None:
+        if args.resume:
+            logger.info('No unfinished backup to resume, starting a new one')
+        start_checkpoint(session, transaction_now, options)
+        commit()
+        return None
+
+    if not compatible_options(checkpoint.options, options):
+        raise ValueError('Cannot resume a backup with the options {old} with '
+                         'the options {new}'.format(old=checkpoint.options,
+                                                    new=options))
+    transaction_now = checkpoint.transaction_now
+    logger.info('Resuming the backup started at {started}',
+                started=transaction_now)
+    return checkpoint
+
+
+def checkpoint_options(args) -> typing.Dict[str, typing.Any]:
+    """
+    :param args: The command line arguments
+    :return: The options a resumed backup must share with the unfinished one
+    """
+    return {'from': args.fromDate, 'to': args.toDate,
+            'incremental': args.incremental,
+            'entries_strategy': args.entriesStrategy}
+
+
+def compatible_options(stored: typing.Dict[str, typing.Any],
+                       requested: typing.Dict[str, typing.Any]) -> bool:
+    """
+    :param stored: The options of the unfinished backup
+    :param requested: The options of the resuming backup
+    :return: True if the resuming backup can continue the unfinished one. The
+    entries strategy auto matches the strategy it was resolved to
+    """
+    stored, requested = dict(stored), dict(requested)
+    old = stored.pop('entries_strategy', None)
+    new = requested.pop('entries_strategy', None)
+    return stored == requested and (old == new or 'auto' in (old, new))
+
+
+def resolve_entries_strategy(args, checkpoint: typing.Optional[Checkpoint],
+                             user_requests: int, project_requests: int) -> \
+        str:
+    """
+    Resolve the entries strategy of the backup. A resumed backup uses the
+    strategy the unfinished backup resolved, as auto can resolve differently
+    once the account has changed, and the timesheets of the unfinished users
+    or projects would then not be fetched. A checkpointed backup records the
+    resolved strategy for that reason
+
+    :param args: The command line arguments
+    :param checkpoint: The progress of the resumed backup, or None
+    :param user_requests: The number of timesheet requests per user
+    :param project_requests: The number of timesheet requests per project
+    :return: 'project' or 'user'
+    """
+    if checkpoint is not None:
+        resolved = checkpoint.options.get('entries_strategy')
+        if resolved != 'auto':
+            return resolved
+    strategy = choose_entries_strategy(args.entriesStrategy, user_requests,
+                                       project_requests)
+    if args.checkpoint or args.resume:
+        set_checkpoint_options(session, dict(checkpoint_options(args),
+                                             entries_strategy=strategy))
+    return strategy
+
+
+def commit_checkpoint(project_id: int = None, user_id: int = None):
+    """
+    Record the last finished project or user of a checkpointed backup,
+    commit, and clear the session to keep the memory use flat
+
+    :param project_id: The id of the last finished project
+    :param user_id: The id of the last finished user, when the timesheets are
+    fetched per user
+    :return: None
+    """
+    if project_id is not None:
+        set_last_project(session, project_id)
+        logger.debug('Checkpoint after project {id}', id=project_id)
+    if user_id is not None:
+        set_last_user(session, user_id)
+        logger.debug('Checkpoint after user {id}', id=user_id)
+    commit()
+    session.expunge_all()
+
+
+def flush():
+    """
+    Flush the session, timed as the flush phase
+    """
+    with profiler.phase('flush'):
+        session.flush()
+
+
+def commit():
+    """
+    Commit the session, timed as the commit phase
+    """
+    with profiler.phase('commit'):
+        session.commit()
+
+
+def record_date_range(projects: typing.List[ProjectRef]) -> \
+        typing.Tuple[typing.Optional[str], typing.Optional[str]]:
+    """
+    :param projects: The projects
+    :return: The dates of the earliest and the latest record of all the
+    projects, each None if not known for all the projects
+    """
+    earliest = [project.earliest_record_at for project in projects]
+    latest = [project.latest_record_at for project in projects]
+    if not projects or None in earliest or None in latest:
+        return None, None
+    return min(earliest), max(latest)
+
+
+def since(cls: HarvestDBType, incremental: bool) -> typing.Optional[str]:
+    """
+    :param cls: The class of the objects
+    :param incremental: True if only changed objects should be fetched
+    :return: The updated_since parameter to fetch the objects of cls with, or
+    None if all objects should be fetched
+    """
+    if incremental:
+        return updated_since(session, cls)
+    return None
+
+
+def synch_list(cls: HarvestDBType,
+               fetch: typing.Callable[..., typing.List[HarvestDBType]],
+               incremental: bool) -> typing.Set[HarvestDBType]:
+    """
+    Fetches and upserts a list of objects. The rows of the objects that no
+    longer exists in Harvest are left untouched, for
+    archive_untouched_tables at the end of the backup.
+    In incremental mode, only the objects updated since the high water mark
+    of the class are fetched.
+
+    :param cls: The class of the objects
+    :param fetch: The Harvest method that fetches the objects. It must accept
+    an updated_since keyword argument
+    :param incremental: True if only changed objects should be fetched
+    :return: The updated objects
+    """
+    with profiler.phase('fetch.' + cls.__tablename__) as phase:
+        harvest_objects = fetch(updated_since=since(cls, incremental))
+        phase.objects = len(harvest_objects)
+    db_objects = upsert(cls, harvest_objects)
+    update_high_water_mark(session, cls, harvest_objects)
+    return db_objects
+
+
+def archive_untouched_tables(backup_invoices: bool):
+    """
+    Archive the untouched rows of all the backed up tables. The referring
+    tables go first, so their rows are gone before the rows they refer to
+
+    :param backup_invoices: True if the invoices were backed up
+    :return: None
+    """
+    archive_untouched_rows(DayEntry)
+    archive_untouched_rows(Expense)
+    archive_untouched_rows(TaskAssignment)
+    archive_untouched_rows(Project)
+    if backup_invoices:
+        archive_untouched_rows(Invoice)
+    archive_untouched_rows(Client)
+    archive_untouched_rows(Task)
+    archive_untouched_rows(User)
 
 
 def archive_untouched_rows(cls: HarvestDBType):
@@ -232,47 +693,96 @@ def archive_untouched_rows(cls: HarvestDBType):
     For all tables (except DayEntry) we can now remove all objects
     which where the _updated_on field is less than the transaction_now
 
+    The rows are copied to the history table with a single INSERT ... SELECT
+    and removed with a single DELETE, so no objects are loaded. Rows that the
+    remaining rows of other tables refer to are kept, as deleting them would
+    break the foreign keys.
+
     :param cls: the Class of the objects to archive
     :return: None
     """
-    query = session.query(cls)  # type: Query
-    query = query.filter(cls._updated_on < transaction_now)  # Add a filter
-    # query.delete() #Bulk delete
-    untouched_rows = query.all()  # type: typing.List[HarvestDBType]
+    # Flush pending changes, as the bulk statements bypass the unit of work
+    flush()
 
-    def delete(row: HarvestDBType):
-        logger.debug('deleted {}', row)
-        session.delete(row)
+    with profiler.phase('archive.' + cls.__tablename__) as phase:
+        phase.objects = _archive_untouched_rows(cls)
 
-    map(delete, untouched_rows)
 
+def _archive_untouched_rows(cls: HarvestDBType) -> int:
+    table = cls.__table__
+    history_table = cls.__history_mapper__.local_table
+    untouched = table.c._updated_on < transaction_now
+    referenced = _referenced(table)
+    if referenced is not None:
+        untouched = untouched & ~referenced
 
-def mark_timesheets_as_updated(cls: DayEntry, from_date, to_date):
+    columns = [col_key for _, col_key in versioned_columns(cls)]
+    columns.append(VERSION_COLUMN_NAME)
+    old_rows = select([table.c[col_key] for col_key in columns] + [
+        literal(datetime.utcnow(), type_=DateTime)]).where(untouched)
+    session.execute(history_table.insert().from_select(
+            columns + ['changed'], old_rows))
+
+    deleted = session.execute(table.delete().where(untouched)).rowcount
+    if deleted:
+        logger.info("{className}: Archived {count} rows",
+                    className=inflection.pluralize(cls.__name__),
+                    count=deleted)
+    return deleted
+
+
+def _referenced(table: sqlalchemy.Table):
+    """
+    :param table: The table
+    :return: a condition that is true for the rows of the table that rows of
+    other tables refer to, or None if no table refers to it
+    """
+    conditions = [exists().where(foreign_key.parent == foreign_key.column)
+                  for other in table.metadata.sorted_tables
+                  for foreign_key in other.foreign_keys
+                  if foreign_key.column.table is table]
+    if not conditions:
+        return None
+    return sqlalchemy.or_(*conditions)
+
+
+def mark_timesheets_as_updated(cls: DayEntry, from_date, to_date,
+                               project_ids: typing.Iterable[int] = ()):
     """
-    Mark all timesheets outside the given range as "updated", so they will not
-    be regarded as untouched and thus archived
+    Mark all timesheets outside the given range, and all timesheets of the
+    given projects, as "updated", so they will not be regarded as untouched
+    and thus archived
 
     :param cls: The class of DayEntry
     :param from_date: The start of the date range
     :param to_date: The end of the date range
+    :param project_ids: The ids of the projects whose timesheets were not
+    fetched
     :return: None
     """
-    query = session.query(cls)  # type: Query
+    query = session.query(cls)  # type: sqlalchemy.orm.Query
     query = query.filter((cls._updated_on < transaction_now) & (
         (cls.spent_at < from_date) | (cls.spent_at > to_date)
     ))
-    query = query.order_by(cls.project_id)
-    # query.update({DayEntry._updated_on : transaction_now}) # Bulk operation
-    old_rows = query.all()  # type: typing.List[DayEntry]
-
-    for old_row in old_rows:
-        old_row._updated_on = transaction_now
-        logger.debug("Updated timestamp on time entry '{id}' from '{project}' at '{date}' "
-            "by '{user}'", id=old_row.id,
-                                 project=old_row.linked_project,
-                                 date=old_row.spent_at,
-                                 user=old_row.linked_user)
-    session.flush()
+    updated = query.update({cls._updated_on: transaction_now},
+                           synchronize_session=False)  # Bulk operation
+    logger.debug("Updated timestamp on {count} time entries outside "
+                 "{from_} to {to}", count=updated, from_=from_date, to=to_date)
+
+    project_ids = sorted(project_ids)
+    updated = 0
+    # In chunks, to stay below the limit of bound parameters of the database
+    for start in range(0, len(project_ids), MARK_CHUNK_SIZE):
+        chunk = project_ids[start:start + MARK_CHUNK_SIZE]
+        query = session.query(cls).filter(
+                (cls._updated_on < transaction_now) &
+                cls.project_id.in_(chunk))
+        updated += query.update({cls._updated_on: transaction_now},
+                                synchronize_session=False)
+    if project_ids:
+        logger.debug("Updated timestamp on {count} time entries of "
+                     "{projects} projects", count=updated,
+                     projects=len(project_ids))
 
 
 def get_history(db_object: HarvestDBType) -> typing.Dict:
@@ -306,30 +816,28 @@ def get_history(db_object: HarvestDBType) -> typing.Dict:
 def upsert(cls: HarvestDBType, harvest_objects: typing.Set[HarvestDBType]) -> \
         typing.Set[HarvestDBType]:
     """
-    Upserts the given objects in the database
+    Upserts the given objects in the database, with the bulk upsert engine.
+    The objects are not added to the session.
     :param cls: The class of the objects (which implicitly denote the sql
     table)
     :param harvest_objects: The objects to create or update in the database
-    :return: The updated objects
+    :return: The given objects
     """
     class_name = inflection.pluralize(cls.__name__)  # Used for log messages
 
     logger.info("{className}: Merging {count} harvest objects with database", className=class_name, count=len(harvest_objects))
     # logformat.add_indent()
-    db_objects = set()
-    for harvest_object in harvest_objects:
-        db_object = session.merge(harvest_object)  # type: HarvestDBType
-        db_objects.add(db_object)
-        # if session.is_modified(db_object):
-        history = get_history(db_object)
-        if history:
-            logger.debug('Object {id} was changed: {row}', id=str(db_object), row=history)
-        # Mark as updated so it wont get cleaned
-        db_object._updated_on = transaction_now
-
-    session.flush()
+    # Flush pending changes, as the bulk statements bypass the unit of work
+    flush()
+    with profiler.phase('upsert.' + cls.__tablename__,
+                        objects=len(harvest_objects)):
+        stats = bulk_upsert(session, cls, harvest_objects, transaction_now)
+    logger.debug("{className}: {inserted} inserted, {updated} updated, "
+                 "{unchanged} unchanged", className=class_name,
+                 inserted=stats.inserted, updated=stats.updated,
+                 unchanged=stats.unchanged)
     # logformat.sub_indent()
-    return db_objects
+    return harvest_objects
 
 
 def print_DDL(engine):
@@ -0,0 +1,152 @@
+import collections
+import contextlib
+import json
+import threading
+import time
+import typing
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from statsbiblioteket.harvest.typesystem.orm_types import versioned_session
+
+
+class PhaseStats(object):
+    """
+    The number of times a phase ran, its total duration, and the number of
+    objects it handled
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.objects = 0
+
+
+class PhaseProfiler(object):
+    """
+    Accumulates the durations of the phases of a backup. Phases can nest, so
+    the duration of an upsert includes the duration of the flush it does
+    """
+
+    def __init__(self, clock: typing.Callable[[], float] = time.perf_counter):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._started = clock()
+        self._started_at = datetime.utcnow()
+        # The stats of each phase, in the order the phases first ran
+        self.phases = collections.OrderedDict(
+        )  # type: typing.Dict[str, PhaseStats]
+
+    def add(self, name: str, seconds: float, objects: int = 0):
+        """
+        Record a run of a phase
+
+        :param name: The name of the phase, like upsert.day_entries
+        :param seconds: The duration of the run
+        :param objects: The number of objects handled by the run
+        :return: None
+        """
+        with self._lock:
+            stats = self.phases.get(name)
+            if stats is None:
+                stats = PhaseStats()
+                self.phases[name] = stats
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.objects += objects
+
+    @contextlib.contextmanager
+    def phase(self, name: str, objects: int = 0):
+        """
+        Time the body of the with statement as a run of a phase. The yielded
+        PhaseStats can be used to count the objects handled, if they are not
+        known beforehand
+
+        :param name: The name of the phase
+        :param objects: The number of objects handled
+        """
+        run = PhaseStats()
+        run.objects = objects
+        start = self._clock()
+        try:
+            yield run
+        finally:
+            self.add(name, self._clock() - start, run.objects)
+
+    def iterate(self, name: str, iterable: typing.Iterable) -> typing.Iterator:
+        """
+        Time how long the consumer waits for each item of an iterable, such as
+        the data fetched by the worker threads
+
+        :param name: The name of the phase
+        :param iterable: The iterable
+        :return: a generator of the items of iterable
+        """
+        iterator = iter(iterable)
+        while True:
+            start = self._clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(name, self._clock() - start)
+                return
+            self.add(name, self._clock() - start, 1)
+            yield item
+
+    def report(self, **extra) -> typing.Dict:
+        """
+        :param extra: Additional entries of the report
+        :return: the report, as a json serialisable dict
+        """
+        with self._lock:
+            phases = [{'name': name, 'calls': stats.calls,
+                       'seconds': round(stats.seconds, 6),
+                       'objects': stats.objects}
+                      for name, stats in self.phases.items()]
+        report = {'started': self._started_at.isoformat() + 'Z',
+                  'total_seconds': round(self._clock() - self._started, 6),
+                  'phases': phases}
+        report.update(extra)
+        return report
+
+    def write(self, path: str, **extra):
+        """
+        Write the report as json
+
+        :param path: The file to write, or - for stdout
+        :param extra: Additional entries of the report
+        :return: None
+        """
+        text = json.dumps(self.report(**extra), indent=2)
+        if path == '-':
+            print(text)
+        else:
+            with open(path, 'w', encoding='utf-8') as report_file:
+                report_file.write(text + '\n')
+
+
+def profiled_versioned_session(session: Session, profiler: PhaseProfiler):
+    """
+    Add the versioning listener to the session, timing the history generation
+    of each flush as the history phase
+
+    :param session: The session to wrap
+    :param profiler: The profiler
+    :return: None
+    """
+    started = []
+
+    # The before_flush listeners run in the order they are added, so these
+    # two surround the versioning listener
+    @event.listens_for(session, 'before_flush')
+    def start_history(session, flush_context, instances):
+        started.append(time.perf_counter())
+
+    versioned_session(session)
+
+    @event.listens_for(session, 'before_flush')
+    def stop_history(session, flush_context, instances):
+        profiler.add('history', time.perf_counter() - started.pop(),
+                     len(session.dirty) + len(session.deleted))
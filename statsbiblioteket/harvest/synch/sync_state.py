@@ -0,0 +1,255 @@
+import json
+import typing
+from datetime import datetime
+
+from sqlalchemy import Table, Column, String, select
+from sqlalchemy.orm import Session
+
+from statsbiblioteket.harvest.typesystem.orm_types import HarvestDBType
+
+sync_state = Table('sync_state', HarvestDBType.metadata,
+                   Column('key', String, primary_key=True),
+                   Column('value', String, nullable=True))
+"""Key/value table with the state of the synchronisation, such as the high
+water marks of the incremental mode. It is created together with the other
+tables"""
+
+CHECKPOINT_PREFIX = 'checkpoint.'
+"""The prefix of the sync state keys of an unfinished checkpointed backup"""
+
+
+def get_state(session: Session, key: str) -> typing.Optional[str]:
+    """
+    Get a value from the sync state table
+
+    :param session: The session
+    :param key: The key of the value
+    :return: The value, or None if no value is stored for key
+    """
+    return session.execute(select([sync_state.c.value]).where(
+            sync_state.c.key == key)).scalar()
+
+
+def set_state(session: Session, key: str, value: typing.Optional[str]):
+    """
+    Store a value in the sync state table, replacing any previous value
+
+    :param session: The session
+    :param key: The key of the value
+    :param value: The value
+    :return: None
+    """
+    updated = session.execute(sync_state.update().where(
+            sync_state.c.key == key).values(value=value))
+    if updated.rowcount == 0:
+        session.execute(sync_state.insert().values(key=key, value=value))
+
+
+def delete_state(session: Session, key_prefix: str):
+    """
+    Remove the values whose keys start with the given prefix from the sync
+    state table
+
+    :param session: The session
+    :param key_prefix: The prefix of the keys
+    :return: None
+    """
+    session.execute(sync_state.delete().where(
+            sync_state.c.key.startswith(key_prefix)))
+
+
+def high_water_mark_key(cls: typing.Type[HarvestDBType],
+                        pending: bool = False) -> str:
+    """
+    :param cls: The class of the objects
+    :param pending: True for the key of the mark of an unfinished
+    checkpointed backup
+    :return: The sync state key of the high water mark of the class
+    """
+    key = 'high_water_mark.' + cls.__tablename__
+    if pending:
+        return CHECKPOINT_PREFIX + key
+    return key
+
+
+def get_high_water_mark(session: Session,
+                        cls: typing.Type[HarvestDBType]) -> \
+        typing.Optional[str]:
+    """
+    Get the high water mark of a class, ie. the largest updated_at of the
+    objects of the class seen by an earlier synchronisation
+
+    :param session: The session
+    :param cls: The class of the objects
+    :return: The high water mark, or None if the class was never synchronised
+    """
+    return get_state(session, high_water_mark_key(cls))
+
+
+def update_high_water_mark(session: Session,
+                           cls: typing.Type[HarvestDBType],
+                           harvest_objects: typing.Iterable[HarvestDBType],
+                           pending: bool = False):
+    """
+    Raise the high water mark of a class to the largest updated_at of the
+    given objects. The mark is never lowered
+
+    :param session: The session
+    :param cls: The class of the objects
+    :param harvest_objects: The objects fetched from harvest
+    :param pending: True to raise the pending mark of a checkpointed backup
+    instead, which only takes effect when the backup finishes, see
+    promote_high_water_mark. Otherwise an interrupted backup would make the
+    next incremental backup skip the objects it did not get to
+    :return: None
+    """
+    key = high_water_mark_key(cls, pending)
+    mark = get_state(session, key)
+    for harvest_object in harvest_objects:
+        updated_at = harvest_object.updated_at
+        if updated_at is not None and (mark is None or updated_at > mark):
+            mark = updated_at
+    if mark is not None:
+        set_state(session, key, mark)
+
+
+def promote_high_water_mark(session: Session,
+                            cls: typing.Type[HarvestDBType]):
+    """
+    Raise the high water mark of a class to the pending mark of a finished
+    checkpointed backup
+
+    :param session: The session
+    :param cls: The class of the objects
+    :return: None
+    """
+    pending = get_state(session, high_water_mark_key(cls, pending=True))
+    mark = get_high_water_mark(session, cls)
+    if pending is not None and (mark is None or pending > mark):
+        set_state(session, high_water_mark_key(cls), pending)
+
+
+def updated_since(session: Session, cls: typing.Type[HarvestDBType]) -> \
+        typing.Optional[str]:
+    """
+    Get the updated_since parameter that fetches the objects of a class that
+    changed since the last synchronisation
+
+    :param session: The session
+    :param cls: The class of the objects
+    :return: The high water mark in the harvest updated_since format
+    ('YYYY-MM-DD HH:MM'), or None if the class was never synchronised
+    """
+    mark = get_high_water_mark(session, cls)
+    if mark is None:
+        return None
+    # Truncating to the minute can only cause a few objects to be fetched again
+    return mark.replace('T', ' ')[:16]
+
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+Checkpoint = typing.NamedTuple('Checkpoint',
+                               [('transaction_now', datetime),
+                                ('options', typing.Dict[str, typing.Any]),
+                                ('last_project', typing.Optional[int]),
+                                ('last_user', typing.Optional[int])])
+"""The progress of an unfinished checkpointed backup"""
+
+
+def _format_timestamp(timestamp: datetime) -> str:
+    if timestamp.tzinfo is not None:
+        return timestamp.strftime(TIMESTAMP_FORMAT + '%z')
+    return timestamp.strftime(TIMESTAMP_FORMAT)
+
+
+def _parse_timestamp(value: str) -> datetime:
+    if len(value) > len('YYYY-MM-DD HH:MM:SS.ffffff'):
+        return datetime.strptime(value, TIMESTAMP_FORMAT + '%z')
+    return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+def start_checkpoint(session: Session, transaction_now: datetime,
+                     options: typing.Dict[str, typing.Any]):
+    """
+    Record the start of a checkpointed backup, replacing any unfinished one
+
+    :param session: The session
+    :param transaction_now: The timestamp the backup marks the rows it
+    touches with. A resumed backup must use the same timestamp, so the rows
+    touched before the interruption are not archived
+    :param options: The options of the backup, which a resumed backup must
+    use too
+    :return: None
+    """
+    clear_checkpoint(session)
+    set_state(session, CHECKPOINT_PREFIX + 'transaction_now',
+              _format_timestamp(transaction_now))
+    set_checkpoint_options(session, options)
+
+
+def set_checkpoint_options(session: Session,
+                           options: typing.Dict[str, typing.Any]):
+    """
+    Replace the options of the unfinished checkpointed backup, such as when
+    an option is resolved after the backup started
+
+    :param session: The session
+    :param options: The options of the backup
+    :return: None
+    """
+    set_state(session, CHECKPOINT_PREFIX + 'options',
+              json.dumps(options, sort_keys=True))
+
+
+def get_checkpoint(session: Session) -> typing.Optional[Checkpoint]:
+    """
+    :param session: The session
+    :return: The progress of the unfinished checkpointed backup, or None if
+    there is none
+    """
+    transaction_now = get_state(session, CHECKPOINT_PREFIX + 'transaction_now')
+    if transaction_now is None:
+        return None
+    options = get_state(session, CHECKPOINT_PREFIX + 'options')
+    last_project = get_state(session, CHECKPOINT_PREFIX + 'last_project')
+    last_user = get_state(session, CHECKPOINT_PREFIX + 'last_user')
+    return Checkpoint(_parse_timestamp(transaction_now), json.loads(options),
+                      None if last_project is None else int(last_project),
+                      None if last_user is None else int(last_user))
+
+
+def set_last_project(session: Session, project_id: int):
+    """
+    Record that a checkpointed backup has finished the projects up to and
+    including the given one. The projects are backed up in order of id
+
+    :param session: The session
+    :param project_id: The id of the last finished project
+    :return: None
+    """
+    set_state(session, CHECKPOINT_PREFIX + 'last_project', str(project_id))
+
+
+def set_last_user(session: Session, user_id: int):
+    """
+    Record that a checkpointed backup has finished the timesheets of the
+    users up to and including the given one, when fetching the timesheets per
+    user. The users are backed up in order of id, after all the projects
+
+    :param session: The session
+    :param user_id: The id of the last finished user
+    :return: None
+    """
+    set_state(session, CHECKPOINT_PREFIX + 'last_user', str(user_id))
+
+
+def clear_checkpoint(session: Session):
+    """
+    Remove the progress of a checkpointed backup, including the pending high
+    water marks
+
+    :param session: The session
+    :return: None
+    """
+    delete_state(session, CHECKPOINT_PREFIX)
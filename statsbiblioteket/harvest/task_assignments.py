@@ -7,13 +7,18 @@ from statsbiblioteket.harvest.typesystem.harvest_types import Task
 class TaskAssignments(Rest):
     # Task Assignment: Assigning tasks to projects
 
-    def get_all_tasks_from_project(self, project_id) -> typing.List[Task]:
+    def get_all_tasks_from_project(self, project_id, updated_since=None) -> \
+            typing.List[Task]:
         """
         GET ALL TASKS ASSIGNED TO A GIVEN PROJECT
+        (optionally updated since a particular date)
         /projects/#{project_id}/task_assignments
         """
         url = '/projects/{0}/task_assignments'.format(project_id)
-        return self._get(url)
+        params = {}
+        if updated_since is not None:
+            params['updated_since'] = updated_since
+        return self._get(url, params=params)
 
     def get_one_task_assigment(self, project_id, task_id):
         """
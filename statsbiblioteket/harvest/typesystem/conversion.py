@@ -0,0 +1,73 @@
+"""
+Conversion of the json values of Harvest to python types.
+
+Harvest is not consistent in the types, ie. ids and booleans are sometimes
+sent as strings, and calling the python type is not always right, like
+bool('false').
+"""
+import datetime
+import decimal
+import typing
+
+_TRUE_STRINGS = frozenset(['true', 't', 'yes', '1'])
+_FALSE_STRINGS = frozenset(['false', 'f', 'no', '0', ''])
+
+
+def to_bool(value) -> bool:
+    if isinstance(value, str):
+        text = value.strip().lower()
+        if text in _TRUE_STRINGS:
+            return True
+        if text in _FALSE_STRINGS:
+            return False
+    elif value in (0, 1):
+        return bool(value)
+    raise ValueError(value)
+
+
+def to_int(value) -> int:
+    if isinstance(value, str):
+        try:
+            return int(value.strip())
+        except ValueError:
+            # Like 12.0
+            value = float(value)
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError(value)
+    return int(value)
+
+
+def to_decimal(value) -> decimal.Decimal:
+    # Through str, so a float converts to the number it prints as
+    try:
+        return decimal.Decimal(str(value).strip())
+    except decimal.InvalidOperation:
+        raise ValueError(value)
+
+
+def to_date(value) -> datetime.date:
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    # Also accepts timestamps, like 2016-01-01T10:00:00Z
+    return datetime.datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+
+
+CONVERTERS = {bool: to_bool, int: to_int, decimal.Decimal: to_decimal,
+              datetime.date: to_date}
+"""The conversions to the python types where calling the type is wrong"""
+
+
+def converter(python_type: type) -> typing.Callable:
+    """
+    :param python_type: The python type
+    :return: a function converting a json value to the python type. None is
+    kept, and a value that cannot be converted raises ValueError or TypeError
+    """
+    convert = CONVERTERS.get(python_type, python_type)
+
+    def convert_value(value):
+        if value is None or type(value) is python_type:
+            return value
+        return convert(value)
+
+    return convert_value
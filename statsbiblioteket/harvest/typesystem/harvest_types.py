@@ -5,7 +5,6 @@ import inflection
 from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey
 from sqlalchemy.orm import relationship
 
-import statsbiblioteket
 from statsbiblioteket.harvest.typesystem.orm_types import HarvestDBType, HarvestType
 
 
@@ -19,13 +18,12 @@ def json_to_harvest(json_dict: typing.Dict):
     was found
     """
     if len(json_dict) == 1:  # Just one value
-        (first_key, _), = json_dict.items()
+        (first_key, fields), = json_dict.items()
 
-        class_name = inflection.camelize(first_key)
-
-        class_ = getattr(statsbiblioteket.harvest.module_name, class_name)
-
-        return class_(**json_dict[first_key])
+        class_ = _HARVEST_CLASSES.get(first_key)
+        if class_ is not None and isinstance(fields, dict):
+            return class_(**fields)
+        return json_dict
 
     if 'for_day' in json_dict and 'day_entries' in json_dict:
         # Special handling for Day
@@ -868,3 +866,11 @@ class Day(HarvestType):
         super().__init__()
         self.day_entries = day_entries
         self.for_day = for_day
+
+
+# The json key of each harvest type, like "day_entry" for DayEntry, built once
+# instead of camelizing the key of every decoded object
+_HARVEST_CLASSES = {inflection.underscore(class_.__name__): class_
+                    for class_ in (Client, Contact, Day, DayEntry, Expense,
+                                   ExpenseCategory, Invoice, Project, Task,
+                                   TaskAssignment, User)}
@@ -1,3 +1,4 @@
+import collections
 import datetime
 import logging
 import typing
@@ -5,19 +6,19 @@ from json import JSONEncoder
 from pprint import pformat
 
 import inflection
-from sqlalchemy import Table, Column, ForeignKeyConstraint, Integer, DateTime
+from sqlalchemy import Table, Column, ForeignKeyConstraint, Integer, \
+    DateTime, String
 from sqlalchemy import event, util
 from sqlalchemy import func
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.orm import Mapper
 from sqlalchemy.orm import Session
-from sqlalchemy.orm import mapper, attributes, object_mapper
+from sqlalchemy.orm import mapper, attributes, object_mapper, class_mapper
 from sqlalchemy.orm.collections import InstrumentedDict, InstrumentedList, \
     InstrumentedSet
-from sqlalchemy.orm.exc import UnmappedColumnError
+from sqlalchemy.orm.exc import UnmappedColumnError, UnmappedClassError
 from sqlalchemy.orm.properties import RelationshipProperty
-from sqlalchemy.orm.state import InstanceState
 
 VERSION_COLUMN_NAME = 'version'
 
@@ -28,6 +29,20 @@ VERSION_META = "version_meta"
 UNVERSIONED = "unversioned"
 
 
+CONTENT_HASH_COLUMN_NAME = '_content_hash'
+CONTENT_HASH_LENGTH = 32
+
+
+HistoryPlan = typing.NamedTuple('HistoryPlan', [
+    ('columns', typing.Tuple[typing.Tuple[str, str], ...]),
+    ('tables', typing.Tuple[typing.Tuple[Table, typing.Tuple[str, ...]], ...]),
+    ('keys', typing.FrozenSet[str])])
+"""The columns a versioned class copies into its history tables, as
+(property key, history column key) tuples, the history tables, base class
+first, with the keys of the columns to insert into each of them, and the
+property keys of the columns"""
+
+
 def remove_private_fields(fields: typing.Dict) -> typing.Dict:
     """
     Remove fields whose key start with _ (indicating private-ness)
@@ -45,10 +60,11 @@ class TypeToJSON(JSONEncoder):
     """
 
     def default(self, object_to_encode):
-        key = inflection.underscore(object_to_encode.__class__.__name__)
-        values = object_to_encode.__dict__
-        values = remove_private_fields(values)
-        values = remove_sqlalchemy_fields(values)
+        key, columns = _type_info(type(object_to_encode))
+        if hasattr(object_to_encode, '_asdict'):  # A plain record
+            values = object_to_encode._asdict()
+        else:
+            values = _public_values(object_to_encode, columns)
 
         encoded = {key: values}
         return encoded
@@ -80,6 +96,48 @@ def remove_fields_with_value_none(fields: typing.Dict) -> typing.Dict:
     return fields
 
 
+TypeInfo = typing.NamedTuple(
+        'TypeInfo', [('key', str),
+                     ('columns', typing.Optional[typing.Tuple[str]])])
+"""The json key of a harvest type, and its public column attribute names, or
+None if the type is not mapped"""
+
+_type_infos = {}  # type: typing.Dict[type, TypeInfo]
+
+
+def _type_info(cls_: type) -> TypeInfo:
+    """
+    :param cls_: The class
+    :return: the TypeInfo of the class, computed on the first call
+    """
+    info = _type_infos.get(cls_)
+    if info is None:
+        try:
+            columns = tuple(prop.key for prop in
+                            class_mapper(cls_).column_attrs
+                            if not prop.key.startswith('_'))
+        except UnmappedClassError:
+            columns = None
+        info = TypeInfo(inflection.underscore(cls_.__name__), columns)
+        _type_infos[cls_] = info
+    return info
+
+
+def _public_values(harvest_object,
+                   columns: typing.Optional[typing.Tuple[str]]) -> typing.Dict:
+    """
+    :param harvest_object: The harvest type object
+    :param columns: The public column attribute names of its class, or None
+    to filter the instance dict instead
+    :return: the public fields of the object
+    """
+    values = harvest_object.__dict__
+    if columns is None:
+        values = remove_private_fields(values)
+        return remove_sqlalchemy_fields(values)
+    return {key: values[key] for key in columns if key in values}
+
+
 class HarvestType(object):
     """
     Base class of all the HarvestType objects
@@ -87,17 +145,21 @@ class HarvestType(object):
 
     def __eq__(self, other):
         if type(other) is type(self):
+            columns = _type_info(type(self)).columns
+            if columns is None:
+                him = remove_fields_with_value_none(
+                        _public_values(self, columns))
+                her = remove_fields_with_value_none(
+                        _public_values(other, columns))
+                return him == her
+
+            # Unset and None fields are equal
             him = self.__dict__
-            him = remove_private_fields(him)
-            him = remove_sqlalchemy_fields(him)
-            him = remove_fields_with_value_none(him)
-
             her = other.__dict__
-            her = remove_private_fields(her)
-            her = remove_sqlalchemy_fields(her)
-            her = remove_fields_with_value_none(her)
-
-            return him == her
+            for key in columns:
+                if him.get(key) != her.get(key):
+                    return False
+            return True
         return False
 
     def __ne__(self, other):
@@ -112,11 +174,8 @@ class HarvestType(object):
         return False
 
     def __repr__(self, *args, **kwargs):
-        name = inflection.underscore(self.__class__.__name__)
-        values = self.__dict__
-        values = remove_private_fields(values)
-        values = remove_sqlalchemy_fields(values)
-        return pformat({name: values})
+        name, columns = _type_info(type(self))
+        return pformat({name: _public_values(self, columns)})
 
     def __str__(self, *args, **kwargs):
         mytype = self.__class__.__name__
@@ -128,6 +187,27 @@ class HarvestType(object):
         return mytype + ': ' + name
 
 
+# The attribute names and the column attribute names of each class
+# constructed by _lenient_constructor
+_Fields = typing.Tuple[typing.FrozenSet[str], typing.FrozenSet[str]]
+_class_fields = {}  # type: typing.Dict[type, _Fields]
+
+
+def _fields_of(cls_: type) -> _Fields:
+    """
+    :param cls_: The class
+    :return: the names of the attributes of the class, and the names of the
+    mapped column attributes, computed on the first call. By then the mappers
+    are configured, so all the attributes are there
+    """
+    fields = _class_fields.get(cls_)
+    if fields is None:
+        columns = frozenset(prop.key
+                            for prop in class_mapper(cls_).column_attrs)
+        fields = (frozenset(dir(cls_)), columns)
+        _class_fields[cls_] = fields
+    return fields
+
 
 def _lenient_constructor(self, **kwargs):
     """A simple constructor that allows initialization from kwargs.
@@ -140,13 +220,21 @@ def _lenient_constructor(self, **kwargs):
     see _declarative_constructor
     """
     cls_ = type(self)
-    for key in kwargs:
-        if not hasattr(cls_, key):
-            logging.debug("%r is an invalid keyword argument for %s" % (
-            key, cls_.__name__))
-            setattr(self, '_' + key, kwargs[key])
+    known, columns = _fields_of(cls_)
+    values = self.__dict__
+    for key, value in kwargs.items():
+        if key in columns:
+            # The object is new, so there is no history to record. Setting the
+            # value directly skips the attribute events, which dominate the
+            # cost of decoding. A session inserts or merges the values of the
+            # instance dict all the same
+            values[key] = value
+        elif key in known:
+            setattr(self, key, value)
         else:
-            setattr(self, key, kwargs[key])
+            logging.debug("%r is an invalid keyword argument for %s", key,
+                          cls_.__name__)
+            setattr(self, '_' + key, value)
 
 
 def mymap(cls, *arg, **kw):
@@ -170,6 +258,14 @@ class HarvestDBType(HarvestDeclarativeType):
         return Column(DateTime, server_default=func.now(), onupdate=func.now(),
                       info=UNVERSIONED,)
 
+    @declared_attr
+    def _content_hash(cls):
+        """The _content_hash column holds a hash of the versioned columns, as
+        last received from Harvest, so unchanged rows can be recognised
+        without comparing all the columns. It is set by bulk_upsert"""
+        return Column(String(CONTENT_HASH_LENGTH), info=UNVERSIONED)
+
+
 def col_references_table(col: Column, table: Table):
     """
     :param col: The column
@@ -211,13 +307,6 @@ def _history_mapper(local_mapper: Mapper):
     # Get the class of the object to map
     cls = local_mapper.class_
 
-    # set the "active_history" flag
-    # on on column-mapped attributes so that the old version
-    # of the info is always loaded (currently sets it on all attributes)
-    for prop in local_mapper._prop_set:
-        prop.active_history = True
-        getattr(cls, prop.key).active_history = True
-
     super_mapper = local_mapper.inherits
     super_history_mapper = getattr(cls, '__history_mapper__', None)
 
@@ -269,7 +358,7 @@ def _history_mapper(local_mapper: Mapper):
             orig_prop = local_mapper.get_property_by_column(column)
             # carry over column re-mappings
             if len(orig_prop.columns) > 1 or \
-                            orig_prop.columns[0].key != orig_prop.key:
+                    orig_prop.columns[0].key != orig_prop.key:
                 properties[orig_prop.key] = tuple(
                     col.info['history_copy'] for col in orig_prop.columns)
 
@@ -287,14 +376,14 @@ def _history_mapper(local_mapper: Mapper):
         # This column is optional and can be omitted.
         cols.append(
             Column('changed', DateTime, default=datetime.datetime.utcnow,
-                info=version_meta))
+                   info=version_meta))
 
         if super_fks:
             cols.append(ForeignKeyConstraint(*zip(*super_fks)))
 
         table = Table(local_mapper.local_table.name + '_history',
-            local_mapper.local_table.metadata, *cols,
-            schema=local_mapper.local_table.schema)
+                      local_mapper.local_table.metadata, *cols,
+                      schema=local_mapper.local_table.schema)
     else:
         # single table inheritance.  take any additional columns that may have
         # been added and add them to the history table.
@@ -316,16 +405,100 @@ def _history_mapper(local_mapper: Mapper):
     versioned_cls = type.__new__(type, "%sHistory" % cls.__name__, bases, {})
 
     m = mapper(versioned_cls, table, inherits=super_history_mapper,
-        polymorphic_on=polymorphic_on,
-        polymorphic_identity=local_mapper.polymorphic_identity,
-        properties=properties)
+               polymorphic_on=polymorphic_on,
+               polymorphic_identity=local_mapper.polymorphic_identity,
+               properties=properties)
     cls.__history_mapper__ = m
 
     if not super_history_mapper:
         local_mapper.local_table.append_column(
             Column(VERSION_COLUMN_NAME, Integer, default=1, nullable=False))
         local_mapper.add_property("version",
-            local_mapper.local_table.c.version)
+                                  local_mapper.local_table.c.version)
+
+    cls.__history_plan__ = _compile_history_plan(local_mapper)
+
+    # set the "active_history" flag on the attributes copied into the history
+    # table, so their old values are loaded before they are changed. The
+    # other attributes, like _updated_on and the relationships, are not
+    # versioned, so their old values are not needed
+    for prop_key, _ in cls.__history_plan__.columns:
+        prop = local_mapper._props[prop_key]
+        prop.active_history = True
+        getattr(cls, prop_key).active_history = True
+
+
+def _compile_history_plan(local_mapper: Mapper) -> HistoryPlan:
+    """
+    Work out which columns of a versioned class are copied into its history
+    tables, so the versioning of each object is a loop over a tuple
+
+    :param local_mapper: The mapper of the versioned class
+    :return: the plan
+    """
+    history_mapper = local_mapper.class_.__history_mapper__
+    columns = []
+    tables = []
+    for om, hm in zip(local_mapper.iterate_to_root(),
+                      history_mapper.iterate_to_root()):
+        if hm.single:
+            continue
+        table_columns = []
+        for hist_col in hm.local_table.c:
+            if _is_versioning_col(hist_col):
+                continue
+            if _is_unversioned(hist_col):
+                continue
+            obj_col = om.local_table.c[hist_col.key]
+            try:
+                prop = local_mapper.get_property_by_column(obj_col)
+            except UnmappedColumnError:
+                # in the case of single table inheritance, there may be
+                # columns on the mapped table intended for the subclass only.
+                # the "unmapped" status of the subclass column on the
+                # base class is a feature of the declarative module.
+                continue
+            columns.append((prop.key, hist_col.key))
+            table_columns.append(hist_col.key)
+        table_columns.append(VERSION_COLUMN_NAME)
+        tables.append((hm.local_table, tuple(table_columns)))
+    tables.reverse()
+    return HistoryPlan(tuple(columns), tuple(tables),
+                       frozenset(prop_key for prop_key, _ in columns))
+
+
+def history_plan(cls) -> HistoryPlan:
+    """
+    :param cls: The versioned class
+    :return: the columns and tables the class is versioned into
+    """
+    return cls.__history_plan__
+
+
+def versioned_columns(cls) -> typing.List[typing.Tuple[str, str]]:
+    """
+    Get the columns of a versioned class that are copied into its history
+    table
+
+    :param cls: The versioned class
+    :return: a list of (property key, column key) tuples
+    """
+    return list(history_plan(cls).columns)
+
+
+def public_columns(cls) -> typing.List[typing.Tuple[str, Column]]:
+    """
+    Get the columns of a mapped class that hold harvest data, that is all
+    but the private and the versioning columns
+
+    :param cls: The mapped class
+    :return: a list of (property key, column) tuples
+    """
+    return [(prop.key, prop.columns[0])
+            for prop in class_mapper(cls).column_attrs
+            if not prop.key.startswith('_') and
+            prop.key != VERSION_COLUMN_NAME and
+            not _is_versioning_col(prop.columns[0])]
 
 
 def versioned_objects(object_set: typing.Set):
@@ -359,61 +532,28 @@ def create_version(obj, session: Session, deleted=False):
 
     obj_changed = False
 
-    for om, hm in zip(obj_mapper.iterate_to_root(),
-            history_mapper.iterate_to_root()):
-        if hm.single:
-            continue
-
-        for hist_col in hm.local_table.c:
-            if _is_versioning_col(hist_col):
-                continue
-            if _is_unversioned(hist_col):
-                continue
-
-            obj_col = om.local_table.c[hist_col.key]
-
-            # get the value of the
-            # attribute based on the MapperProperty related to the
-            # mapped column.  this will allow usage of MapperProperties
-            # that have a different keyname than that of the mapped column.
-            try:
-                prop = obj_mapper.get_property_by_column(obj_col)
-            except UnmappedColumnError:
-                # in the case of single table inheritance, there may be
-                # columns on the mapped table intended for the subclass only.
-                # the "unmapped" status of the subclass column on the
-                # base class is a feature of the declarative module.
-                continue
-
-            # expired object attributes and also deferred cols might not
-            # be in the dict.  force it to load no matter what by
-            # using getattr().
-            if prop.key not in obj_state.dict:
-                getattr(obj, prop.key)
-
-            added, unchanged, deleted = attributes.get_history(obj, prop.key)
-
-            if deleted:
-                attr[prop.key] = deleted[0]
-                obj_changed = True
-            elif unchanged:
-                attr[prop.key] = unchanged[0]
-            elif added:
-                # if the attribute had no value.
-                attr[prop.key] = added[0]
-                obj_changed = True
+    for prop_key, _ in history_plan(type(obj)).columns:
+        # expired object attributes and also deferred cols might not
+        # be in the dict.  force it to load no matter what by
+        # using getattr().
+        if prop_key not in obj_state.dict:
+            getattr(obj, prop_key)
+
+        added, unchanged, old = attributes.get_history(obj, prop_key)
+
+        if old:
+            attr[prop_key] = old[0]
+            obj_changed = True
+        elif unchanged:
+            attr[prop_key] = unchanged[0]
+        elif added:
+            # if the attribute had no value.
+            attr[prop_key] = added[0]
+            obj_changed = True
 
     if not obj_changed:
         # not changed, but we have relationships.  OK, check those too
-        for prop in obj_mapper.iterate_properties:
-            if isinstance(prop, RelationshipProperty) and \
-                    attributes.get_history(obj, prop.key, passive=attributes.PASSIVE_NO_INITIALIZE).has_changes():
-                for p in prop.local_columns:
-                    if p.foreign_keys:
-                        obj_changed = True
-                        break
-                if obj_changed is True:
-                    break
+        obj_changed = _relationship_changed(obj, obj_mapper)
 
     if not obj_changed and not deleted:
         return
@@ -426,15 +566,110 @@ def create_version(obj, session: Session, deleted=False):
     obj.version += 1
 
 
-def versioned_session(session):
+def _relationship_changed(obj, obj_mapper: Mapper) -> bool:
+    """
+    :param obj: The object
+    :param obj_mapper: The mapper of the object
+    :return: True if a many-to-one relationship of the object was changed
+    """
+    for prop in obj_mapper.iterate_properties:
+        if isinstance(prop, RelationshipProperty) and \
+                attributes.get_history(
+                    obj, prop.key,
+                    passive=attributes.PASSIVE_NO_INITIALIZE).has_changes():
+            for p in prop.local_columns:
+                if p.foreign_keys:
+                    return True
+    return False
+
+
+def create_versions(objects: typing.Iterable, session: Session,
+                    deleted=False):
+    """
+    Create new versions of the objects for the session, like create_version,
+    but with one executemany INSERT per history table and class, instead of
+    a history object per object
+
+    :param objects: The versioned objects to create versions for
+    :param session: The session
+    :param deleted: If true, the objects have been deleted
+    :return: None
+    """
+    by_class = collections.OrderedDict()
+    for obj in objects:
+        by_class.setdefault(type(obj), []).append(obj)
+
+    for cls, objs in by_class.items():
+        obj_mapper = class_mapper(cls)
+        plan = history_plan(cls)
+        rows = []
+        for obj in objs:
+            obj_state = attributes.instance_state(obj)  # type: InstanceState
+            if not deleted and plan.keys.isdisjoint(
+                    obj_state.committed_state) and \
+                    not _relationship_changed(obj, obj_mapper):
+                # Only unversioned attributes, like _updated_on, were changed.
+                # Skip it before the expired attributes are loaded
+                continue
+            obj_dict = obj_state.dict
+            manager = obj_state.manager
+            row = {}
+            obj_changed = False
+            for prop_key, col_key in plan.columns:
+                # expired object attributes and also deferred cols might not
+                # be in the dict.  force it to load no matter what by
+                # using getattr().
+                if prop_key not in obj_dict:
+                    getattr(obj, prop_key)
+
+                added, unchanged, old = manager[prop_key].impl.get_history(
+                        obj_state, obj_dict)
+                if old:
+                    row[col_key] = old[0]
+                    obj_changed = True
+                elif unchanged:
+                    row[col_key] = unchanged[0]
+                elif added:
+                    # if the attribute had no value.
+                    row[col_key] = added[0]
+                    obj_changed = True
+                else:
+                    row[col_key] = None
+
+            if not obj_changed and not deleted and \
+                    not _relationship_changed(obj, obj_mapper):
+                continue
+
+            row[VERSION_COLUMN_NAME] = obj.version
+            rows.append(row)
+            obj.version += 1
+
+        if not rows:
+            continue
+        history_mapper = cls.__history_mapper__
+        for table, keys in plan.tables:
+            session.execute(table.insert(),
+                            [{key: row[key] for key in keys} for row in rows],
+                            mapper=history_mapper)
+
+
+def versioned_session(session, batched=True):
     """
     Add a versioning listener to the session
 
     :param session: The session to wrap
+    :param batched: If true, the history rows of each flush are inserted
+    with create_versions, otherwise one history object per changed object is
+    added to the session with create_version
     :return: None
     """
     @event.listens_for(session, 'before_flush')
     def before_flush(session, flush_context, instances):
+        if batched:
+            create_versions(versioned_objects(session.dirty), session)
+            create_versions(versioned_objects(session.deleted), session,
+                            deleted=True)
+            return
         for obj in versioned_objects(session.dirty):
             create_version(obj, session)
         for obj in versioned_objects(session.deleted):
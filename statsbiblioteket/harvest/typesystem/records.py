@@ -0,0 +1,117 @@
+"""
+Plain records of the harvest types, for callers that only read the objects.
+
+The records have the same names and fields as the harvest types, but are not
+mapped to a database, so they are smaller and faster to construct. Decode
+responses as records with Harvest.basic(..., records=True).
+"""
+import typing
+from pprint import pformat
+
+from statsbiblioteket.harvest.typesystem import harvest_types
+from statsbiblioteket.harvest.typesystem.harvest_types import Day
+from statsbiblioteket.harvest.typesystem.orm_types import _type_info, \
+    public_columns
+
+
+class HarvestRecord(object):
+    """
+    Base class of the plain records. Fields missing from the json are None,
+    and fields unknown to the record are kept in the _extra dict
+    """
+    __slots__ = ('_extra',)
+
+    _fields = ()  # type: typing.Tuple[str]
+
+    def __init__(self, **kwargs):
+        for field in self._fields:
+            setattr(self, field, kwargs.pop(field, None))
+        self._extra = kwargs
+
+    def _asdict(self) -> typing.Dict:
+        """
+        :return: the fields of the record as a dict
+        """
+        return {field: getattr(self, field) for field in self._fields}
+
+    def __eq__(self, other):
+        if type(other) is type(self):
+            for field in self._fields:
+                if getattr(self, field) != getattr(other, field):
+                    return False
+            return True
+        return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self, *args, **kwargs):
+        return self.id
+
+    def __lt__(self, other):
+        if hasattr(other, 'id'):
+            return self.id < other.id
+        return False
+
+    def __repr__(self, *args, **kwargs):
+        return pformat({_type_info(type(self)).key: self._asdict()})
+
+    def __str__(self, *args, **kwargs):
+        name = getattr(self, 'name', None) or str(self.id)
+        return self.__class__.__name__ + ': ' + name
+
+
+def _record_type(harvest_type: type) -> type:
+    """
+    Create the record type of a harvest type
+
+    :param harvest_type: The mapped harvest type
+    :return: a HarvestRecord subclass with the public columns of the type,
+    except the version, as fields
+    """
+    fields = tuple(key for key, _ in public_columns(harvest_type))
+    return type(harvest_type.__name__, (HarvestRecord,),
+                {'__slots__': fields, '_fields': fields,
+                 '__module__': __name__,
+                 '__doc__': 'Plain record of ' + harvest_type.__name__})
+
+
+Client = _record_type(harvest_types.Client)
+Contact = _record_type(harvest_types.Contact)
+DayEntry = _record_type(harvest_types.DayEntry)
+Expense = _record_type(harvest_types.Expense)
+ExpenseCategory = _record_type(harvest_types.ExpenseCategory)
+Invoice = _record_type(harvest_types.Invoice)
+Project = _record_type(harvest_types.Project)
+Task = _record_type(harvest_types.Task)
+TaskAssignment = _record_type(harvest_types.TaskAssignment)
+User = _record_type(harvest_types.User)
+
+_RECORD_CLASSES = {_type_info(class_).key: class_ for class_ in
+                   (Client, Contact, DayEntry, Expense, ExpenseCategory,
+                    Invoice, Project, Task, TaskAssignment, User)}
+
+
+def json_to_record(json_dict: typing.Dict):
+    """
+    If possible, convert the json dictionary to a plain record. The
+    counterpart of json_to_harvest
+    :param json_dict: The json dict
+    :return: A record, or the json dictionary, if no harvest type was found
+    """
+    if len(json_dict) == 1:  # Just one value
+        (first_key, fields), = json_dict.items()
+
+        class_ = _RECORD_CLASSES.get(first_key)
+        if class_ is not None and isinstance(fields, dict):
+            return class_(**fields)
+        return json_dict
+
+    if 'for_day' in json_dict and 'day_entries' in json_dict:
+        # Day is not mapped, so it is used as is, with records as entries
+        json_dict['day_entries'] = [DayEntry(**day_entry_fields)
+                                    for day_entry_fields in
+                                    json_dict['day_entries'] or []]
+        return Day(**json_dict)
+
+    return json_dict
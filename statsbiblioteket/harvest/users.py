@@ -1,19 +1,23 @@
 import typing
 
+from statsbiblioteket.harvest.projects import timesheet_params
 from statsbiblioteket.harvest.rest import Rest
-from statsbiblioteket.harvest.typesystem.harvest_types import User
+from statsbiblioteket.harvest.typesystem.harvest_types import User, DayEntry
 
 
 class Users(Rest):
     # People
 
-    def users(self) -> typing.List[User]:
+    def users(self, updated_since=None) -> typing.List[User]:
         """
-        Get all the people
+        Get all the people (optionally updated since a particular date)
         http://help.getharvest.com/api/users-api/users/managing-users/
         """
         url = '/people'
-        return self._get(url)
+        params = {}
+        if updated_since is not None:
+            params['updated_since'] = updated_since
+        return self._get(url, params=params)
 
     def get_user(self, user_id) -> User:
         """
@@ -22,6 +26,29 @@ class Users(Rest):
         url = '/people/{0}'.format(user_id)
         return self._get(url)
 
+    def timesheets_for_user(self, user_id, start_date, end_date,
+                            updated_since=None) -> typing.List[DayEntry]:
+        """
+        Get the timesheets of a person, across all projects
+        http://help.getharvest.com/api/timesheets-api/timesheets/retrieving-time-entries/#for-a-user
+        """
+        params = timesheet_params(start_date, end_date, updated_since)
+
+        url = '/people/{0}/entries'.format(user_id)
+        return self._get(url, params=params)
+
+    def iter_timesheets_for_user(self, user_id, start_date, end_date,
+                                 updated_since=None) -> \
+            typing.Iterator[DayEntry]:
+        """
+        Iterate over the timesheets of a person, decoding them while the
+        response is read
+        """
+        params = timesheet_params(start_date, end_date, updated_since)
+
+        url = '/people/{0}/entries'.format(user_id)
+        return self._iter_get(url, params=params)
+
     def toggle_user_active(self, user_id):
         """
         Toggle the active flag of a person
@@ -23,11 +23,15 @@ class CurlyBraceFormatter(logging.Formatter):
         message with all fields from the record
         """
         message = record.getMessage() # type: Str
-        if record.keywords:
-            message = message.format(**record.keywords)
+        # Loggers created before this module was imported are not
+        # KeywordLoggers, so their records have no keywords
+        keywords = getattr(record, 'keywords', None)
+        if keywords:
+            message = message.format(**keywords)
         if record.args:
             message = message.format(record.args)
         record.msg = message
+        record.args = None  # The args have been applied to the message
         formatted = super().format(record)
 
         return formatted
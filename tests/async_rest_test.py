@@ -0,0 +1,180 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from statsbiblioteket.harvest.harvest import AsyncHarvest
+from statsbiblioteket.harvest.http_cache import HttpCache
+from statsbiblioteket.harvest.invoices import INVOICES_PAGE_SIZE
+from statsbiblioteket.harvest.metrics import RETRIES
+from statsbiblioteket.harvest.rest import RateLimiter, HarvestError
+from statsbiblioteket.harvest.typesystem.harvest_types import Invoice, User
+
+aiohttp = pytest.importorskip('aiohttp')
+from aiohttp import web  # noqa: E402
+from aiohttp.test_utils import TestServer  # noqa: E402
+
+INVOICES = [{'invoice': {'id': invoice_id, 'amount': 100.0}}
+            for invoice_id in range(INVOICES_PAGE_SIZE + 10)]
+
+USERS = [{'user': {'id': 1, 'first_name': 'Harvest'}}]
+
+
+class FakeServer(object):
+    """
+    The listings of a small account, served by aiohttp. The responses of
+    the next requests can be replaced, given as the keyword arguments of
+    web.Response, and the requests are recorded
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.responses = []
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/people', self.people)
+        app.router.add_get('/invoices', self.invoices)
+        return app
+
+    async def people(self, request):
+        return self.respond(request, USERS)
+
+    async def invoices(self, request):
+        page = int(request.query.get('page', 1))
+        start = (page - 1) * INVOICES_PAGE_SIZE
+        return self.respond(request,
+                            INVOICES[start:start + INVOICES_PAGE_SIZE])
+
+    def respond(self, request, body):
+        self.requests.append(request.path_qs)
+        if self.responses:
+            return web.Response(**self.responses.pop(0))
+        return web.json_response(body)
+
+
+def run(server, test, **kwargs):
+    """
+    Run the coroutine function test with a client of the server
+    """
+
+    async def main():
+        async with TestServer(server.app()) as test_server:
+            uri = str(test_server.make_url('')).rstrip('/')
+            rate_limiter = RateLimiter(requests=10 ** 6, period=1,
+                                       backoff=0.001)
+            async with AsyncHarvest.basic(uri, 'user@example.com', 'secret',
+                                          rate_limiter=rate_limiter,
+                                          **kwargs) as hrvst:
+                return await test(hrvst)
+
+    return asyncio.run(main())
+
+
+async def collect(iterator):
+    return [harvest_object async for harvest_object in iterator]
+
+
+class TestAsyncHarvest(object):
+
+    def test_get(self):
+        server = FakeServer()
+        users = run(server, lambda hrvst: hrvst.users())
+        assert users == [User(id=1, first_name='Harvest')]
+
+    def test_pages_are_fetched_until_a_short_page(self):
+        server = FakeServer()
+        invoices = run(server,
+                       lambda hrvst: collect(hrvst.iter_invoices()))
+
+        assert [invoice.id for invoice in invoices] == \
+            [invoice['invoice']['id'] for invoice in INVOICES]
+        assert isinstance(invoices[0], Invoice)
+        assert server.requests == ['/invoices?page=1', '/invoices?page=2']
+
+    def test_retry_after(self):
+        server = FakeServer()
+        server.responses = [{'status': 429, 'headers': {'Retry-After': '0'}},
+                            {'status': 503}]
+
+        async def test(hrvst):
+            users = await hrvst.users()
+            return users, hrvst.metrics.counter(RETRIES, endpoint='/people')
+
+        users, retries = run(server, test)
+        assert users == [User(id=1, first_name='Harvest')]
+        assert retries == 2
+        assert len(server.requests) == 3
+
+    def test_retries_give_up(self):
+        server = FakeServer()
+        server.responses = [{'status': 500, 'text': 'Oops'}] * 7
+
+        with pytest.raises(HarvestError) as error:
+            run(server, lambda hrvst: hrvst.users())
+        assert '500' in str(error.value)
+        # The first attempt and the retries of the rate limiter
+        assert len(server.requests) == 6
+
+    def test_errors(self):
+        server = FakeServer()
+        server.responses = [{'status': 404, 'text': 'No such thing'},
+                            {'status': 401, 'text': 'Who are you'}]
+
+        with pytest.raises(HarvestError) as error:
+            run(server, lambda hrvst: hrvst.users())
+        assert error.value.args[1] == 'No such thing'
+
+        with pytest.raises(HarvestError) as error:
+            run(server, lambda hrvst: collect(hrvst.iter_invoices()))
+        assert error.value.args[1] == 'Who are you'
+
+    def test_not_modified_responses_are_cached(self, tmpdir):
+        server = FakeServer()
+        body = json.dumps(USERS)
+        server.responses = [
+            {'text': body, 'content_type': 'application/json',
+             'headers': {'ETag': '"v1"'}},
+            {'status': 304, 'headers': {'ETag': '"v1"'}}]
+
+        async def test(hrvst):
+            return await hrvst.users(), await hrvst.users()
+
+        first, second = run(server, test, cache_dir=str(tmpdir))
+        assert first == second == [User(id=1, first_name='Harvest')]
+        assert len(tmpdir.listdir()) == 1
+
+    def test_cache_files_are_used_off_the_event_loop(self, tmpdir,
+                                                     monkeypatch):
+        threads = []
+        get, store = HttpCache.get, HttpCache.store
+
+        def recording_get(cache, *args):
+            threads.append(threading.current_thread())
+            return get(cache, *args)
+
+        def recording_store(cache, *args):
+            threads.append(threading.current_thread())
+            return store(cache, *args)
+
+        monkeypatch.setattr(HttpCache, 'get', recording_get)
+        monkeypatch.setattr(HttpCache, 'store', recording_store)
+        server = FakeServer()
+        server.responses = [{'text': json.dumps(USERS),
+                             'content_type': 'application/json',
+                             'headers': {'ETag': '"v1"'}}]
+
+        run(server, lambda hrvst: hrvst.users(), cache_dir=str(tmpdir))
+        assert len(threads) == 2
+        assert threading.main_thread() not in threads
+
+    @pytest.mark.parametrize('setting, connect, read', [
+        ((3, 30), 3, 30), (5, 5, 5), (None, None, None)])
+    def test_timeouts(self, setting, connect, read):
+        async def test(hrvst):
+            return hrvst._get_session().timeout
+
+        timeout = run(FakeServer(), test, timeout=setting)
+        assert timeout.total is None
+        assert (timeout.sock_connect, timeout.sock_read) == (connect, read)
@@ -0,0 +1,215 @@
+"""
+Benchmarks of the backup, the decoding and the list endpoints, against the
+offline fake Harvest in fake_harvest.py.
+
+The size of the account is set with HARVEST_BENCHMARK_SIZE as
+users,projects,entries. The results are printed, and written as json to the
+file named by HARVEST_BENCHMARK_OUTPUT, if set, together with the commit and
+the account size, so runs of different commits can be compared::
+
+    HARVEST_BENCHMARK_SIZE=20,200,100000 HARVEST_BENCHMARK_OUTPUT=bench.json \\
+        python -m pytest -s tests/benchmark_test.py
+"""
+import datetime
+import json
+import os
+import platform
+import subprocess
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from statsbiblioteket.harvest import Harvest
+from statsbiblioteket.harvest.synch import harvest_synch
+from statsbiblioteket.harvest.typesystem.harvest_types import \
+    json_to_harvest, DayEntry, HarvestDBType
+from statsbiblioteket.harvest.typesystem.orm_types import versioned_session
+from statsbiblioteket.harvest.typesystem.records import json_to_record
+from tests.decode_test import legacy_json_to_harvest
+from tests.equality_test import legacy_eq
+from tests.fake_harvest import FakeAccount, fake_harvest, mount
+
+SIZE = tuple(int(value) for value in
+             os.environ.get('HARVEST_BENCHMARK_SIZE', '10,40,5000').split(','))
+REPEAT = 3
+
+results = {}
+
+
+def best_time(function, repeat=REPEAT):
+    """
+    :return: the best duration of repeat calls, and the last result
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def record(name, seconds, objects):
+    per_second = round(objects / seconds) if seconds else None
+    results[name] = {'seconds': round(seconds, 6), 'objects': objects,
+                     'per_second': per_second}
+    print('{name}: {objects} objects in {seconds:.3f}s'.format(
+            name=name, objects=objects, seconds=seconds))
+
+
+def commit_id():
+    try:
+        return subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=os.path.dirname(__file__),
+                stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@pytest.fixture(scope='module')
+def account():
+    users, projects, entries = SIZE
+    yield FakeAccount(users=users, projects=projects, entries=entries,
+                      expenses=entries // 100, invoices=entries // 100)
+    report = {'commit': commit_id(), 'python': platform.python_version(),
+              'size': {'users': users, 'projects': projects,
+                       'entries': entries},
+              'results': results}
+    output = os.environ.get('HARVEST_BENCHMARK_OUTPUT')
+    if output:
+        with open(output, 'w', encoding='utf-8') as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+@pytest.fixture()
+def fake_basic(account, monkeypatch):
+    """Make the backup talk to the fake account"""
+    basic = Harvest.basic
+
+    def fake(*args, **kwargs):
+        return mount(basic(*args, **kwargs), account)
+
+    monkeypatch.setattr(Harvest, 'basic', fake)
+
+
+def backup_args(database, *extra):
+    return harvest_synch.create_parser().parse_args(
+            ['--domain', 'https://fake.harvestapp.com',
+             '--sql', 'sqlite:///' + database,
+             '--from', '2016-01-01', '--to', '2016-12-31'] + list(extra))
+
+
+class TestBenchmark(object):
+
+    def test_backup(self, account, fake_basic, tmpdir):
+        database = str(tmpdir.join('backup.db'))
+        engine = create_engine('sqlite:///' + database)
+        entries = len(account.entries)
+
+        def run(*extra):
+            start = time.perf_counter()
+            harvest_synch.backup(backup_args(database, *extra), 'user', 'pass')
+            return time.perf_counter() - start
+
+        record('backup.initial', run(), entries)
+        assert engine.scalar('select count(*) from day_entries') == entries
+
+        record('backup.unchanged', run(), entries)
+        assert engine.scalar('select count(*) from day_entries_history') == 0
+
+        record('backup.incremental', run('--incremental'), 0)
+
+        account.change_entries(entries // 100)
+        record('backup.changed', run(), entries)
+        assert engine.scalar('select count(*) from day_entries_history') == \
+            entries // 100
+
+    def test_merge_and_flush(self, account):
+        engine = create_engine('sqlite://')
+        HarvestDBType.metadata.create_all(engine)
+        session = sessionmaker(bind=engine, autoflush=False)()
+        versioned_session(session)
+        session.add_all([DayEntry(**entry) for entry in account.entries])
+        session.commit()
+
+        # Keep the stored objects in the identity map, so the merge does not
+        # select them one by one. Their _updated_on is expired, as after a
+        # flush that changed them, since it is set by the database
+        stored = session.query(DayEntry).all()
+        for day_entry in stored:
+            day_entry.notes = 'Changed'
+        session.flush()
+        # The fetched objects change the notes back
+        fetched = [DayEntry(**entry) for entry in account.entries]
+        now = datetime.datetime.utcnow()
+        for day_entry in fetched:
+            day_entry._updated_on = now
+
+        start = time.perf_counter()
+        for day_entry in fetched:
+            session.merge(day_entry)
+        record('merge.day_entries', time.perf_counter() - start, len(fetched))
+
+        start = time.perf_counter()
+        session.flush()
+        record('flush.day_entries', time.perf_counter() - start, len(fetched))
+
+        history = DayEntry.__history_mapper__.local_table
+        assert session.execute(history.count()).scalar() == 2 * len(fetched)
+        assert len(stored) == len(fetched)
+        session.close()
+
+    def test_decode(self, account):
+        body = json.dumps([{'day_entry': entry} for entry in account.entries])
+        entries = len(account.entries)
+
+        seconds, decoded = best_time(
+                lambda: json.loads(body, object_hook=legacy_json_to_harvest))
+        record('decode.legacy', seconds, entries)
+        assert len(decoded) == entries
+
+        seconds, decoded = best_time(
+                lambda: json.loads(body, object_hook=json_to_harvest))
+        record('decode.harvest_types', seconds, entries)
+        assert len(decoded) == entries
+
+        seconds, decoded = best_time(
+                lambda: json.loads(body, object_hook=json_to_record))
+        record('decode.records', seconds, entries)
+        assert len(decoded) == entries
+
+    def test_equality(self, account):
+        pairs = [(DayEntry(**entry), DayEntry(**entry))
+                 for entry in account.entries]
+
+        seconds, equal = best_time(
+                lambda: [legacy_eq(him, her) for him, her in pairs])
+        record('equality.legacy', seconds, len(pairs))
+        assert all(equal)
+
+        seconds, equal = best_time(lambda: [him == her for him, her in pairs])
+        record('equality.harvest_types', seconds, len(pairs))
+        assert all(equal)
+
+    def test_list_endpoints(self, account):
+        hrvst = fake_harvest(account)
+        for name, fetch, count in (
+                ('list.users', hrvst.users, len(account.users)),
+                ('list.projects', hrvst.projects, len(account.projects)),
+                ('list.invoices', lambda: list(hrvst.iter_invoices()),
+                 len(account.invoices))):
+            seconds, fetched = best_time(fetch)
+            record(name, seconds, count)
+            assert len(fetched) == count
+
+        def all_timesheets():
+            return [entry for project in account.projects
+                    for entry in hrvst.iter_timesheets_for_project(
+                        project['id'], '2016-01-01', '2016-12-31')]
+
+        seconds, fetched = best_time(all_timesheets)
+        record('list.timesheets', seconds, len(fetched))
+        assert len(fetched) == len(account.entries)
@@ -0,0 +1,158 @@
+import datetime
+import decimal
+
+import pytest
+from sqlalchemy import create_engine, inspect, Column, Boolean, Integer, \
+    Numeric, Date, String
+from sqlalchemy.orm import sessionmaker
+
+from statsbiblioteket.harvest.synch.bulk_upsert import bulk_upsert, \
+    add_content_hash_columns, UpsertStats, _normaliser
+from statsbiblioteket.harvest.typesystem.harvest_types import DayEntry, \
+    HarvestDBType
+
+NOW = datetime.datetime(2017, 1, 1)
+LATER = datetime.datetime(2017, 1, 2)
+
+
+def day_entries(hours=1.0):
+    return [DayEntry(id=entry_id, hours=hours, notes='Some notes',
+                     spent_at='2016-01-01', project_id='42')
+            for entry_id in range(10)]
+
+
+@pytest.fixture()
+def session():
+    engine = create_engine('sqlite://')
+    HarvestDBType.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def rows(session):
+    table = DayEntry.__table__
+    return session.execute(table.select().order_by(table.c.id)).fetchall()
+
+
+def history_count(session):
+    history = DayEntry.__history_mapper__.local_table
+    return session.execute(history.count()).scalar()
+
+
+class TestBulkUpsert(object):
+
+    def test_new_and_changed_rows_in_batches(self, session):
+        bulk_upsert(session, DayEntry, day_entries()[:5], NOW)
+        given = day_entries()
+        for day_entry in given[3:7]:
+            day_entry.hours = 3.0
+
+        assert bulk_upsert(session, DayEntry, given, LATER, batch_size=3) == \
+            UpsertStats(inserted=5, updated=2, unchanged=3)
+        stored = rows(session)
+        assert [row.hours for row in stored] == \
+            [day_entry.hours for day_entry in given]
+        assert [row.version for row in stored] == [1, 1, 1, 2, 2] + [1] * 5
+        assert [row._updated_on for row in stored] == [LATER] * 10
+
+        history = DayEntry.__history_mapper__.local_table
+        old_rows = session.execute(
+                history.select().order_by(history.c.id)).fetchall()
+        assert [(row.id, row.hours, row.version) for row in old_rows] == \
+            [(3, 1.0, 1), (4, 1.0, 1)]
+
+    def test_values_not_given_are_kept(self, session):
+        bulk_upsert(session, DayEntry, day_entries(), NOW)
+        partial = DayEntry(id=1, hours=5.0)
+
+        assert bulk_upsert(session, DayEntry, [partial], LATER) == \
+            UpsertStats(inserted=0, updated=1, unchanged=0)
+        row = rows(session)[1]
+        assert row.hours == 5.0
+        assert row.notes == 'Some notes'
+
+    def test_ids_are_normalised_and_the_last_object_wins(self, session):
+        first = DayEntry(id='7', hours=1.0)
+        last = DayEntry(id=7, hours=2.0)
+
+        assert bulk_upsert(session, DayEntry, [first, last], NOW) == \
+            UpsertStats(inserted=1, updated=0, unchanged=0)
+        row, = rows(session)
+        assert (row.id, row.hours) == (7, 2.0)
+
+    def test_booleans_sent_as_strings(self, session):
+        closed = DayEntry(id=1, is_closed='false', is_billed='true')
+        assert bulk_upsert(session, DayEntry, [closed], NOW) == \
+            UpsertStats(inserted=1, updated=0, unchanged=0)
+        row, = rows(session)
+        assert (row.is_closed, row.is_billed) == (False, True)
+
+        closed = DayEntry(id=1, is_closed=False, is_billed=True)
+        assert bulk_upsert(session, DayEntry, [closed], LATER) == \
+            UpsertStats(inserted=0, updated=0, unchanged=1)
+
+    @pytest.mark.parametrize('column_type, value, expected', [
+        (Boolean, 'false', False), (Boolean, 'True', True),
+        (Boolean, 0, False), (Boolean, 'maybe', 'maybe'), (Integer, '42', 42),
+        (Integer, 42.0, 42), (Integer, True, 1), (Integer, 4.5, 4.5),
+        (Integer, 'x', 'x'),
+        (Numeric, 0.1, decimal.Decimal('0.1')),
+        (Numeric, '2.50', decimal.Decimal('2.50')), (Numeric, 'x', 'x'),
+        (Date, '2016-01-31', datetime.date(2016, 1, 31)),
+        (Date, '2016-01-31T10:00:00Z', datetime.date(2016, 1, 31)),
+        (Date, datetime.datetime(2016, 1, 31, 10), datetime.date(2016, 1, 31)),
+        (Date, 'soon', 'soon'), (String, 42, '42'), (String, None, None)])
+    def test_values_are_normalised_to_the_column_type(self, column_type,
+                                                      value, expected):
+        normalise = _normaliser(Column('value', column_type))
+        normalised = normalise(value)
+        assert normalised == expected
+        assert type(normalised) is type(expected)
+
+    def test_unchanged_rows_are_touched(self, session):
+        assert bulk_upsert(session, DayEntry, day_entries(), NOW) == \
+            UpsertStats(inserted=10, updated=0, unchanged=0)
+        hashes = [row._content_hash for row in rows(session)]
+        assert None not in hashes
+
+        assert bulk_upsert(session, DayEntry, day_entries(), LATER) == \
+            UpsertStats(inserted=0, updated=0, unchanged=10)
+        assert [row._updated_on for row in rows(session)] == [LATER] * 10
+        assert [row._content_hash for row in rows(session)] == hashes
+        assert history_count(session) == 0
+
+    def test_changed_rows_are_versioned(self, session):
+        bulk_upsert(session, DayEntry, day_entries(), NOW)
+        before = rows(session)
+        changed = day_entries()
+        changed[3].hours = 2.0
+
+        assert bulk_upsert(session, DayEntry, changed, LATER) == \
+            UpsertStats(inserted=0, updated=1, unchanged=9)
+        after = rows(session)
+        assert after[3].hours == 2.0
+        assert after[3].version == 2
+        assert after[3]._content_hash != before[3]._content_hash
+        assert history_count(session) == 1
+
+    def test_rows_without_hash_are_compared(self, session):
+        bulk_upsert(session, DayEntry, day_entries(), NOW)
+        session.execute(DayEntry.__table__.update().values(_content_hash=None))
+
+        assert bulk_upsert(session, DayEntry, day_entries(), LATER) == \
+            UpsertStats(inserted=0, updated=0, unchanged=10)
+        assert None not in [row._content_hash for row in rows(session)]
+        assert history_count(session) == 0
+
+    def test_content_hash_column_is_added(self):
+        engine = create_engine('sqlite://')
+        engine.execute('CREATE TABLE day_entries (id INTEGER PRIMARY KEY, '
+                       'notes VARCHAR, _updated_on DATETIME)')
+
+        add_content_hash_columns(engine)
+        add_content_hash_columns(engine)  # Only added once
+
+        columns = [column['name'] for column in
+                   inspect(engine).get_columns('day_entries')]
+        assert columns.count('_content_hash') == 1
@@ -0,0 +1,71 @@
+import json
+
+import inflection
+
+import statsbiblioteket.harvest
+from statsbiblioteket.harvest.json_backend import get_loads, \
+    apply_object_hook
+from statsbiblioteket.harvest.typesystem.harvest_types import \
+    json_to_harvest, DayEntry
+
+ENTRIES = 5000
+
+
+def legacy_json_to_harvest(json_dict):
+    """The decoding before the dispatch table and the field cache"""
+    if len(json_dict) == 1:
+        (first_key, _), = json_dict.items()
+        class_name = inflection.camelize(first_key)
+        class_ = getattr(statsbiblioteket.harvest.module_name, class_name)
+        harvest_object = class_()
+        for key, value in json_dict[first_key].items():
+            if not hasattr(class_, key):
+                setattr(harvest_object, '_' + key, value)
+            else:
+                setattr(harvest_object, key, value)
+        return harvest_object
+    return json_dict
+
+
+DAY_ENTRY = {'notes': 'Some notes.', 'spent_at': '2015-07-01', 'hours': 0.16,
+             'user_id': 508343, 'project_id': 3554414, 'task_id': 2086200,
+             'created_at': '2015-08-25T14:31:52Z',
+             'updated_at': '2015-08-25T14:47:02Z', 'adjustment_record': False,
+             'timer_started_at': None, 'is_closed': False, 'is_billed': False}
+
+
+def timesheet_json():
+    entries = []
+    for entry_id in range(ENTRIES):
+        fields = dict(DAY_ENTRY, id=entry_id, hint_unknown=entry_id)
+        entries.append({'day_entry': fields})
+    return json.dumps(entries)
+
+
+class TestDecode(object):
+
+    def test_decode_matches_the_legacy_decoding(self):
+        text = timesheet_json()
+
+        legacy = json.loads(text, object_hook=legacy_json_to_harvest)
+        fast = json.loads(text, object_hook=json_to_harvest)
+
+        assert fast == legacy
+        assert [repr(entry) for entry in fast] == \
+            [repr(entry) for entry in legacy]
+        assert fast[0]._hint_unknown == 0
+        assert legacy[0]._hint_unknown == 0
+
+    def test_backends_decode_the_same(self):
+        text = timesheet_json()
+        expected = json.loads(text, object_hook=json_to_harvest)
+        loads = get_loads('auto')
+        assert loads(text.encode('utf-8'), object_hook=json_to_harvest) == \
+            expected
+        plain = json.loads(text)
+        assert apply_object_hook(plain, json_to_harvest) == expected
+        assert isinstance(expected[0], DayEntry)
+
+    def test_unknown_keys_are_kept_as_dicts(self):
+        assert json_to_harvest({'unknown': {'id': 1}}) == \
+            {'unknown': {'id': 1}}
@@ -0,0 +1,57 @@
+import json
+from pprint import pformat
+
+import inflection
+
+from statsbiblioteket.harvest.typesystem.harvest_types import DayEntry, Day
+from statsbiblioteket.harvest.typesystem.orm_types import TypeToJSON, \
+    remove_private_fields, remove_sqlalchemy_fields, \
+    remove_fields_with_value_none
+
+ENTRIES = 2000
+
+
+def legacy_public_fields(harvest_object):
+    """The filtering before the per-class column lists"""
+    values = remove_private_fields(harvest_object.__dict__)
+    return remove_sqlalchemy_fields(values)
+
+
+def legacy_eq(him, her):
+    return remove_fields_with_value_none(legacy_public_fields(him)) == \
+           remove_fields_with_value_none(legacy_public_fields(her))
+
+
+def day_entries():
+    return [DayEntry(id=entry_id, notes='Some notes', hours=entry_id % 8,
+                     spent_at='2015-07-01', project_id=entry_id % 10,
+                     task_id=None, hint_unknown=entry_id)
+            for entry_id in range(ENTRIES)]
+
+
+class TestEquality(object):
+
+    def test_comparison_matches_the_legacy_comparison(self):
+        hims = day_entries()
+        hers = day_entries()
+        hers[-1].notes = 'Other notes'
+        hers[-2].task_id = 42
+
+        assert [him == her for him, her in zip(hims, hers)] == \
+            [legacy_eq(him, her) for him, her in zip(hims, hers)]
+        assert hims[0] == hers[0]
+        assert hims[-1] != hers[-1]
+        assert hims[-2] != hers[-2]
+
+    def test_repr_and_json_are_unchanged(self):
+        entry = day_entries()[1]
+        assert repr(entry) == pformat(
+                {'day_entry': legacy_public_fields(entry)})
+        encoded = json.loads(json.dumps(entry, cls=TypeToJSON))
+        assert encoded == {'day_entry': legacy_public_fields(entry)}
+
+    def test_unmapped_types_filter_the_instance_dict(self):
+        day = Day(day_entries=[], for_day='2016-06-28')
+        assert day == Day(day_entries=[], for_day='2016-06-28')
+        assert day != Day(day_entries=[], for_day='2016-06-29')
+        assert inflection.underscore(type(day).__name__) in repr(day)
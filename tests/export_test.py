@@ -0,0 +1,105 @@
+import os
+
+import pytest
+
+from statsbiblioteket.harvest.export import arrow_schema, record_batches, \
+    write_parquet
+from statsbiblioteket.harvest.typesystem import records
+from statsbiblioteket.harvest.typesystem.harvest_types import DayEntry
+
+pyarrow = pytest.importorskip('pyarrow')
+import pyarrow.parquet  # noqa: E402
+
+
+def day_entries(count):
+    return [records.DayEntry(id=entry_id, notes='Some notes',
+                             hours=entry_id / 4, task_id=str(entry_id),
+                             spent_at='2016-0{month}-01'.format(
+                                     month=1 + entry_id % 3),
+                             is_closed=False)
+            for entry_id in range(count)]
+
+
+class TestExport(object):
+
+    def test_schema_follows_the_columns(self):
+        schema = arrow_schema(DayEntry)
+        assert schema.field('id').type == pyarrow.int64()
+        assert schema.field('hours').type == pyarrow.float64()
+        assert schema.field('is_closed').type == pyarrow.bool_()
+        assert schema.field('spent_at').type == pyarrow.string()
+        assert 'version' not in schema.names
+
+    def test_record_batches(self):
+        batches = list(record_batches(day_entries(25), DayEntry,
+                                      batch_size=10))
+        assert [batch.num_rows for batch in batches] == [10, 10, 5]
+        # Numbers sent as strings are converted to the column type
+        assert batches[0].column('task_id').to_pylist()[:3] == [0, 1, 2]
+
+    def test_booleans_sent_as_strings(self):
+        entries = day_entries(2)
+        entries[0].is_closed = 'false'
+        entries[1].is_closed = 'true'
+        batch, = record_batches(entries, DayEntry)
+        assert batch.column('is_closed').to_pylist() == [False, True]
+
+    def test_values_that_cannot_be_converted_are_null(self):
+        entries = day_entries(3)
+        entries[0].task_id = '12.0'
+        entries[1].task_id = 'twelve'
+        entries[2].is_closed = 'maybe'
+        batch, = record_batches(entries, DayEntry)
+        assert batch.column('task_id').to_pylist() == [12, None, 2]
+        assert batch.column('is_closed').to_pylist() == [False, False, None]
+
+    def test_parquet_partitioned_by_month(self, tmpdir):
+        counts = write_parquet(day_entries(30), DayEntry, str(tmpdir),
+                               batch_size=4)
+        assert counts == {'2016-01': 10, '2016-02': 10, '2016-03': 10}
+
+        path = os.path.join(str(tmpdir), 'month=2016-02', 'part-0.parquet')
+        table = pyarrow.parquet.read_table(path)
+        assert table.num_rows == 10
+        assert table.column('id').to_pylist() == list(range(1, 30, 3))
+
+    def test_parquet_writers_are_bounded(self, tmpdir, monkeypatch):
+        writer_class = pyarrow.parquet.ParquetWriter
+        open_writers = []
+        most_open = []
+
+        class CountingWriter(writer_class):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                open_writers.append(self)
+                most_open.append(len(open_writers))
+
+            def close(self):
+                if self in open_writers:
+                    open_writers.remove(self)
+                super().close()
+
+        monkeypatch.setattr(pyarrow.parquet, 'ParquetWriter', CountingWriter)
+        # The months come round in turn, so with two open months, each comes
+        # back after being closed
+        counts = write_parquet(day_entries(30), DayEntry, str(tmpdir),
+                               batch_size=4, max_open=2)
+
+        assert counts == {'2016-01': 10, '2016-02': 10, '2016-03': 10}
+        assert max(most_open) <= 2
+        assert not open_writers
+        assert len(os.listdir(os.path.join(str(tmpdir), 'month=2016-02'))) > 1
+        table = pyarrow.parquet.read_table(
+                os.path.join(str(tmpdir), 'month=2016-02'))
+        assert sorted(table.column('id').to_pylist()) == \
+            list(range(1, 30, 3))
+
+    def test_sorted_input_is_one_file_per_month(self, tmpdir):
+        entries = sorted(day_entries(30), key=lambda entry: entry.spent_at)
+        write_parquet(entries, DayEntry, str(tmpdir), batch_size=4,
+                      max_open=1)
+
+        assert sorted(os.listdir(str(tmpdir))) == \
+            ['month=2016-01', 'month=2016-02', 'month=2016-03']
+        assert os.listdir(os.path.join(str(tmpdir), 'month=2016-03')) == \
+            ['part-0.parquet']
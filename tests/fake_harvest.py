@@ -0,0 +1,378 @@
+"""
+An offline stand-in for the Harvest API, for tests and benchmarks.
+
+FakeAccount synthesises a deterministic account of a given size, and
+FakeHarvestAdapter answers the requests of a Harvest client from it, when
+mounted on the session of the client::
+
+    account = FakeAccount(users=10, projects=50, entries=10000)
+    hrvst = fake_harvest(account)
+    hrvst.timesheets_for_project(account.projects[0]['id'], ...)
+"""
+import io
+import json
+import random
+import re
+import time
+import typing
+from datetime import date, timedelta
+from urllib.parse import urlparse, parse_qs
+
+import requests
+from requests.adapters import BaseAdapter
+
+from statsbiblioteket.harvest import Harvest
+from statsbiblioteket.harvest.invoices import INVOICES_PAGE_SIZE
+from statsbiblioteket.harvest.rest import RateLimiter
+
+FAKE_URI = 'https://fake.harvestapp.com'
+
+_PROJECT_PATH = re.compile(r'^/projects/(\d+)/(entries|task_assignments|'
+                           r'expenses)$')
+_USER_ENTRIES_PATH = re.compile(r'^/people/(\d+)/entries$')
+
+
+def _timestamp(day: str, hour: int = 10) -> str:
+    return '{day}T{hour:02d}:00:00Z'.format(day=day, hour=hour)
+
+
+class FakeAccount(object):
+    """
+    A synthetic Harvest account. The same arguments always give the same
+    account, so benchmarks are comparable across commits.
+
+    The timesheets are spread over the days of the year, and over half of
+    the projects, as accounts usually have many projects without recent
+    activity. The projects carry the hint_earliest_record_at and
+    hint_latest_record_at of their timesheets, like the real API.
+    """
+
+    def __init__(self, users: int = 5, projects: int = 20,
+                 entries: int = 500, expenses: int = 0, invoices: int = 0,
+                 tasks: int = 5, clients: int = 3, year: int = 2016,
+                 seed: int = 42):
+        """
+        :param users: The number of users
+        :param projects: The number of projects
+        :param entries: The number of timesheet entries
+        :param expenses: The number of expenses. If 0, the expenses module is
+        disabled
+        :param invoices: The number of invoices. If 0, the invoices module is
+        disabled
+        :param tasks: The number of tasks, all assigned to every project
+        :param clients: The number of clients
+        :param year: The year of the timesheets
+        :param seed: The seed of the random choices
+        """
+        rnd = random.Random(seed)
+        created = _timestamp('{year}-01-01'.format(year=year - 1))
+        self.year = year
+        self.users = [{'id': 100000 + i,
+                       'email': 'user{0}@example.com'.format(i),
+                       'first_name': 'First{0}'.format(i),
+                       'last_name': 'Last{0}'.format(i),
+                       'is_admin': i == 0, 'is_active': True,
+                       'is_contractor': False, 'telephone': '',
+                       'department': 'Department {0}'.format(i % 4),
+                       'timezone': 'Copenhagen', 'default_hourly_rate': 100.0,
+                       'cost_rate': None, 'created_at': created,
+                       'updated_at': created}
+                      for i in range(users)]
+        self.clients = [{'id': 200000 + i, 'name': 'Client {0}'.format(i),
+                         'active': True, 'currency': 'Danish Krone - DKK',
+                         'currency_symbol': 'kr', 'details': '',
+                         'created_at': created, 'updated_at': created}
+                        for i in range(clients)]
+        self.tasks = [{'id': 300000 + i, 'name': 'Task {0}'.format(i),
+                       'billable_by_default': i % 2 == 0,
+                       'is_default': i == 0, 'default_hourly_rate': 0.0,
+                       'deactivated': False, 'created_at': created,
+                       'updated_at': created}
+                      for i in range(tasks)]
+        self.projects = [{'id': 400000 + i,
+                          'client_id': self.clients[i % clients]['id'],
+                          'name': 'Project {0}'.format(i),
+                          'code': 'P{0}'.format(i), 'active': i % 4 != 3,
+                          'billable': True, 'bill_by': 'none',
+                          'budget': None, 'budget_by': 'none',
+                          'notes': '', 'hourly_rate': None,
+                          'hint_earliest_record_at': None,
+                          'hint_latest_record_at': None,
+                          'created_at': created, 'updated_at': created}
+                         for i in range(projects)]
+        self.task_assignments = [
+            {'id': 500000 + len(self.tasks) * p + t,
+             'project_id': project['id'], 'task_id': task['id'],
+             'billable': task['billable_by_default'], 'deactivated': False,
+             'budget': None, 'estimate': None, 'hourly_rate': None,
+             'created_at': created, 'updated_at': created}
+            for p, project in enumerate(self.projects)
+            for t, task in enumerate(self.tasks)]
+
+        first_day = date(year, 1, 1)
+        active_projects = self.projects[:max(1, projects // 2)]
+        self.entries = []
+        for i in range(entries):
+            day = (first_day + timedelta(days=rnd.randrange(365))).isoformat()
+            hours = rnd.choice((0.25, 0.5, 1.0, 1.5, 2.0, 4.0, 7.5))
+            self.entries.append({
+                'id': 600000000 + i,
+                'project_id': rnd.choice(active_projects)['id'],
+                'user_id': rnd.choice(self.users)['id'],
+                'task_id': rnd.choice(self.tasks)['id'],
+                'spent_at': day, 'hours': hours, 'hours_without_timer': hours,
+                'notes': 'Worked on item {0}'.format(rnd.randrange(1000)),
+                'adjustment_record': False, 'timer_started_at': None,
+                'is_closed': False, 'is_billed': False,
+                'created_at': _timestamp(day, 9),
+                'updated_at': _timestamp(day, 17)})
+
+        self.expense_categories = [{'id': 700000, 'name': 'Travel',
+                                    'unit_name': None, 'unit_price': None,
+                                    'deactivated': False,
+                                    'created_at': created,
+                                    'updated_at': created}]
+        self.expenses = []
+        for i in range(expenses):
+            day = (first_day + timedelta(days=rnd.randrange(365))).isoformat()
+            self.expenses.append({
+                'id': 800000 + i,
+                'project_id': rnd.choice(active_projects)['id'],
+                'user_id': rnd.choice(self.users)['id'],
+                'expense_category_id': 700000, 'spent_at': day,
+                'total_cost': float(rnd.randrange(10, 1000)), 'units': 1.0,
+                'notes': 'Expense {0}'.format(i), 'billable': True,
+                'is_closed': False, 'is_locked': False, 'invoice_id': 0,
+                'has_receipt': False, 'created_at': _timestamp(day),
+                'updated_at': _timestamp(day)})
+        self.invoices = []
+        for i in range(invoices):
+            day = (first_day + timedelta(days=rnd.randrange(365))).isoformat()
+            self.invoices.append({
+                'id': 900000 + i, 'client_id': rnd.choice(self.clients)['id'],
+                'number': str(1000 + i), 'issued_at': day, 'due_at': day,
+                'amount': float(rnd.randrange(100, 10000)),
+                'due_amount': 0.0, 'state': 'paid', 'subject': '',
+                'notes': '', 'currency': 'Danish Krone - DKK',
+                'created_at': _timestamp(day), 'updated_at': _timestamp(day)})
+
+        self.requests = []  # type: typing.List[typing.Tuple[str, typing.Dict]]
+        self._reindex()
+
+    def _reindex(self):
+        """
+        Index the timesheets and expenses, update the hints of the projects,
+        and forget the encoded responses. Call it after changing the account
+        """
+        self._entries_by_project = {}
+        self._entries_by_user = {}
+        for entry in self.entries:
+            self._entries_by_project.setdefault(entry['project_id'],
+                                                []).append(entry)
+            self._entries_by_user.setdefault(entry['user_id'],
+                                             []).append(entry)
+        for project in self.projects:
+            days = [entry['spent_at'] for entry in
+                    self._entries_by_project.get(project['id'], [])]
+            project['hint_earliest_record_at'] = min(days) if days else None
+            project['hint_latest_record_at'] = max(days) if days else None
+        self._expenses_by_project = {}
+        for expense in self.expenses:
+            self._expenses_by_project.setdefault(expense['project_id'],
+                                                 []).append(expense)
+        self._bodies = {}
+
+    def change_entries(self, count: int, updated_at: str = None):
+        """
+        Change the hours of the first timesheets, as if they were edited
+
+        :param count: The number of timesheets to change
+        :param updated_at: Their new updated_at (default: the end of the year)
+        :return: None
+        """
+        updated_at = updated_at or _timestamp('{0}-12-31'.format(self.year))
+        for entry in self.entries[:count]:
+            entry['hours'] += 1
+            entry['updated_at'] = updated_at
+        self._reindex()
+
+    def set_hints(self, count: int, earliest: str, latest: str):
+        """
+        Set the record date hints of the first projects, as if Harvest had
+        not updated them
+
+        :param count: The number of projects
+        :param earliest: Their hint_earliest_record_at
+        :param latest: Their hint_latest_record_at
+        :return: None
+        """
+        for project in self.projects[:count]:
+            project['hint_earliest_record_at'] = earliest
+            project['hint_latest_record_at'] = latest
+        self._bodies = {}
+
+    def delete_entries(self, count: int):
+        """
+        Delete the last timesheets
+
+        :param count: The number of timesheets to delete
+        :return: None
+        """
+        del self.entries[len(self.entries) - count:]
+        self._reindex()
+
+    def who_am_i(self) -> typing.Dict:
+        return {'company': {'name': 'Fake company', 'base_uri': FAKE_URI,
+                            'modules': {'expenses': bool(self.expenses),
+                                        'invoices': bool(self.invoices)}},
+                'user': self.users[0]}
+
+    def body(self, path: str, query: typing.Dict[str, str]) -> \
+            typing.Optional[bytes]:
+        """
+        :param path: The path of a GET request
+        :param query: The query parameters of the request
+        :return: the encoded json response, or None if the path is unknown
+        """
+        key = (path, tuple(sorted(query.items())))
+        body = self._bodies.get(key)
+        if body is None:
+            response = self.route(path, query)
+            if response is None:
+                return None
+            body = json.dumps(response).encode('utf-8')
+            self._bodies[key] = body
+        return body
+
+    def route(self, path: str, query: typing.Dict[str, str]):
+        """
+        :param path: The path of a GET request
+        :param query: The query parameters of the request
+        :return: the json response, or None if the path is unknown
+        """
+        def since(objects):
+            updated_since = query.get('updated_since')
+            if not updated_since:
+                return objects
+            updated_since = updated_since.replace(' ', 'T')
+            return [obj for obj in objects
+                    if obj['updated_at'] > updated_since]
+
+        def spent(objects, field='spent_at'):
+            start = query.get('from', '00000000')
+            end = query.get('to', '99999999')
+            return [obj for obj in objects
+                    if start <= obj[field].replace('-', '') <= end]
+
+        def wrap(key, objects):
+            return [{key: obj} for obj in objects]
+
+        if path == '/account/who_am_i':
+            return self.who_am_i()
+        if path == '/people':
+            return wrap('user', since(self.users))
+        if path == '/tasks':
+            return wrap('task', since(self.tasks))
+        if path == '/clients':
+            return wrap('client', since(self.clients))
+        if path == '/projects':
+            return wrap('project', since(self.projects))
+        if path == '/expense_categories':
+            return wrap('expense_category', self.expense_categories)
+        if path == '/invoices':
+            invoices = since(spent(self.invoices, 'issued_at'))
+            if 'page' in query:
+                start = (int(query['page']) - 1) * INVOICES_PAGE_SIZE
+                invoices = invoices[start:start + INVOICES_PAGE_SIZE]
+            return wrap('invoice', invoices)
+        match = _PROJECT_PATH.match(path)
+        if match:
+            project_id, what = int(match.group(1)), match.group(2)
+            if what == 'entries':
+                return wrap('day_entry', since(spent(
+                        self._entries_by_project.get(project_id, []))))
+            if what == 'task_assignments':
+                return wrap('task_assignment', since(
+                        [assignment for assignment in self.task_assignments
+                         if assignment['project_id'] == project_id]))
+            return wrap('expense', self._expenses_by_project.get(project_id,
+                                                                 []))
+        match = _USER_ENTRIES_PATH.match(path)
+        if match:
+            return wrap('day_entry', since(spent(
+                    self._entries_by_user.get(int(match.group(1)), []))))
+        return None
+
+
+class FakeHarvestAdapter(BaseAdapter):
+    """
+    Transport adapter answering GET requests from a FakeAccount
+    """
+
+    def __init__(self, account: FakeAccount, latency: float = 0.0):
+        """
+        :param account: The account to answer from
+        :param latency: The number of seconds each request takes, to simulate
+        the network
+        """
+        super().__init__()
+        self.account = account
+        self.latency = latency
+
+    def send(self, request, **kwargs):
+        url = urlparse(request.url)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self.account.requests.append((url.path, query))
+        if self.latency:
+            time.sleep(self.latency)
+        body = self.account.body(url.path, query) \
+            if request.method == 'GET' else None
+
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.encoding = 'utf-8'
+        response.headers['Content-Type'] = 'application/json'
+        if body is None:
+            response.status_code = 404
+            body = b'{"error": "not found"}'
+        else:
+            response.status_code = 200
+        response.raw = io.BytesIO(body)
+        return response
+
+    def close(self):
+        pass
+
+
+def mount(hrvst: Harvest, account: FakeAccount, latency: float = 0.0,
+          rate_limited: bool = False) -> Harvest:
+    """
+    Make a Harvest client talk to the account instead of the network
+
+    :param hrvst: The client
+    :param account: The account
+    :param latency: The simulated duration of each request
+    :param rate_limited: If False, the rate limit of Harvest is lifted, so
+    the requests are only limited by the client itself
+    :return: the client
+    """
+    adapter = FakeHarvestAdapter(account, latency)
+    hrvst._session.mount('https://', adapter)
+    hrvst._session.mount('http://', adapter)
+    if not rate_limited:
+        hrvst.rate_limiter = RateLimiter(requests=10 ** 9, period=1)
+    return hrvst
+
+
+def fake_harvest(account: FakeAccount, latency: float = 0.0,
+                 rate_limited: bool = False, **kwargs) -> Harvest:
+    """
+    :param account: The account
+    :param latency: The simulated duration of each request
+    :param rate_limited: If False, the rate limit of Harvest is lifted
+    :param kwargs: The arguments of Harvest.basic, like records or memoize
+    :return: a Harvest client talking to the account
+    """
+    return mount(Harvest.basic(FAKE_URI, 'user0@example.com', 'password',
+                               **kwargs), account, latency, rate_limited)
@@ -0,0 +1,186 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from statsbiblioteket.harvest.synch.fetching import date_windows, \
+    fetch_project_data, ProjectRef, fetch_user_timesheets, \
+    choose_entries_strategy, may_have_records, project_timesheet_requests, \
+    user_timesheet_requests, ordered_parallel_map
+
+
+class WindowedHarvest(object):
+    """Answers the timesheet requests with the requested date window"""
+
+    def __init__(self):
+        self.windows = []
+
+    def get_all_tasks_from_project(self, project_id, updated_since=None):
+        return ['task of {id}'.format(id=project_id)]
+
+    def expenses_for_project(self, project_id):
+        return []
+
+    def timesheets_for_project(self, project_id, start_date, end_date,
+                               updated_since=None):
+        self.windows.append((project_id, start_date, end_date))
+        return [(project_id, start_date)]
+
+    def timesheets_for_user(self, user_id, start_date, end_date,
+                            updated_since=None):
+        self.windows.append(('user', user_id, start_date, end_date))
+        return [(user_id, start_date)]
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    """Counts the submitted calls"""
+
+    def __init__(self, max_workers):
+        super(CountingExecutor, self).__init__(max_workers=max_workers)
+        self.submitted = 0
+
+    def submit(self, *args, **kwargs):
+        self.submitted += 1
+        return super(CountingExecutor, self).submit(*args, **kwargs)
+
+
+class TestFetching(object):
+
+    def test_parallel_map_keeps_the_order(self):
+        def slow_for_small(item):
+            # The first items finish last
+            time.sleep(0.01 * (5 - item))
+            return item * 10
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            results = list(ordered_parallel_map(executor, slow_for_small,
+                                                range(5), window=5))
+        assert results == [0, 10, 20, 30, 40]
+
+    def test_parallel_map_limits_the_calls_ahead(self):
+        with CountingExecutor(max_workers=2) as executor:
+            results = ordered_parallel_map(executor, lambda item: item,
+                                           range(100), window=3)
+            assert next(results) == 0
+            assert executor.submitted == 3
+            assert next(results) == 1
+            assert executor.submitted == 4
+            results.close()
+
+    def test_parallel_map_cancels_the_rest_when_closed(self):
+        started = []
+        release = threading.Event()
+
+        def blocking(item):
+            started.append(item)
+            if item == 1:
+                release.wait(5)
+            return item
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            results = ordered_parallel_map(executor, blocking, range(10),
+                                           window=4)
+            assert next(results) == 0
+            results.close()
+            release.set()
+        # The calls that had not started are cancelled, and the remaining
+        # items are never submitted
+        assert started in ([0], [0, 1])
+
+    def test_windows_are_calendar_aligned(self):
+        assert date_windows('2016-01-15', '2016-03-10', 'month') == [
+            ('2016-01-15', '2016-01-31'), ('2016-02-01', '2016-02-29'),
+            ('2016-03-01', '2016-03-10')]
+        assert date_windows('2016-01-15', '2016-03-10') == [
+            ('2016-01-15', '2016-03-10')]
+
+    def test_windows_outside_the_hints_are_merged(self):
+        windows = date_windows('1970-01-01', '2020-12-31', 'quarter',
+                               earliest='2016-02-10', latest='2016-08-01')
+        assert windows == [('1970-01-01', '2016-03-31'),
+                           ('2016-04-01', '2016-06-30'),
+                           ('2016-07-01', '2020-12-31')]
+        # No records in the interval according to the hints
+        assert date_windows('2016-01-01', '2016-12-31', 'month',
+                            earliest='2017-05-01') == [('2016-01-01',
+                                                        '2016-12-31')]
+
+    def test_windows_are_merged_per_project(self):
+        hrvst = WindowedHarvest()
+        projects = [ProjectRef(1, 'one', None, None),
+                    ProjectRef(2, 'two', '2016-02-01', '2016-02-01')]
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            fetched = list(fetch_project_data(
+                    hrvst, projects, '2016-01-01', '2016-03-31',
+                    backup_expenses=True, executor=executor, window=4,
+                    date_window='month'))
+
+        assert [data.project_id for data in fetched] == [1, 2]
+        assert fetched[0].task_assignments == ['task of 1']
+        assert fetched[0].timesheets == [(1, '2016-01-01'),
+                                         (1, '2016-02-01'),
+                                         (1, '2016-03-01')]
+        assert fetched[1].timesheets == [(2, '2016-01-01')]
+        assert (2, '2016-01-01', '2016-03-31') in hrvst.windows
+
+    def test_projects_without_records_in_the_interval(self):
+        assert may_have_records(ProjectRef(1, 'one', None, None),
+                                '2016-01-01', '2016-12-31')
+        assert may_have_records(
+                ProjectRef(2, 'two', '2015-06-01T10:00:00Z',
+                           '2016-01-01T08:00:00Z'), '2016-01-01', '2016-12-31')
+        assert not may_have_records(
+                ProjectRef(3, 'three', '2014-01-01', '2015-12-31'),
+                '2016-01-01', '2016-12-31')
+        assert not may_have_records(
+                ProjectRef(4, 'four', '2017-01-01', '2017-02-01'),
+                '2016-01-01', '2016-12-31')
+
+    def test_skipped_timesheets(self):
+        hrvst = WindowedHarvest()
+        projects = [ProjectRef(1, 'one', None, None),
+                    ProjectRef(2, 'two', '2014-01-01', '2014-02-01')]
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            fetched = list(fetch_project_data(
+                    hrvst, projects, '2016-01-01', '2016-03-31',
+                    backup_expenses=True, executor=executor, window=4,
+                    date_window='month', skip_timesheets={2}))
+
+        assert fetched[1].task_assignments == ['task of 2']
+        assert fetched[1].timesheets == []
+        assert [window for window in hrvst.windows if window[0] == 2] == []
+        assert len(fetched[0].timesheets) == 3
+
+    def test_timesheets_per_user(self):
+        hrvst = WindowedHarvest()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            fetched = list(fetch_user_timesheets(
+                    hrvst, [7, 8], '2016-01-01', '2016-12-31',
+                    executor=executor, window=4, date_window='quarter',
+                    earliest='2016-05-01', latest='2016-06-01'))
+
+        assert fetched == [(7, [(7, '2016-01-01')]), (8, [(8, '2016-01-01')])]
+        assert ('user', 8, '2016-01-01', '2016-12-31') in hrvst.windows
+
+    def test_strategy_with_fewest_requests(self):
+        assert choose_entries_strategy('auto', user_requests=5,
+                                       project_requests=200) == 'user'
+        assert choose_entries_strategy('auto', user_requests=50,
+                                       project_requests=20) == 'project'
+        assert choose_entries_strategy('project', user_requests=5,
+                                       project_requests=200) == 'project'
+
+    def test_timesheet_requests(self):
+        projects = [ProjectRef(1, 'one', None, None),
+                    ProjectRef(2, 'two', '2016-02-01', '2016-02-01'),
+                    ProjectRef(3, 'three', '2014-01-01', '2014-02-01')]
+        # Three months for the first, one for the others
+        assert project_timesheet_requests(projects, '2016-01-01',
+                                          '2016-03-31', 'month') == 5
+        assert project_timesheet_requests(projects, '2016-01-01',
+                                          '2016-03-31', 'month',
+                                          skip_timesheets={3}) == 4
+        assert user_timesheet_requests(4, '2016-01-01', '2016-12-31',
+                                       'quarter') == 16
+        assert user_timesheet_requests(4, '2016-01-01', '2016-12-31',
+                                       'quarter', earliest='2016-05-01',
+                                       latest='2016-06-01') == 4
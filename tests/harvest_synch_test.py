@@ -0,0 +1,350 @@
+import datetime
+import sys
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from statsbiblioteket.harvest import Harvest
+from statsbiblioteket.harvest.synch import harvest_export, harvest_synch
+from statsbiblioteket.harvest.synch.bulk_upsert import bulk_upsert
+from statsbiblioteket.harvest.synch.profiling import PhaseProfiler
+from statsbiblioteket.harvest.typesystem.harvest_types import DayEntry, \
+    HarvestDBType, Project, TaskAssignment
+from tests.fake_harvest import FakeAccount, mount, FAKE_URI
+
+
+@pytest.fixture()
+def account(monkeypatch):
+    """A fake account, which the backups talk to"""
+    account = FakeAccount(users=3, projects=12, entries=300)
+    basic = Harvest.basic
+
+    def fake(*args, **kwargs):
+        return mount(basic(*args, **kwargs), account)
+
+    monkeypatch.setattr(Harvest, 'basic', fake)
+    return account
+
+
+@pytest.fixture()
+def database(tmpdir):
+    return 'sqlite:///' + str(tmpdir.join('backup.db'))
+
+
+def synch_session(monkeypatch, foreign_keys=False):
+    """
+    Set the session of harvest_synch, with transaction_now set to LATER, and
+    a new profiler
+
+    :param foreign_keys: If True, SQLite enforces the foreign keys
+    :return: the session
+    """
+    engine = create_engine('sqlite://')
+    if foreign_keys:
+        @event.listens_for(engine, 'connect')
+        def enforce_foreign_keys(connection, record):
+            connection.execute('PRAGMA foreign_keys=ON')
+
+    HarvestDBType.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    monkeypatch.setattr(harvest_synch, 'session', session, raising=False)
+    monkeypatch.setattr(harvest_synch, 'transaction_now', LATER,
+                        raising=False)
+    monkeypatch.setattr(harvest_synch, 'profiler', PhaseProfiler())
+    return session
+
+
+@pytest.fixture()
+def session(monkeypatch):
+    session = synch_session(monkeypatch)
+    yield session
+    session.close()
+
+
+@pytest.fixture()
+def fk_session(monkeypatch):
+    """A session of harvest_synch that enforces the foreign keys"""
+    session = synch_session(monkeypatch, foreign_keys=True)
+    yield session
+    session.close()
+
+
+NOW = datetime.datetime(2017, 1, 1)
+LATER = datetime.datetime(2017, 1, 2)
+
+
+def run_backup(database, *extra):
+    args = harvest_synch.create_parser().parse_args(
+            ['--domain', FAKE_URI, '--sql', database,
+             '--from', '2016-01-01', '--to', '2016-12-31'] + list(extra))
+    harvest_synch.backup(args, 'user', 'pass')
+
+
+def count(database, table):
+    return create_engine(database).scalar(
+            'select count(*) from {table}'.format(table=table))
+
+
+class TestBackup(object):
+
+    def test_projects_are_fetched_concurrently(self, account, database):
+        run_backup(database, '--workers', '4', '--entriesStrategy', 'project',
+                   '--window', 'quarter')
+
+        assert count(database, 'projects') == len(account.projects)
+        assert count(database, 'task_assignments') == \
+            len(account.task_assignments)
+        assert count(database, 'day_entries') == len(account.entries)
+
+    def test_the_pool_has_a_connection_per_worker(self, account, database,
+                                                  monkeypatch):
+        settings = []
+        basic = Harvest.basic
+
+        def recording(*args, **kwargs):
+            settings.append(kwargs.get('pool_maxsize'))
+            return basic(*args, **kwargs)
+
+        monkeypatch.setattr(Harvest, 'basic', recording)
+        run_backup(database, '--workers', '16')
+        run_backup(database, '--workers', '2')
+
+        assert settings == [16, 10]
+
+    def test_incremental_backup_fetches_the_changes(self, account,
+                                                    database):
+        run_backup(database, '--entriesStrategy', 'project')
+        account.change_entries(5, updated_at='2017-01-05T10:00:00Z')
+        del account.requests[:]
+
+        run_backup(database, '--incremental', '--entriesStrategy', 'project')
+
+        queries = {path: query for path, query in account.requests}
+        assert 'updated_since' in queries['/people']
+        assert 'updated_since' in queries['/projects']
+        entries = [query for path, query in account.requests
+                   if path.endswith('/entries')]
+        assert entries
+        assert all(query['updated_since'] == entries[0]['updated_since']
+                   for query in entries)
+        assert entries[0]['updated_since'] < '2017-01-05'
+        # The changed timesheets are versioned, and nothing is archived
+        assert count(database, 'day_entries') == len(account.entries)
+        assert count(database, 'day_entries_history') == 5
+        hours = create_engine(database).execute(
+                'select hours from day_entries order by id limit 5')
+        assert [row.hours for row in hours] == \
+            [entry['hours'] for entry in account.entries[:5]]
+
+        # The high water mark has moved past the changes
+        del account.requests[:]
+        run_backup(database, '--incremental', '--entriesStrategy', 'project')
+        entries = [query for path, query in account.requests
+                   if path.endswith('/entries')]
+        assert entries[0]['updated_since'] == '2017-01-05 10:00'
+
+    def test_pruned_projects_keep_their_timesheets(self, account, database):
+        run_backup(database, '--entriesStrategy', 'project')
+        # Hints claiming that the first project has no records in 2016
+        account.set_hints(1, '2015-01-01', '2015-12-31')
+        del account.requests[:]
+        # As if the first backup was a while ago, as the database clock may
+        # only count seconds
+        create_engine(database).execute(
+                "update day_entries set _updated_on = '2016-12-31 00:00:00'")
+
+        run_backup(database, '--entriesStrategy', 'project',
+                   '--pruneProjects')
+
+        pruned = '/projects/{id}/entries'.format(id=account.projects[0]['id'])
+        assert pruned not in [path for path, query in account.requests]
+        assert count(database, 'day_entries') == len(account.entries)
+        assert count(database, 'day_entries_history') == 0
+
+    def test_resume_uses_the_resolved_strategy(self, account, database,
+                                               monkeypatch):
+        upsert = harvest_synch.upsert
+        day_entry_upserts = []
+
+        def failing_upsert(cls, harvest_objects):
+            if cls.__name__ == 'DayEntry':
+                day_entry_upserts.append(len(harvest_objects))
+                if len(day_entry_upserts) == 2:
+                    raise RuntimeError('Connection lost')
+            return upsert(cls, harvest_objects)
+
+        # Fewer users than projects, so auto fetches the timesheets per user,
+        # and the backup fails after the first user
+        monkeypatch.setattr(harvest_synch, 'upsert', failing_upsert)
+        with pytest.raises(RuntimeError):
+            run_backup(database, '--checkpoint')
+        assert 0 < count(database, 'day_entries') < len(account.entries)
+
+        # The account changed, so auto now prefers the projects
+        monkeypatch.setattr(harvest_synch, 'upsert', upsert)
+        monkeypatch.setattr(harvest_synch, 'choose_entries_strategy',
+                            lambda *args, **kwargs: 'project')
+        run_backup(database, '--resume')
+
+        assert count(database, 'day_entries') == len(account.entries)
+        assert count(database, 'day_entries_history') == 0
+
+    def test_resume_with_another_strategy_fails(self, account, database,
+                                                monkeypatch):
+        def failing_upsert(cls, harvest_objects):
+            raise RuntimeError('Connection lost')
+
+        upsert = harvest_synch.upsert
+        monkeypatch.setattr(harvest_synch, 'upsert', failing_upsert)
+        with pytest.raises(RuntimeError):
+            run_backup(database, '--checkpoint', '--entriesStrategy', 'user')
+        monkeypatch.setattr(harvest_synch, 'upsert', upsert)
+
+        with pytest.raises(ValueError):
+            run_backup(database, '--resume', '--entriesStrategy', 'project')
+
+    def test_failing_report_keeps_the_error_of_the_backup(
+            self, account, database, monkeypatch, tmpdir):
+        def failing_upsert(cls, harvest_objects):
+            raise RuntimeError('Connection lost')
+
+        monkeypatch.setattr(harvest_synch, 'upsert', failing_upsert)
+        profile = str(tmpdir.join('missing', 'profile.json'))
+        with pytest.raises(RuntimeError):
+            run_backup(database, '--profile', profile)
+
+    def test_failing_report_of_a_backup(self, account, database, tmpdir):
+        profile = str(tmpdir.join('missing', 'profile.json'))
+        with pytest.raises(OSError):
+            run_backup(database, '--profile', profile)
+        assert count(database, 'day_entries') == len(account.entries)
+
+
+class TestArchive(object):
+
+    def store_day_entries(self, session, project_ids=None):
+        """
+        Store a day entry for each month of 2016, of which the first two are
+        touched by the backup of LATER
+
+        :param project_ids: The project id of some of the day entries, by id
+        """
+        project_ids = project_ids or {}
+        day_entries = [DayEntry(id=month, hours=1.0, notes='Notes',
+                                spent_at='2016-{:02d}-15'.format(month),
+                                project_id=project_ids.get(month))
+                       for month in range(1, 13)]
+        bulk_upsert(session, DayEntry, day_entries, NOW)
+        bulk_upsert(session, DayEntry, day_entries[:2], LATER)
+
+    def test_timesheets_outside_the_interval_are_marked(self, session):
+        self.store_day_entries(session)
+
+        harvest_synch.mark_timesheets_as_updated(DayEntry, '2016-01-01',
+                                                 '2016-06-30')
+
+        touched = session.query(DayEntry.id).filter(
+                DayEntry._updated_on == LATER).order_by(DayEntry.id)
+        assert [id_ for id_, in touched] == [1, 2, 7, 8, 9, 10, 11, 12]
+
+    def test_timesheets_of_the_given_projects_are_marked(self, session,
+                                                         monkeypatch):
+        self.store_day_entries(session, project_ids={3: 7, 4: 7, 8: 7, 9: 8})
+        monkeypatch.setattr(harvest_synch, 'MARK_CHUNK_SIZE', 1)
+
+        harvest_synch.mark_timesheets_as_updated(DayEntry, '2016-01-01',
+                                                 '2016-12-31',
+                                                 project_ids=[7, 9])
+
+        touched = session.query(DayEntry.id).filter(
+                DayEntry._updated_on == LATER).order_by(DayEntry.id)
+        assert [id_ for id_, in touched] == [1, 2, 3, 4, 8]
+
+    def test_untouched_rows_are_archived(self, session):
+        self.store_day_entries(session)
+        harvest_synch.mark_timesheets_as_updated(DayEntry, '2016-01-01',
+                                                 '2016-06-30')
+
+        harvest_synch.archive_untouched_rows(DayEntry)
+
+        assert [day_entry.id for day_entry in session.query(DayEntry).order_by(
+                DayEntry.id)] == [1, 2, 7, 8, 9, 10, 11, 12]
+        history = DayEntry.__history_mapper__.local_table
+        archived = session.execute(
+                history.select().order_by(history.c.id)).fetchall()
+        assert [(row.id, row.spent_at, row.version) for row in archived] == \
+            [(month, '2016-{:02d}-15'.format(month), 1)
+             for month in range(3, 7)]
+        assert None not in [row.changed for row in archived]
+        assert harvest_synch.profiler.phases[
+            'archive.day_entries'].objects == 4
+
+    def store_project_with_children(self, session):
+        """
+        Store project 1, and project 2 with a task assignment and a day
+        entry, of which only project 1 is touched by the backup of LATER
+        """
+        projects = [Project(id=1, name='Kept'), Project(id=2, name='Gone')]
+        bulk_upsert(session, Project, projects, NOW)
+        bulk_upsert(session, TaskAssignment,
+                    [TaskAssignment(id=10, project_id=2)], NOW)
+        bulk_upsert(session, DayEntry,
+                    [DayEntry(id=20, project_id=2, hours=1.0,
+                              spent_at='2016-01-15')], NOW)
+        bulk_upsert(session, Project, projects[:1], LATER)
+
+    def test_referring_rows_are_archived_first(self, fk_session):
+        self.store_project_with_children(fk_session)
+
+        harvest_synch.archive_untouched_tables(backup_invoices=False)
+
+        assert [project.id for project in fk_session.query(Project)] == [1]
+        assert fk_session.query(TaskAssignment).count() == 0
+        assert fk_session.query(DayEntry).count() == 0
+        for cls in (Project, TaskAssignment, DayEntry):
+            history = cls.__history_mapper__.local_table
+            assert fk_session.execute(history.count()).scalar() == 1
+
+    def test_referred_rows_are_kept(self, fk_session):
+        self.store_project_with_children(fk_session)
+        # The day entry is outside the interval of the backup
+        bulk_upsert(fk_session, DayEntry,
+                    [DayEntry(id=20, project_id=2, hours=1.0,
+                              spent_at='2016-01-15')], LATER)
+
+        harvest_synch.archive_untouched_tables(backup_invoices=False)
+
+        assert [project.id for project in fk_session.query(
+                Project).order_by(Project.id)] == [1, 2]
+        assert fk_session.query(TaskAssignment).count() == 0
+        assert fk_session.query(DayEntry).count() == 1
+
+
+class TestParser(object):
+
+    def test_backup_options(self):
+        args = harvest_synch.create_parser().parse_args(
+                ['--domain', FAKE_URI, '--workers', '8'])
+        assert args.command is None
+        assert (args.harvestDomain, args.workers) == (FAKE_URI, 8)
+
+    def test_export_subcommand(self, monkeypatch, tmpdir):
+        exports = []
+        monkeypatch.setattr(harvest_export, 'run_export',
+                            lambda parser, args: exports.append(args))
+        monkeypatch.setattr(sys, 'argv',
+                            ['harvest', 'export', '--domain', FAKE_URI,
+                             '--out', str(tmpdir), '--tables', 'invoices'])
+
+        harvest_synch.main()
+
+        [args] = exports
+        assert args.command == 'export'
+        assert (args.harvestDomain, args.outDir, args.tables) == \
+            (FAKE_URI, str(tmpdir), ['invoices'])
+
+    def test_backup_needs_a_domain(self, monkeypatch):
+        monkeypatch.setattr(sys, 'argv', ['harvest', '--workers', '8'])
+        with pytest.raises(SystemExit):
+            harvest_synch.main()
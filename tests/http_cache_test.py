@@ -0,0 +1,75 @@
+import io
+
+import requests
+from requests.adapters import BaseAdapter
+
+from statsbiblioteket.harvest import Harvest, User
+
+USERS = b'[{"user": {"id": 1, "email": "user@example.com"}}]'
+
+
+class ConditionalAdapter(BaseAdapter):
+    """Serves USERS with an ETag, and 304 to requests with that ETag"""
+
+    def __init__(self):
+        super().__init__()
+        self.statuses = []
+
+    def send(self, request, **kwargs):
+        resp = requests.Response()
+        resp.request = request
+        resp.url = request.url
+        resp.headers['ETag'] = '"v1"'
+        if request.headers.get('If-None-Match') == '"v1"':
+            resp.status_code = 304
+            resp.raw = io.BytesIO(b'')
+        else:
+            resp.status_code = 200
+            resp.raw = io.BytesIO(USERS)
+        self.statuses.append(resp.status_code)
+        return resp
+
+    def close(self):
+        pass
+
+
+class TestHttpCache(object):
+
+    def harvest(self, cache_dir, adapter, user='user'):
+        harvest = Harvest.basic('https://example.harvestapp.com', user,
+                                'password', cache_dir=cache_dir)
+        harvest._session.mount('https://', adapter)
+        return harvest
+
+    def test_not_modified_uses_cache(self, tmpdir):
+        adapter = ConditionalAdapter()
+
+        first = self.harvest(str(tmpdir), adapter).users()
+        # A new client, as in the next run
+        second = self.harvest(str(tmpdir), adapter).users()
+
+        assert adapter.statuses == [200, 304]
+        assert first == second
+        assert isinstance(second[0], User)
+
+    def test_users_do_not_share_responses(self, tmpdir):
+        adapter = ConditionalAdapter()
+
+        self.harvest(str(tmpdir), adapter).users()
+        self.harvest(str(tmpdir), adapter, user='other').users()
+        self.harvest(str(tmpdir), adapter, user='other').users()
+
+        # The other user's first request is not conditional
+        assert adapter.statuses == [200, 200, 304]
+        assert len(tmpdir.listdir()) == 2
+
+    def test_without_cache_dir(self):
+        adapter = ConditionalAdapter()
+        harvest = Harvest.basic('https://example.harvestapp.com', 'user',
+                                'password')
+        harvest._session.mount('https://', adapter)
+
+        harvest.users()
+        harvest.users()
+
+        assert adapter.statuses == [200, 200]
@@ -0,0 +1,64 @@
+from statsbiblioteket.harvest import Harvest
+from statsbiblioteket.harvest.memo import MemoCache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CountingHarvest(Harvest):
+    """Answers get_project without http, counting the calls"""
+
+    def _request(self, method='GET', path='/', data=None, params=None):
+        self.calls.append((method, path))
+        return {'path': path}
+
+
+def create_harvest(**kwargs):
+    harvest = CountingHarvest.basic('https://example.harvestapp.com', 'user',
+                                    'password', **kwargs)
+    harvest.calls = []
+    return harvest
+
+
+class TestMemo(object):
+
+    def test_ttl_and_lru(self):
+        clock = FakeClock()
+        cache = MemoCache(ttl=10, max_size=2, clock=clock)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        assert cache.get('a') == (True, 1)
+        cache.put('c', 3)  # evicts b, the least recently used
+        assert cache.get('b') == (False, None)
+        clock.now = 11
+        assert cache.get('a') == (False, None)
+        assert (cache.hits, cache.misses) == (1, 2)
+
+    def test_lookups_are_memoized(self):
+        harvest = create_harvest(memoize=True)
+        assert harvest.get_project(1) == harvest.get_project('1')
+        harvest.get_project(2)
+        assert len(harvest.calls) == 2
+        assert harvest.memo_stats()['project'] == {'hits': 1, 'misses': 2,
+                                                   'size': 2}
+
+    def test_changes_invalidate(self):
+        harvest = create_harvest(memoize=True)
+        harvest.get_project(1)
+        harvest.toggle_project_active(1)
+        harvest.get_project(1)
+        assert harvest.calls == [('GET', '/projects/1'),
+                                 ('PUT', '/projects/1/toggle'),
+                                 ('GET', '/projects/1')]
+
+    def test_disabled_by_default(self):
+        harvest = create_harvest()
+        harvest.get_user(1)
+        harvest.get_user(1)
+        assert len(harvest.calls) == 2
+        assert harvest.memo_stats() == {}
@@ -0,0 +1,81 @@
+import io
+
+import requests
+from requests.adapters import BaseAdapter
+
+from statsbiblioteket.harvest import Harvest
+from statsbiblioteket.harvest import rest
+from statsbiblioteket.harvest.metrics import endpoint_template, \
+    InMemoryMetrics, prometheus_text, statsd_lines, REQUEST_SECONDS, \
+    RESPONSE_BYTES, RESPONSES, RETRIES
+
+
+class JsonAdapter(BaseAdapter):
+    """Answers 503 to the first request and the json body to the rest"""
+
+    def __init__(self, body):
+        super().__init__()
+        self.body = body
+        self.sent = 0
+
+    def send(self, request, **kwargs):
+        self.sent += 1
+        resp = requests.Response()
+        resp.request = request
+        resp.url = request.url
+        resp.status_code = 503 if self.sent == 1 else 200
+        resp.raw = io.BytesIO(self.body)
+        return resp
+
+    def close(self):
+        pass
+
+
+class TestMetrics(object):
+
+    def test_endpoint_template(self):
+        assert endpoint_template('/projects/123/entries?from=20160101') == \
+            '/projects/{id}/entries'
+        assert endpoint_template('/people/42') == '/people/{id}'
+        assert endpoint_template('/account/who_am_i') == '/account/who_am_i'
+
+    def test_histogram(self):
+        metrics = InMemoryMetrics()
+        for value in (0.02, 0.02, 0.3, 4):
+            metrics.observe(REQUEST_SECONDS, value, endpoint='/people')
+        histogram = metrics.histogram(REQUEST_SECONDS, endpoint='/people')
+        assert histogram.count == 4
+        assert histogram.quantile(0.5) == 0.05
+        assert histogram.quantile(1) == 4
+
+    def test_exporters(self):
+        metrics = InMemoryMetrics()
+        metrics.observe(REQUEST_SECONDS, 0.2, endpoint='/people')
+        metrics.increment(RESPONSES, endpoint='/people', status='200')
+
+        text = prometheus_text(metrics)
+        assert '# TYPE harvest_request_seconds histogram' in text
+        assert 'harvest_request_seconds_bucket{endpoint="/people",' \
+               'le="0.25"} 1' in text
+        assert 'harvest_responses_total{endpoint="/people",status="200"} 1' \
+               in text
+        assert statsd_lines(metrics) == [
+            'harvest.harvest_request_seconds.people:200.000|ms',
+            'harvest.harvest_responses_total.people.200:1|c']
+
+    def test_requests_are_recorded(self, monkeypatch):
+        monkeypatch.setattr(rest.time, 'sleep', lambda seconds: None)
+        harvest = Harvest.basic('https://example.harvestapp.com', 'user',
+                                'password')
+        harvest._session.mount('https://', JsonAdapter(b'[]'))
+
+        assert harvest.timesheets_for_project(7, '2016-01-01',
+                                              '2016-12-31') == []
+
+        metrics = harvest.metrics
+        endpoint = '/projects/{id}/entries'
+        assert metrics.counter(RETRIES, endpoint=endpoint) == 1
+        assert metrics.counter(RESPONSES, endpoint=endpoint,
+                               status='503') == 1
+        assert metrics.histogram(RESPONSE_BYTES, endpoint=endpoint).sum == 2
+        assert endpoint in metrics.summary()
@@ -0,0 +1,95 @@
+import json
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from statsbiblioteket.harvest.synch.profiling import PhaseProfiler, \
+    profiled_versioned_session
+from statsbiblioteket.harvest.typesystem.harvest_types import Client, \
+    HarvestDBType
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestPhaseProfiler(object):
+
+    def test_phases_accumulate(self):
+        clock = FakeClock()
+        profiler = PhaseProfiler(clock=clock)
+        for _ in range(2):
+            with profiler.phase('upsert.day_entries', objects=10):
+                clock.now += 1.5
+        with profiler.phase('fetch.users') as phase:
+            clock.now += 0.5
+            phase.objects = 3
+
+        report = profiler.report(run='test')
+        assert report['run'] == 'test'
+        assert report['total_seconds'] == 3.5
+        assert report['phases'] == [
+            {'name': 'upsert.day_entries', 'calls': 2, 'seconds': 3.0,
+             'objects': 20},
+            {'name': 'fetch.users', 'calls': 1, 'seconds': 0.5,
+             'objects': 3}]
+
+    def test_failed_phase_is_timed(self):
+        clock = FakeClock()
+        profiler = PhaseProfiler(clock=clock)
+        try:
+            with profiler.phase('commit'):
+                clock.now += 2
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        assert profiler.phases['commit'].seconds == 2
+
+    def test_iterate_times_the_wait(self):
+        clock = FakeClock()
+        profiler = PhaseProfiler(clock=clock)
+
+        def slow_items():
+            for item in 'abc':
+                clock.now += 1
+                yield item
+
+        consumed = []
+        for item in profiler.iterate('fetch.project_data', slow_items()):
+            clock.now += 10  # The work of the consumer is not counted
+            consumed.append(item)
+
+        assert consumed == ['a', 'b', 'c']
+        stats = profiler.phases['fetch.project_data']
+        assert stats.seconds == 3
+        assert stats.objects == 3
+
+    def test_write(self, tmpdir):
+        profiler = PhaseProfiler()
+        profiler.add('flush', 0.25)
+        report_file = tmpdir.join('profile.json')
+        profiler.write(str(report_file), endpoints={})
+        report = json.loads(report_file.read())
+        assert report['phases'][0]['name'] == 'flush'
+        assert report['endpoints'] == {}
+
+    def test_history_phase(self):
+        engine = create_engine('sqlite://')
+        HarvestDBType.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        profiler = PhaseProfiler()
+        profiled_versioned_session(session, profiler)
+
+        session.add(Client(id=1, name='Old name'))
+        session.commit()
+        client = session.query(Client).one()
+        client.name = 'New name'
+        session.commit()
+
+        assert profiler.phases['history'].calls == 2
+        assert profiler.phases['history'].objects == 1
+        session.close()
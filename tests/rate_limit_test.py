@@ -0,0 +1,103 @@
+import io
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+from statsbiblioteket.harvest import Harvest
+from statsbiblioteket.harvest import rest
+from statsbiblioteket.harvest.rest import RateLimiter
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ScriptedAdapter(BaseAdapter):
+    """Answers the requests with the given status codes, in order"""
+
+    def __init__(self, responses):
+        super().__init__()
+        self.responses = list(responses)
+        self.sent = 0
+
+    def send(self, request, **kwargs):
+        status_code, headers = self.responses.pop(0)
+        self.sent += 1
+        resp = requests.Response()
+        resp.request = request
+        resp.url = request.url
+        resp.status_code = status_code
+        resp.headers.update(headers)
+        resp.raw = io.BytesIO(b'[]')
+        return resp
+
+    def close(self):
+        pass
+
+
+class TestRateLimit(object):
+
+    def test_bucket_allows_burst_then_waits(self):
+        clock = FakeClock()
+        limiter = RateLimiter(requests=10, period=5, clock=clock)
+        assert [limiter.reserve() for _ in range(5)] == [0.0] * 5
+        # The bucket refills with the other 5 tokens in 5 seconds
+        assert limiter.reserve() == 1.0
+        assert limiter.reserve() == 2.0
+        clock.now = 1.0
+        assert limiter.reserve() == 2.0
+
+    @pytest.mark.parametrize('requests, period', [
+        (100, 15), (10, 5), (3, 10), (2, 1), (1, 1)])
+    def test_no_period_has_more_than_the_requests(self, requests, period):
+        clock = FakeClock()
+        limiter = RateLimiter(requests=requests, period=period, clock=clock)
+        # A greedy caller, sending each request as soon as it may
+        sent = []
+        for _ in range(10 * requests):
+            clock.now += limiter.reserve()
+            sent.append(clock.now)
+        # And callers queueing up at once
+        clock.now += 2 * period
+        start = clock.now
+        sent.extend(start + limiter.reserve() for _ in range(10 * requests))
+
+        for first in sent:
+            in_period = [time for time in sent
+                         if first <= time < first + period - 1e-9]
+            assert len(in_period) <= requests
+
+    def test_retry_after_pauses_all_requests(self):
+        clock = FakeClock()
+        limiter = RateLimiter(clock=clock)
+        assert limiter.retry_delay('GET', 429, {'Retry-After': '7'}, 0) == 7
+        assert limiter.reserve() == 7
+        clock.now = 7.0
+        assert limiter.reserve() == 0
+
+    def test_server_errors_are_retried_with_backoff(self):
+        limiter = RateLimiter(backoff=1, max_backoff=8, max_retries=5)
+        for attempt, cap in enumerate([1, 2, 4, 8, 8]):
+            delay = limiter.retry_delay('GET', 502, {}, attempt)
+            assert cap / 2 <= delay <= cap
+        assert limiter.retry_delay('GET', 502, {}, 5) is None
+        assert limiter.retry_delay('POST', 502, {}, 0) is None
+        assert limiter.retry_delay('GET', 404, {}, 0) is None
+
+    def test_requests_are_retried(self, monkeypatch):
+        sleeps = []
+        monkeypatch.setattr(rest.time, 'sleep', sleeps.append)
+        adapter = ScriptedAdapter([(429, {'Retry-After': '3'}), (503, {}),
+                                   (200, {})])
+        harvest = Harvest.basic('https://example.harvestapp.com', 'user',
+                                'password')
+        harvest._session.mount('https://', adapter)
+
+        assert harvest.users() == []
+        assert adapter.sent == 3
+        assert sleeps[0] == 3
@@ -0,0 +1,75 @@
+import json
+import tracemalloc
+
+from statsbiblioteket.harvest.typesystem import records
+from statsbiblioteket.harvest.typesystem.harvest_types import \
+    json_to_harvest, DayEntry
+from statsbiblioteket.harvest.typesystem.orm_types import TypeToJSON
+from statsbiblioteket.harvest.typesystem.records import json_to_record
+
+ENTRIES = 5000
+
+DAY_ENTRY = {'notes': 'Some notes.', 'spent_at': '2015-07-01', 'hours': 0.16,
+             'user_id': 508343, 'project_id': 3554414, 'task_id': 2086200,
+             'created_at': '2015-08-25T14:31:52Z',
+             'updated_at': '2015-08-25T14:47:02Z', 'is_closed': False}
+
+
+def timesheet_json():
+    return json.dumps([{'day_entry': dict(DAY_ENTRY, id=entry_id)}
+                       for entry_id in range(ENTRIES)])
+
+
+def measure(text, object_hook):
+    """
+    :return: the decoded text, and the memory allocated by decoding it
+    """
+    tracemalloc.start()
+    decoded = json.loads(text, object_hook=object_hook)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return decoded, size
+
+
+def encoded_values(harvest_object):
+    """
+    :return: the json encoded values of the object, without the ones that are
+    None, as the records encode the unset fields too
+    """
+    (_, values), = json.loads(json.dumps(harvest_object,
+                                         cls=TypeToJSON)).items()
+    return {key: value for key, value in values.items() if value is not None}
+
+
+class TestRecords(object):
+
+    def test_records_have_the_fields_of_the_harvest_types(self):
+        text = timesheet_json()
+        entry, = json.loads(text[:text.index('}}') + 2] + ']',
+                            object_hook=json_to_harvest)
+        record, = json.loads(text[:text.index('}}') + 2] + ']',
+                             object_hook=json_to_record)
+
+        assert isinstance(record, records.DayEntry)
+        assert record.notes == entry.notes
+        assert record.task_id == entry.task_id
+        assert record.hours_with_timer is None
+        assert json.loads(json.dumps(record, cls=TypeToJSON))['day_entry'][
+                   'hours'] == 0.16
+        assert record == records.DayEntry(**dict(DAY_ENTRY, id=0))
+
+    def test_unknown_fields_are_kept(self):
+        record = records.User(id=1, first_name='Harvest', hint_unknown=2)
+        assert record._extra == {'hint_unknown': 2}
+        assert str(record) == 'User: 1'
+
+    def test_records_decode_like_the_harvest_types(self):
+        text = timesheet_json()
+        harvest_objects, harvest_size = measure(text, json_to_harvest)
+        plain_records, record_size = measure(text, json_to_record)
+
+        assert isinstance(harvest_objects[0], DayEntry)
+        assert len(plain_records) == ENTRIES
+        assert [encoded_values(record) for record in plain_records] == \
+            [encoded_values(entry) for entry in harvest_objects]
+        assert record_size < harvest_size
@@ -0,0 +1,79 @@
+from requests.adapters import HTTPAdapter
+
+from statsbiblioteket.harvest import Harvest
+from statsbiblioteket.harvest import rest
+from statsbiblioteket.harvest.rest import IDEMPOTENT_METHODS
+from tests.rate_limit_test import ScriptedAdapter
+
+URI = 'https://example.harvestapp.com'
+
+
+class RecordingAdapter(ScriptedAdapter):
+    """Answers every request with an empty list, recording the timeouts"""
+
+    def __init__(self):
+        super().__init__([])
+        self.timeouts = []
+
+    def send(self, request, **kwargs):
+        self.timeouts.append(kwargs.get('timeout'))
+        self.responses.append((200, {}))
+        return super().send(request, **kwargs)
+
+
+class TestConnections(object):
+
+    def test_adapter_has_the_pool_and_retry_settings(self):
+        harvest = Harvest.basic(URI, 'user', 'password', pool_connections=4,
+                                pool_maxsize=32, max_retries=7)
+
+        for prefix in ('https://', 'http://'):
+            adapter = harvest._session.get_adapter(prefix + 'example.com')
+            assert isinstance(adapter, HTTPAdapter)
+            assert adapter._pool_connections == 4
+            assert adapter._pool_maxsize == 32
+            assert adapter.max_retries.total == 7
+            # Error responses are left to the rate limiter
+            assert adapter.max_retries.status == 0
+            assert adapter.max_retries.allowed_methods == IDEMPOTENT_METHODS
+
+    def test_default_settings(self):
+        harvest = Harvest.basic(URI, 'user', 'password')
+
+        adapter = harvest._session.get_adapter(URI)
+        assert adapter._pool_maxsize == 10
+        assert adapter.max_retries.total == 3
+        assert harvest.timeout == (10, 60)
+
+    def test_retries_with_old_urllib3(self, monkeypatch):
+        class OldRetry(rest.Retry):
+            """The Retry of urllib3 before 1.26"""
+
+            def __init__(self, method_whitelist=None, **kwargs):
+                if 'allowed_methods' in kwargs:
+                    raise TypeError('unexpected keyword argument')
+                super().__init__(allowed_methods=method_whitelist, **kwargs)
+                self.method_whitelist = method_whitelist
+
+        monkeypatch.setattr(rest, 'Retry', OldRetry)
+        harvest = Harvest.basic(URI, 'user', 'password', max_retries=2)
+
+        retry = harvest._session.get_adapter(URI).max_retries
+        assert retry.method_whitelist == IDEMPOTENT_METHODS
+        assert retry.total == 2
+
+    def test_requests_are_sent_with_the_timeout(self):
+        harvest = Harvest.basic(URI, 'user', 'password', timeout=(3, 30))
+        adapter = RecordingAdapter()
+        harvest._session.mount('https://', adapter)
+
+        assert harvest.users() == []
+        assert adapter.timeouts == [(3, 30)]
+
+    def test_oauth_clients_get_the_settings(self):
+        harvest = Harvest.oath(URI, 'client', {'access_token': 'token',
+                                               'token_type': 'Bearer'},
+                               pool_maxsize=20, timeout=5)
+
+        assert harvest._session.get_adapter(URI)._pool_maxsize == 20
+        assert harvest.timeout == 5
@@ -0,0 +1,48 @@
+import json
+import os
+
+import pytest
+
+from statsbiblioteket.harvest.streaming import JsonArrayDecoder, \
+    iter_json_array
+from statsbiblioteket.harvest.typesystem.harvest_types import Client, \
+    json_to_harvest
+
+curdir = os.path.dirname(os.path.realpath(__file__))
+
+
+def chunked(text, size):
+    return [text[start:start + size] for start in range(0, len(text), size)]
+
+
+class TestStreaming(object):
+
+    @pytest.mark.parametrize('size', [1, 2, 3, 7, 64, 100000])
+    def test_chunk_boundaries(self, size):
+        with open(curdir + '/client.json', 'r') as clientjson:
+            client, = json.load(clientjson)
+        text = json.dumps([client, 12.5, "a, ]", [1, [2]], client, 3])
+
+        expected = json.loads(text, object_hook=json_to_harvest)
+        streamed = list(iter_json_array(chunked(text, size),
+                                        object_hook=json_to_harvest))
+
+        assert streamed == expected
+        assert isinstance(streamed[0], Client)
+
+    def test_elements_are_returned_when_complete(self):
+        decoder = JsonArrayDecoder()
+        assert decoder.feed('[{"id": 1}, {"id"') == [{'id': 1}]
+        assert decoder.feed(': 2}, 1') == [{'id': 2}]
+        assert decoder.feed('0 ]') == [10]
+        assert decoder.close() == []
+
+    def test_empty_array(self):
+        assert list(iter_json_array([' [ ', ' ] '])) == []
+
+    def test_not_an_array(self):
+        assert list(iter_json_array(['{"a"', ': 1}'])) == [{'a': 1}]
+
+    def test_incomplete_array(self):
+        with pytest.raises(ValueError):
+            list(iter_json_array(['[{"id": 1}, ']))
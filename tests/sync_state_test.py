@@ -0,0 +1,67 @@
+from datetime import datetime
+
+import pytest
+import sqlalchemy
+from sqlalchemy.orm import sessionmaker
+
+from statsbiblioteket.harvest.synch.sync_state import start_checkpoint, \
+    get_checkpoint, set_last_project, clear_checkpoint, \
+    update_high_water_mark, promote_high_water_mark, get_high_water_mark, \
+    updated_since
+from statsbiblioteket.harvest.typesystem.harvest_types import DayEntry
+from statsbiblioteket.harvest.typesystem.orm_types import HarvestDBType
+
+
+@pytest.fixture
+def session():
+    engine = sqlalchemy.create_engine('sqlite://')
+    HarvestDBType.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+class TestSyncState(object):
+
+    def test_checkpoint_round_trip(self, session):
+        started = datetime(2017, 3, 1, 12, 30, 15, 250)
+        options = {'from': '2016-01-01', 'to': '2016-12-31',
+                   'incremental': False}
+        assert get_checkpoint(session) is None
+
+        start_checkpoint(session, started, options)
+        set_last_project(session, 42)
+
+        checkpoint = get_checkpoint(session)
+        assert checkpoint.transaction_now == started
+        assert checkpoint.options == options
+        assert checkpoint.last_project == 42
+
+        clear_checkpoint(session)
+        assert get_checkpoint(session) is None
+
+    def test_updated_since(self, session):
+        assert updated_since(session, DayEntry) is None
+        update_high_water_mark(session, DayEntry, [
+            DayEntry(id=1, updated_at='2017-01-05T10:42:13Z'),
+            DayEntry(id=2, updated_at=None),
+            DayEntry(id=3, updated_at='2016-12-01T08:00:00Z')])
+        assert updated_since(session, DayEntry) == '2017-01-05 10:42'
+
+        # The mark is never lowered
+        update_high_water_mark(session, DayEntry, [
+            DayEntry(id=3, updated_at='2016-01-01T00:00:00Z')])
+        assert updated_since(session, DayEntry) == '2017-01-05 10:42'
+
+    def test_pending_high_water_mark(self, session):
+        update_high_water_mark(session, DayEntry,
+                               [DayEntry(id=1, updated_at='2017-01-01')])
+        update_high_water_mark(session, DayEntry,
+                               [DayEntry(id=2, updated_at='2017-02-01')],
+                               pending=True)
+        # The pending mark only takes effect when the backup finishes
+        assert get_high_water_mark(session, DayEntry) == '2017-01-01'
+
+        promote_high_water_mark(session, DayEntry)
+        clear_checkpoint(session)
+        assert get_high_water_mark(session, DayEntry) == '2017-02-01'
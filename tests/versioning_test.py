@@ -0,0 +1,89 @@
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from statsbiblioteket.harvest.typesystem.harvest_types import Client, \
+    DayEntry, HarvestDBType
+from statsbiblioteket.harvest.typesystem.orm_types import versioned_session, \
+    history_plan, versioned_columns
+
+
+def make_session(batched):
+    engine = create_engine('sqlite://')
+    HarvestDBType.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    versioned_session(session, batched=batched)
+    return session
+
+
+def history(session, cls):
+    table = cls.__history_mapper__.local_table
+    return sorted(tuple(row[column.key] for column in table.c
+                        if column.key != 'changed')
+                  for row in session.execute(table.select()))
+
+
+def change_entries(session):
+    session.add_all([DayEntry(id=entry_id, hours=1.0, notes='note',
+                              spent_at='2016-01-01', project_id=1)
+                     for entry_id in range(10)])
+    session.add(Client(id=1, name='Client'))
+    session.commit()
+    for entry in session.query(DayEntry).filter(DayEntry.id < 5):
+        entry.hours += 1
+    session.query(Client).one().name = 'Renamed client'
+    session.commit()
+    session.query(DayEntry).get(0).notes = 'changed again'
+    session.query(DayEntry).get(1).notes = 'note'  # Not a change
+    session.delete(session.query(DayEntry).get(9))
+    session.commit()
+
+
+class TestBatchedVersioning(object):
+
+    @pytest.mark.parametrize('cls', [DayEntry, Client])
+    def test_same_history_as_per_object_versions(self, cls):
+        batched = make_session(batched=True)
+        per_object = make_session(batched=False)
+        change_entries(batched)
+        change_entries(per_object)
+
+        assert history(batched, cls) == history(per_object, cls)
+        assert [entry.version for entry in
+                batched.query(DayEntry).order_by(DayEntry.id)] == \
+            [3, 2, 2, 2, 2, 1, 1, 1, 1]
+
+    def test_one_insert_per_class(self):
+        session = make_session(batched=True)
+        session.add_all([DayEntry(id=entry_id, hours=1.0)
+                         for entry_id in range(100)])
+        session.commit()
+        for entry in session.query(DayEntry):
+            entry.hours = 2.0
+
+        inserts = []
+
+        @event.listens_for(session.bind, 'before_cursor_execute')
+        def count_inserts(conn, cursor, statement, parameters, context,
+                          executemany):
+            if statement.startswith('INSERT INTO day_entries_history'):
+                inserts.append(len(parameters) if executemany else 1)
+
+        session.commit()
+        assert inserts == [100]
+        assert len(history(session, DayEntry)) == 100
+
+
+class TestHistoryPlan(object):
+
+    def test_plan_of_the_versioned_columns(self):
+        plan = history_plan(DayEntry)
+        keys = [col_key for _, col_key in plan.columns]
+        assert 'id' in keys and 'hours' in keys
+        assert '_updated_on' not in keys
+        assert 'version' not in keys
+        assert versioned_columns(DayEntry) == list(plan.columns)
+
+        (table, table_keys), = plan.tables
+        assert table.name == 'day_entries_history'
+        assert table_keys == tuple(keys) + ('version',)